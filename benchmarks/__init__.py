@@ -0,0 +1,3 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
@@ -0,0 +1,301 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+'''Benchmarks AqiService against synthetic sensor and weather databases.
+
+Run from the top of the repository, e.g.
+
+    python -m benchmarks.bench --span-days 365 --cadence 60 --output results.json
+
+Three cases are measured for every standard:
+    service   AqiService.new_archive_record for the most recent archive records
+    backfill  replaying the end of the weather archive, as bin/aqi_backfill does
+    standard  calculate_aqi for each pollutant, and the composite, over an
+              in-memory window of observations
+
+Each case reports events per second and, unless disabled, the peak memory
+allocated by python while processing a sample of events.'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+
+import weewx
+
+import user.aqi.backfill
+import user.aqi.service
+import user.aqi.units
+
+from . import synthetic
+
+CASES = ['service', 'backfill', 'standard']
+
+clock = getattr(time, 'perf_counter', time.time)
+
+def _percentile(sorted_values, q):
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def _result(case, standard, durations, total_secs, peak_bytes):
+    durations = sorted(durations)
+    return {
+        'case': case,
+        'standard': standard,
+        'events': len(durations),
+        'seconds': total_secs,
+        'events_per_sec': (len(durations) / total_secs) if total_secs > 0 else None,
+        'mean_ms': (1000.0 * sum(durations) / len(durations)) if durations else None,
+        'p50_ms': 1000.0 * _percentile(durations, 0.50) if durations else None,
+        'p95_ms': 1000.0 * _percentile(durations, 0.95) if durations else None,
+        'max_ms': 1000.0 * durations[-1] if durations else None,
+        'peak_bytes': peak_bytes,
+    }
+
+def _peak_memory(fn, *args):
+    '''Runs fn under tracemalloc, and returns the peak number of bytes
+    allocated while it ran.'''
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+class Benchmark(object):
+    def __init__(self, args):
+        self.args = args
+        self.workdir = args.workdir
+        self.interval = args.archive_interval
+        self.end_time = args.end_time - (args.end_time % self.interval)
+        self.start_time = self.end_time - int(args.span_days * 86400)
+
+    def config(self, standard):
+        return synthetic.make_config(self.workdir, standard, self.interval,
+            self.args.weather_source, aqi_database='aqi_' + standard.split('.', 2)[-1].replace('.', '_'))
+
+    def create_databases(self):
+        synthetic.create_databases(self.config(synthetic.STANDARDS[0]),
+            self.start_time, self.end_time, self.args.cadence, self.args.seed)
+
+    def new_service(self, standard):
+        config_dict = self.config(standard)
+        path = config_dict['Databases'][config_dict['DataBindings']['aqi_binding']['database']]['database_name']
+        if os.path.exists(path):
+            os.unlink(path)
+        if self.args.hourly_aggregates:
+            config_dict['AqiService']['hourly_aggregates'] = {'enable': 'true'}
+        engine = synthetic.Engine(config_dict)
+        return (engine, user.aqi.service.AqiService(engine, config_dict))
+
+    def event_times(self, n, skip=0):
+        '''Returns the timestamps of n archive records, ending skip records
+        before the end of the span.'''
+        last = self.end_time - skip * self.interval
+        return list(range(last - (n - 1) * self.interval, last + 1, self.interval))
+
+    def run_service(self, standard):
+        (engine, service) = self.new_service(standard)
+        try:
+            def process(times, durations):
+                for ts in times:
+                    event = weewx.Event(weewx.NEW_ARCHIVE_RECORD,
+                        record={'dateTime': ts, 'interval': self.interval // 60})
+                    start = clock()
+                    service.new_archive_record(event)
+                    durations.append(clock() - start)
+
+            peak = None
+            if self.args.memory_events > 0:
+                peak = _peak_memory(process, self.event_times(self.args.memory_events, self.args.events), [])
+            durations = []
+            start = clock()
+            process(self.event_times(self.args.events), durations)
+            return _result('service', standard, durations, clock() - start, peak)
+        finally:
+            service.shutDown()
+            engine.db_binder.close()
+
+    def run_backfill(self, standard):
+        (engine, service) = self.new_service(standard)
+        try:
+            wx_dbm = engine.db_binder.get_manager('wx_binding')
+            end_time = self.end_time + 1
+            start_time = end_time - int(self.args.backfill_days * 86400)
+
+            peak = None
+            if self.args.memory_events > 0:
+                memory_start = start_time - self.args.memory_events * self.interval
+                peak = _peak_memory(user.aqi.backfill.backfill, service, wx_dbm, memory_start, start_time)
+
+            durations = []
+            last = [clock()]
+            def progress(record):
+                now = clock()
+                durations.append(now - last[0])
+                last[0] = now
+            start = clock()
+            user.aqi.backfill.backfill(service, wx_dbm, start_time, end_time, progress)
+            return _result('backfill', standard, durations, clock() - start, peak)
+        finally:
+            service.shutDown()
+            engine.db_binder.close()
+
+    def observations(self, aqi_standard):
+        '''Returns a window of observations, in the units required by the
+        standard, long enough for every calculator of the standard.'''
+        required = aqi_standard.get_pollutants()
+        units = dict([(p, unit) for (p, _, unit, _, _) in synthetic.POLLUTANTS])
+        columns = dict([(p, column) for (p, column, _, _, _) in synthetic.POLLUTANTS])
+        start_time = self.end_time - aqi_standard.max_duration()
+        observations = []
+        for reading in synthetic.gen_sensor_readings(start_time, self.end_time + 1, self.args.cadence, self.args.seed):
+            row = {'dateTime': reading['dateTime']}
+            temp_kelvin = weewx.units.CtoK(reading[synthetic.TEMP_COLUMN])
+            pressure_kilopascals = reading[synthetic.PRESSURE_COLUMN] / 10.0
+            for (pollutant, required_unit) in list(required.items()):
+                row[pollutant] = user.aqi.units.convert_pollutant_units(pollutant,
+                    reading[columns[pollutant]], units[pollutant], required_unit,
+                    temp_kelvin, pressure_kilopascals)
+            observations.append(row)
+        return observations
+
+    def run_standard(self, standard):
+        (engine, service) = self.new_service(standard)
+        try:
+            aqi_standard = service.aqi_standard
+        finally:
+            service.shutDown()
+            engine.db_binder.close()
+        observations = self.observations(aqi_standard)
+        pollutants = aqi_standard.get_pollutants()
+
+        def calculate(n, durations):
+            for _ in range(n):
+                start = clock()
+                for (pollutant, unit) in list(pollutants.items()):
+                    try:
+                        aqi_standard.calculate_aqi(pollutant, unit, observations)
+                    except NotImplementedError:
+                        pass
+                aqi_standard.calculate_composite_aqi(pollutants, observations)
+                durations.append(clock() - start)
+
+        peak = None
+        if self.args.memory_events > 0:
+            peak = _peak_memory(calculate, min(self.args.memory_events, self.args.repeat), [])
+        durations = []
+        start = clock()
+        calculate(self.args.repeat, durations)
+        result = _result('standard', standard, durations, clock() - start, peak)
+        result['window'] = len(observations)
+        return result
+
+    def run(self):
+        results = []
+        for standard in self.args.standards:
+            for case in self.args.cases:
+                sys.stderr.write('%s %s...\n' % (case, standard))
+                try:
+                    result = getattr(self, 'run_' + case)(standard)
+                except Exception as e:
+                    traceback.print_exc()
+                    result = {'case': case, 'standard': standard, 'error': '%s: %s' % (type(e).__name__, str(e))}
+                results.append(result)
+        return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks AqiService against synthetic data.')
+    parser.add_argument('--span-days', type=float, default=7,
+        help='Days of synthetic sensor data to generate (default: 7)')
+    parser.add_argument('--cadence', type=int, default=60,
+        help='Seconds between sensor readings (default: 60)')
+    parser.add_argument('--archive-interval', type=int, default=300,
+        help='Seconds between archive records (default: 300)')
+    parser.add_argument('--end-time', type=int, default=1609459200,
+        help='Epoch seconds of the end of the synthetic data (default: 1609459200)')
+    parser.add_argument('--seed', type=int, default=1,
+        help='Seed of the synthetic data (default: 1)')
+    parser.add_argument('--weather-source', choices=['sensor', 'archive'], default='sensor',
+        help='Read temperature and pressure from the sensor or the main weather archive (default: sensor)')
+    parser.add_argument('--hourly-aggregates', action='store_true',
+        help='Enable the hourly aggregates table')
+    parser.add_argument('--standards', default=','.join(synthetic.STANDARDS),
+        help='Comma separated fully qualified standards to benchmark (default: all)')
+    parser.add_argument('--cases', default=','.join(CASES),
+        help='Comma separated cases to run (default: %s)' % (','.join(CASES)))
+    parser.add_argument('--events', type=int, default=100,
+        help='Archive records timed by the service case (default: 100)')
+    parser.add_argument('--backfill-days', type=float, default=1,
+        help='Days replayed by the backfill case (default: 1)')
+    parser.add_argument('--repeat', type=int, default=20,
+        help='Calculations timed by the standard case (default: 20)')
+    parser.add_argument('--memory-events', type=int, default=10,
+        help='Events processed under tracemalloc to measure peak memory, 0 disables (default: 10)')
+    parser.add_argument('--workdir', default=None,
+        help='Directory for the synthetic databases (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true',
+        help='Do not delete the working directory')
+    parser.add_argument('--output', default=None,
+        help='Write the JSON results to this file (default: stdout)')
+    args = parser.parse_args(argv)
+    args.standards = [s for s in args.standards.split(',') if s]
+    args.cases = [c for c in args.cases.split(',') if c]
+    for case in args.cases:
+        if case not in CASES:
+            parser.error('unknown case %s' % (case))
+
+    cleanup = args.workdir is None and not args.keep
+    if args.workdir is None:
+        args.workdir = tempfile.mkdtemp(prefix='aqi_bench_')
+    elif not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+
+    try:
+        bench = Benchmark(args)
+        sys.stderr.write('generating %g days of synthetic data in %s...\n' % (args.span_days, args.workdir))
+        start = clock()
+        bench.create_databases()
+        generate_secs = clock() - start
+        results = bench.run()
+    finally:
+        if cleanup:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'weewx': weewx.__version__,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            'generate_seconds': generate_secs,
+            'args': dict([(k, v) for (k, v) in vars(args).items() if k not in ['workdir', 'keep', 'output']]),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0 if all('error' not in r for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
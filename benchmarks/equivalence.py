@@ -0,0 +1,271 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+'''Checks that an alternate way of calculating AQIs produces exactly the same
+records as the reference AqiService.
+
+Archive records are replayed through two services, each writing to its own
+aqi store. The reference is the stock AqiService. The candidate is the same
+configuration with the --candidate options applied to [AqiService], and may
+be a different service class. Every column of every record written is then
+compared, and the first divergence is reported together with the sensor and
+weather readings in its window.
+
+Run from the top of the repository, e.g. with synthetic data for all standards
+
+    python -m benchmarks.equivalence --candidate hourly_aggregates.enable=true
+
+or with the recorded history of an installation, without modifying its aqi
+store
+
+    python -m benchmarks.equivalence --config /home/weewx/weewx.conf \\
+        --start-time 1609372800 --end-time 1609459200 --candidate ...
+
+The synthetic data includes a daily SO2 episode that falls in the hole
+between the US AQI's 1 hour and 24 hour SO2 tables.'''
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+
+import configobj
+import weewx
+
+import user.aqi.backfill
+import user.aqi.service
+
+from . import synthetic
+
+def set_option(config_dict, option):
+    '''Applies an option of the form `section.key=value` to the [AqiService]
+    section of config_dict.'''
+    (path, value) = option.split('=', 1)
+    keys = path.split('.')
+    section = config_dict['AqiService']
+    for key in keys[:-1]:
+        if key not in section:
+            section[key] = {}
+        section = section[key]
+    section[keys[-1]] = value
+
+def redirect_aqi_store(config_dict, path):
+    '''Points the aqi data binding of config_dict at a new sqlite database.'''
+    binding = config_dict['AqiService']['standard']['data_binding']
+    name = 'aqi_equivalence_' + os.path.splitext(os.path.basename(path))[0]
+    config_dict['DataBindings'][binding]['database'] = name
+    config_dict['Databases'][name] = {'database_name': path, 'driver': 'weedb.sqlite'}
+
+def _load_class(fq_name):
+    module_name = '.'.join(fq_name.split('.')[:-1])
+    __import__(module_name)
+    return getattr(sys.modules[module_name], fq_name.split('.')[-1])
+
+def window_contents(service, ts, interval):
+    '''Returns the sensor and weather rows the reference service read for the
+    archive record at ts.'''
+    start_time = ts - service.aqi_standard.max_duration()
+    end_time = ts - interval * 60
+    contents = {}
+    (weather_dbm, weather_table_name, _) = service._get_weather_source()
+    for (name, dbm, table_name) in [
+            ('sensor', service.sensor_dbm, service.sensor_dbm.table_name),
+            ('weather', weather_dbm, weather_table_name)]:
+        cols = dbm.connection.columnsOf(table_name)
+        sql = 'SELECT %s FROM %s WHERE dateTime >= ? AND dateTime <= ? ORDER BY dateTime ASC' % (
+            ', '.join(cols), table_name)
+        contents[name] = [dict(zip(cols, row)) for row in dbm.genSql(sql, (start_time, end_time))]
+    return contents
+
+def read_records(aqi_dbm):
+    '''Returns the records of the aqi store, keyed by dateTime.'''
+    cols = [x[0] for x in user.aqi.service.schema]
+    sql = 'SELECT %s FROM %s ORDER BY dateTime ASC' % (', '.join(cols), aqi_dbm.table_name)
+    return dict([(row[0], dict(zip(cols, row))) for row in aqi_dbm.genSql(sql)])
+
+def diff_records(reference, candidate):
+    '''Returns the differing records, in order, as a list of (dateTime,
+    {column: (reference value, candidate value)}). A record missing from one
+    side is reported with None in place of its values.'''
+    divergences = []
+    for ts in sorted(set(reference) | set(candidate)):
+        ref = reference.get(ts, {})
+        cand = candidate.get(ts, {})
+        columns = {}
+        for col in sorted(set(ref) | set(cand)):
+            if ref.get(col) != cand.get(col):
+                columns[col] = (ref.get(col), cand.get(col))
+        if len(columns) > 0:
+            divergences.append((ts, columns))
+    return divergences
+
+def replay(reference_config, candidate_config, candidate_class, records):
+    '''Replays the archive records through the reference and candidate
+    services, and compares the records they stored. Returns a report.'''
+    for (config_dict, service_class) in [
+            (reference_config, user.aqi.service.AqiService),
+            (candidate_config, candidate_class)]:
+        engine = synthetic.Engine(config_dict)
+        try:
+            service = service_class(engine, config_dict)
+            try:
+                for record in records:
+                    service.new_archive_record(weewx.Event(weewx.NEW_ARCHIVE_RECORD, record=dict(record)))
+            finally:
+                # the service may hold records until it shuts down
+                service.shutDown()
+        finally:
+            engine.db_binder.close()
+
+    # reopen the reference to read the stores, and the window of any divergence
+    engine = synthetic.Engine(reference_config)
+    try:
+        service = user.aqi.service.AqiService(engine, reference_config)
+        reference = read_records(service.aqi_dbm)
+        candidate_engine = synthetic.Engine(candidate_config)
+        try:
+            binding = candidate_config['AqiService']['standard']['data_binding']
+            candidate = read_records(candidate_engine.db_binder.get_manager(binding))
+        finally:
+            candidate_engine.db_binder.close()
+
+        divergences = diff_records(reference, candidate)
+        report = {
+            'records': len(records),
+            'reference_records': len(reference),
+            'candidate_records': len(candidate),
+            'divergences': len(divergences),
+        }
+        if len(divergences) > 0:
+            (ts, columns) = divergences[0]
+            interval = [r['interval'] for r in records if r['dateTime'] == ts]
+            report['first_divergence'] = {
+                'dateTime': ts,
+                'columns': columns,
+                'window': window_contents(service, ts, interval[0] if interval else records[0]['interval']),
+            }
+        service.shutDown()
+        return report
+    finally:
+        engine.db_binder.close()
+
+def synthetic_cases(args):
+    '''Yields (standard, reference config, candidate config, records) for
+    every standard, over synthetic data.'''
+    end_time = args.end_time - (args.end_time % args.archive_interval)
+    start_time = end_time - int(args.span_days * 86400)
+    config_dict = synthetic.make_config(args.workdir, synthetic.STANDARDS[0], args.archive_interval, args.weather_source)
+    synthetic.create_databases(config_dict, start_time, end_time, args.cadence, args.seed, so2_episodes=True)
+    replay_start = end_time - int(args.replay_days * 86400)
+    records = list(synthetic.gen_weather_records(replay_start, end_time, args.archive_interval))
+    for standard in args.standards or synthetic.STANDARDS:
+        configs = []
+        for side in ['reference', 'candidate']:
+            config_dict = synthetic.make_config(args.workdir, standard, args.archive_interval,
+                args.weather_source, aqi_database='aqi_' + side)
+            configs.append(config_dict)
+        yield (standard, configs[0], configs[1], records)
+
+def recorded_cases(args):
+    '''Yields (standard, reference config, candidate config, records) for
+    the recorded history of the installation configured by args.config.'''
+    base = configobj.ConfigObj(args.config, file_error=True)
+    engine = synthetic.Engine(base)
+    try:
+        wx_dbm = engine.db_binder.get_manager('wx_binding')
+        records = list(user.aqi.backfill.gen_archive_records(wx_dbm, args.start_time, args.end_time))
+    finally:
+        engine.db_binder.close()
+    for standard in args.standards or [base['AqiService']['standard']['standard']]:
+        configs = []
+        for side in ['reference', 'candidate']:
+            config_dict = copy.deepcopy(base)
+            config_dict['AqiService']['standard']['standard'] = standard
+            configs.append(config_dict)
+        yield (standard, configs[0], configs[1], records)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compares the AQIs of a candidate AqiService to the reference.')
+    parser.add_argument('--candidate', action='append', default=[],
+        help='Option applied to the candidate\'s [AqiService] section, as section.key=value. May be repeated.')
+    parser.add_argument('--option', action='append', default=[],
+        help='Option applied to both services\' [AqiService] sections, as section.key=value. May be repeated.')
+    parser.add_argument('--candidate-class', default='user.aqi.service.AqiService',
+        help='Fully qualified class of the candidate service (default: user.aqi.service.AqiService)')
+    parser.add_argument('--standards', default='',
+        help='Comma separated fully qualified standards to compare (default: all, or the configured standard)')
+    parser.add_argument('--config', default=None,
+        help='weewx.conf of an installation to replay, instead of synthetic data')
+    parser.add_argument('--start-time', type=int, default=0,
+        help='With --config, epoch seconds of the first archive record to replay (default: 0)')
+    parser.add_argument('--end-time', type=int, default=1609459200,
+        help='Epoch seconds of the end of the replay (default: 1609459200)')
+    parser.add_argument('--span-days', type=float, default=3,
+        help='Days of synthetic data to generate (default: 3)')
+    parser.add_argument('--replay-days', type=float, default=1,
+        help='Days of synthetic archive records to replay (default: 1)')
+    parser.add_argument('--cadence', type=int, default=60,
+        help='Seconds between synthetic sensor readings (default: 60)')
+    parser.add_argument('--archive-interval', type=int, default=300,
+        help='Seconds between synthetic archive records (default: 300)')
+    parser.add_argument('--seed', type=int, default=1,
+        help='Seed of the synthetic data (default: 1)')
+    parser.add_argument('--weather-source', choices=['sensor', 'archive'], default='sensor',
+        help='Read synthetic temperature and pressure from the sensor or the main weather archive (default: sensor)')
+    parser.add_argument('--workdir', default=None,
+        help='Directory for the databases (default: a temporary directory)')
+    parser.add_argument('--output', default=None,
+        help='Write the full JSON report, including the first divergence\'s window, to this file')
+    args = parser.parse_args(argv)
+    args.standards = [s for s in args.standards.split(',') if s]
+
+    cleanup = args.workdir is None
+    if args.workdir is None:
+        args.workdir = tempfile.mkdtemp(prefix='aqi_equivalence_')
+    elif not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+
+    candidate_class = _load_class(args.candidate_class)
+    cases = recorded_cases(args) if args.config else synthetic_cases(args)
+    reports = {}
+    try:
+        for (standard, reference_config, candidate_config, records) in cases:
+            for (config_dict, side) in [(reference_config, 'reference'), (candidate_config, 'candidate')]:
+                path = os.path.join(args.workdir, 'aqi_%s.sdb' % (side))
+                if os.path.exists(path):
+                    os.unlink(path)
+                redirect_aqi_store(config_dict, path)
+                for option in args.option:
+                    set_option(config_dict, option)
+            for option in args.candidate:
+                set_option(candidate_config, option)
+
+            report = replay(reference_config, candidate_config, candidate_class, records)
+            reports[standard] = report
+            line = '%s: %d records, %d reference, %d candidate, %d divergences' % (
+                standard, report['records'], report['reference_records'],
+                report['candidate_records'], report['divergences'])
+            if 'first_divergence' in report:
+                first = report['first_divergence']
+                line += '\n    first at %d: %s\n    window: %d sensor rows, %d weather rows' % (
+                    first['dateTime'],
+                    ', '.join(['%s %r != %r' % (col, ref, cand) for (col, (ref, cand)) in sorted(first['columns'].items())]),
+                    len(first['window']['sensor']), len(first['window']['weather']))
+            print(line)
+    finally:
+        if cleanup:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2, sort_keys=True)
+    return 0 if all(r['divergences'] == 0 for r in reports.values()) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
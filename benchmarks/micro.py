@@ -0,0 +1,290 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+'''Micro-benchmarks of the calculators' hot functions, with baselines.
+
+Run from the top of the repository:
+
+    python -m benchmarks.micro run --output results.json
+    python -m benchmarks.micro baseline
+    python -m benchmarks.micro compare [results.json]
+
+`run` times every benchmark for windows of 60 to 100,000 observations.
+`baseline` does the same, and stores the timings in benchmarks/baselines/.
+`compare` reports the ratio of each timing to the baseline, running the
+benchmarks first if no results are given, and exits with an error if any
+is slower than the baseline by more than the threshold.
+
+Every report also times a fixed calibration loop, and records the host it
+ran on. `compare` scales the baseline's timings by the ratio of the two
+calibrations, so a baseline recorded on another machine is still roughly
+comparable.
+
+For functions that work on a single value, such as
+BreakpointTable._calculate_index_from_mean, the window is the number of
+values processed, one call each.'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+
+from user.aqi import calculators
+from user.aqi import eu
+from user.aqi import units
+from user.aqi import us
+
+SIZES = [60, 1000, 10000, 100000]
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json')
+DEFAULT_THRESHOLD = 0.25
+
+clock = getattr(time, 'perf_counter', time.time)
+
+def make_observations(n, span_in_secs, low, high, seed=1):
+    '''Returns n (timestamp, value) pairs evenly spread over span_in_secs,
+    newest first, as the calculators see them after cleaning.'''
+    rng = random.Random(seed)
+    step = span_in_secs / float(n)
+    end_time = 1609459200
+    return [(end_time - i * step, round(rng.uniform(low, high), 1)) for i in range(n)]
+
+def make_values(n, low, high, seed=1):
+    rng = random.Random(seed)
+    return [round(rng.uniform(low, high), 1) for _ in range(n)]
+
+def make_window(n, span_in_secs, low, high, seed=1):
+    '''Returns an ObservationWindow of n PM2.5 readings evenly spread over
+    span_in_secs, as the service builds it from the rows it reads.'''
+    rng = random.Random(seed)
+    step = span_in_secs / float(n)
+    end_time = 1609459200
+    return calculators.ObservationWindow([
+        calculators.Observation(dateTime=end_time - (n - 1 - i) * step, pm2_5=round(rng.uniform(low, high), 1))
+        for i in range(n)], ascending=True)
+
+def bench_get_last_valid_index(n):
+    observations = make_observations(n, 2 * calculators.DAY, 0, 100)
+    return lambda: calculators.get_last_valid_index(observations, calculators.DAY)
+
+def bench_newest_first(n):
+    window = make_window(n, 2 * calculators.DAY, 0, 100)
+    return lambda: window.newest_first(calculators.PM2_5, calculators.TRUNCATE_TO_1, calculators.DAY)
+
+def bench_arithmetic_mean(n):
+    observations = make_observations(n, calculators.DAY, 0, 100)
+    return lambda: calculators.arithmetic_mean(observations)
+
+def bench_nowcast_pm_mean(n):
+    span = 12 * calculators.HOUR
+    observations = make_observations(n, span, 0, 100)
+    obs_frequency_in_sec = span / float(n)
+    return lambda: us.nowcast_pm_mean(observations, obs_frequency_in_sec, 0.75, 3)
+
+def bench_eu_24hr_mean(n):
+    span = calculators.DAY
+    observations = make_observations(n, span, 0, 100)
+    obs_frequency_in_sec = span / float(n)
+    return lambda: eu.eu_24hr_mean(observations, obs_frequency_in_sec, 0.75, 18)
+
+def bench_breakpoint_table(n):
+    table = us.AirQualityIndex(60).calculators[calculators.PM2_5]
+    means = make_values(n, 0, 500)
+    def run():
+        for mean in means:
+            table._calculate_index_from_mean(mean)
+    return run
+
+def bench_linear_scale(n):
+    scale = calculators.LinearScale(
+        unit='part_per_million',
+        duration_in_secs=8 * calculators.HOUR,
+        obs_frequency_in_sec=60,
+        high_obs=9.0,
+        breakpoints=[0, 34, 100, 150, 200])
+    means = make_values(n, 0, 20)
+    def run():
+        for mean in means:
+            scale._calculate_index_from_mean(mean)
+    return run
+
+def bench_convert_pollutant_units(n):
+    values = make_values(n, 0, 200)
+    def run():
+        for value in values:
+            units.convert_pollutant_units(calculators.NO2, value, 'part_per_billion',
+                'microgram_per_meter_cubed', 293.15, 101.325)
+    return run
+
+def bench_convert_pollutant_units_column(n):
+    values = make_values(n, 0, 200)
+    temps = make_values(n, 263.15, 313.15, seed=2)
+    pressures = make_values(n, 95, 105, seed=3)
+    return lambda: units.convert_pollutant_units_column(calculators.NO2, values, 'part_per_billion',
+        'microgram_per_meter_cubed', temps, pressures)
+
+BENCHMARKS = [
+    ('get_last_valid_index', bench_get_last_valid_index),
+    ('ObservationWindow.newest_first', bench_newest_first),
+    ('arithmetic_mean', bench_arithmetic_mean),
+    ('nowcast_pm_mean', bench_nowcast_pm_mean),
+    ('eu_24hr_mean', bench_eu_24hr_mean),
+    ('BreakpointTable._calculate_index_from_mean', bench_breakpoint_table),
+    ('LinearScale._calculate_index_from_mean', bench_linear_scale),
+    ('convert_pollutant_units', bench_convert_pollutant_units),
+    ('convert_pollutant_units_column', bench_convert_pollutant_units_column),
+]
+
+def bench_calibration():
+    '''A fixed loop of float arithmetic and list indexing, like the
+    calculators', that measures the speed of the machine.'''
+    values = make_values(10000, 0, 100)
+    def run():
+        total = 0.0
+        for i in range(len(values)):
+            total += values[i] * 0.5
+        return total
+    return run
+
+def time_call(fn, min_secs=0.05, repeat=5):
+    '''Returns the best time, in seconds, of a single call to fn. Calls are
+    batched until a batch takes at least min_secs.'''
+    number = 1
+    while True:
+        start = clock()
+        for _ in range(number):
+            fn()
+        elapsed = clock() - start
+        if elapsed >= min_secs:
+            break
+        number *= 10 if elapsed < (min_secs / 10.0) else 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = clock()
+        for _ in range(number):
+            fn()
+        best = min(best, clock() - start)
+    return best / number
+
+def run(names=None, sizes=SIZES, repeat=5):
+    '''Runs the benchmarks, returning a report mapping `name@size` to the
+    seconds per call, along with the seconds per call of the calibration
+    loop on this machine.'''
+    timings = {}
+    calibrate = bench_calibration()
+    calibration = time_call(calibrate, repeat=repeat)
+    for (name, setup) in BENCHMARKS:
+        if names and name not in names:
+            continue
+        # the speed of a shared machine drifts, so the calibration is repeated
+        # between the benchmarks, and the fastest is kept
+        calibration = min(calibration, time_call(calibrate, repeat=repeat))
+        for n in sizes:
+            sys.stderr.write('%s@%d...\n' % (name, n))
+            timings['%s@%d' % (name, n)] = time_call(setup(n), repeat=repeat)
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'host': platform.node(),
+            'calibration': calibration,
+        },
+        'timings': timings,
+    }
+
+def compare(baseline, results, threshold):
+    '''Returns a list of (key, baseline secs, result secs, ratio, slower)
+    for every timing in both reports. Timings are compared relative to the
+    calibration loop of their report, so that a baseline recorded on one
+    machine can be compared with results from another. The baseline's
+    timings are scaled to this machine.'''
+    scale = 1.0
+    if baseline['meta'].get('calibration') and results['meta'].get('calibration'):
+        scale = results['meta']['calibration'] / baseline['meta']['calibration']
+    rows = []
+    def sort_key(key):
+        (name, size) = key.rsplit('@', 1)
+        return (name, int(size))
+    for key in sorted(results['timings'], key=sort_key):
+        if key not in baseline['timings']:
+            continue
+        base = baseline['timings'][key] * scale
+        secs = results['timings'][key]
+        ratio = secs / base if base > 0 else float('inf')
+        rows.append((key, base, secs, ratio, ratio > (1.0 + threshold)))
+    return rows
+
+def _write(report, path):
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the AQI calculators.')
+    subparsers = parser.add_subparsers(dest='command')
+    for command in ['run', 'baseline', 'compare']:
+        p = subparsers.add_parser(command)
+        p.add_argument('--only', action='append', default=[],
+            help='Only run this benchmark. May be repeated.')
+        p.add_argument('--sizes', default=','.join([str(s) for s in SIZES]),
+            help='Comma separated window sizes (default: %s)' % (','.join([str(s) for s in SIZES])))
+        p.add_argument('--repeat', type=int, default=5,
+            help='Timing repetitions, the best is kept (default: 5)')
+        if command == 'run':
+            p.add_argument('--output', default=None, help='Write the JSON results to this file (default: stdout)')
+        else:
+            p.add_argument('--baseline', default=BASELINE_FILE, help='Baseline file (default: %s)' % (BASELINE_FILE))
+        if command == 'compare':
+            p.add_argument('results', nargs='?', default=None,
+                help='Results written by `run`. If omitted, the benchmarks are run.')
+            p.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                help='Fraction slower than the baseline that is flagged (default: %g)' % (DEFAULT_THRESHOLD))
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required')
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    if args.command == 'run':
+        _write(run(args.only, sizes, args.repeat), args.output)
+        return 0
+
+    if args.command == 'baseline':
+        _write(run(args.only, sizes, args.repeat), args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run(args.only, sizes, args.repeat)
+    if not baseline['meta'].get('calibration'):
+        print('warning: the baseline has no calibration, so its timings are only comparable on %s' % (
+            baseline['meta'].get('host') or baseline['meta'].get('platform')))
+    elif baseline['meta'].get('host') != results['meta'].get('host'):
+        print('baseline recorded on %s, scaled by %.2f to this machine by the calibration loop' % (
+            baseline['meta'].get('host'), results['meta']['calibration'] / baseline['meta']['calibration']))
+
+    slower = 0
+    for (key, base, secs, ratio, flagged) in compare(baseline, results, args.threshold):
+        print('%-55s %12.3f us %12.3f us %6.2fx%s' % (key, base * 1e6, secs * 1e6, ratio,
+            '  SLOWER' if flagged else ''))
+        if flagged:
+            slower += 1
+    if slower > 0:
+        print('%d benchmarks are more than %d%% slower than the baseline' % (slower, round(args.threshold * 100)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+'''Generates synthetic air sensor and weather databases, and the weewx
+configuration to run AqiService against them.'''
+
+import math
+import os
+import random
+
+import configobj
+import weewx
+import weewx.manager
+import weewx.units
+
+# All standards, by their fully qualified class name.
+STANDARDS = [
+    'user.aqi.us.AirQualityIndex',
+    'user.aqi.us.NowCast',
+    'user.aqi.eu.EuropeanAirQualityIndex',
+    'user.aqi.eu.CommonAirQualityHourlyIndex',
+    'user.aqi.uk.DailyAirQualityIndex',
+    'user.aqi.india.NationalAirQualityIndex',
+    'user.aqi.mx.IndiceMetropolitanoCalidadAire',
+    'user.aqi.au.AirQualityIndex',
+    'user.aqi.ca.AirQualityHealthIndex',
+]
+
+# The synthetic sensor's readings. Each pollutant has a column, the unit the
+# column is recorded in, the daily baseline, and the amplitude of its diurnal
+# cycle. The values are chosen so that every standard can index them.
+POLLUTANTS = [
+    # (pollutant, column, unit, baseline, amplitude)
+    ('pm2_5', 'bench_pm2_5', 'microgram_per_meter_cubed', 15.0, 10.0),
+    ('pm10_0', 'bench_pm10_0', 'microgram_per_meter_cubed', 30.0, 20.0),
+    ('co', 'bench_co', 'part_per_billion', 800.0, 500.0),
+    ('no2', 'bench_no2', 'part_per_billion', 20.0, 15.0),
+    ('so2', 'bench_so2', 'part_per_billion', 8.0, 5.0),
+    ('o3', 'bench_o3', 'part_per_billion', 30.0, 20.0),
+    ('nh3', 'bench_nh3', 'part_per_billion', 30.0, 20.0),
+    ('pb', 'bench_pb', 'microgram_per_meter_cubed', 0.15, 0.1),
+]
+TEMP_COLUMN = 'bench_temperature'
+PRESSURE_COLUMN = 'bench_pressure'
+
+sensor_schema = [
+    ('dateTime', 'INTEGER NOT NULL PRIMARY KEY'),
+    ('usUnits', 'INTEGER NOT NULL'),
+    ('interval', 'INTEGER NOT NULL'),
+    (TEMP_COLUMN, 'REAL'),
+    (PRESSURE_COLUMN, 'REAL'),
+] + [(column, 'REAL') for (_, column, _, _, _) in POLLUTANTS]
+
+weather_schema = [
+    ('dateTime', 'INTEGER NOT NULL PRIMARY KEY'),
+    ('usUnits', 'INTEGER NOT NULL'),
+    ('interval', 'INTEGER NOT NULL'),
+    ('outTemp', 'REAL'),
+    ('barometer', 'REAL'),
+]
+
+# register the units of the sensor's columns. The readings are recorded in the
+# same units regardless of the unit system.
+for (_, column, unit, _, _) in POLLUTANTS:
+    group = 'group_bench_' + unit
+    weewx.units.obs_group_dict[column] = group
+    weewx.units.USUnits[group] = unit
+    weewx.units.MetricUnits[group] = unit
+    weewx.units.MetricWXUnits[group] = unit
+weewx.units.obs_group_dict[TEMP_COLUMN] = 'group_temperature'
+weewx.units.obs_group_dict[PRESSURE_COLUMN] = 'group_pressure'
+
+def _diurnal(ts, baseline, amplitude, phase):
+    return baseline + amplitude * math.sin(2 * math.pi * ((ts % 86400) / 86400.0 + phase))
+
+# Daily hour, in UTC, of the optional SO2 episode, and its concentration in
+# ppb. The hourly mean is above the US AQI's 1 hour table, but the daily mean
+# is below its 24 hour table.
+SO2_EPISODE_HOUR = 12
+SO2_EPISODE_PPB = 320.0
+
+def gen_sensor_readings(start_time, end_time, cadence, seed=1, so2_episodes=False):
+    '''Yields sensor readings, in METRICWX units, every cadence seconds in
+    [start_time, end_time). Each reading follows a diurnal cycle with
+    random noise. If so2_episodes is true, SO2 spikes for an hour each day.'''
+    rng = random.Random(seed)
+    for ts in range(start_time, end_time, cadence):
+        record = {
+            'dateTime': ts,
+            'usUnits': weewx.METRICWX,
+            'interval': max(1, cadence // 60),
+            TEMP_COLUMN: round(_diurnal(ts, 15.0, 8.0, 0.5) + rng.gauss(0, 0.5), 1),
+            PRESSURE_COLUMN: round(1013.0 + rng.gauss(0, 2.0), 1),
+        }
+        for (i, (_, column, _, baseline, amplitude)) in enumerate(POLLUTANTS):
+            value = _diurnal(ts, baseline, amplitude, i / float(len(POLLUTANTS))) * rng.uniform(0.8, 1.2)
+            record[column] = round(max(0.0, value), 3)
+        if so2_episodes and (ts % 86400) // 3600 == SO2_EPISODE_HOUR:
+            record['bench_so2'] = round(SO2_EPISODE_PPB + rng.uniform(0.0, 10.0), 3)
+        yield record
+
+def gen_weather_records(start_time, end_time, archive_interval):
+    '''Yields main weather archive records, in US units, every
+    archive_interval seconds in (start_time, end_time].'''
+    first = start_time - (start_time % archive_interval) + archive_interval
+    for ts in range(first, end_time + 1, archive_interval):
+        yield {
+            'dateTime': ts,
+            'usUnits': weewx.US,
+            'interval': archive_interval // 60,
+            'outTemp': round(weewx.units.CtoF(_diurnal(ts, 15.0, 8.0, 0.5)), 1),
+            'barometer': 29.92,
+        }
+
+def make_config(root, standard, archive_interval, weather_source='sensor', aqi_database='aqi'):
+    '''Returns a weewx configuration running AqiService with the standard
+    against the synthetic databases in the directory root. If weather_source
+    is `sensor`, temperature and pressure come from the sensor, otherwise from
+    the main weather archive.'''
+    air_sensor = {
+        'data_binding': 'bench_sensor_binding',
+    }
+    for (pollutant, column, _, _, _) in POLLUTANTS:
+        air_sensor[pollutant] = column
+    if weather_source == 'sensor':
+        air_sensor['temp'] = TEMP_COLUMN
+        air_sensor['pressure'] = PRESSURE_COLUMN
+
+    databases = {}
+    for name in ['bench_sensor', 'bench_weather', aqi_database]:
+        databases[name] = {
+            'database_name': os.path.join(root, name + '.sdb'),
+            'driver': 'weedb.sqlite',
+        }
+
+    return configobj.ConfigObj({
+        'WEEWX_ROOT': root,
+        'StdArchive': {'archive_interval': str(archive_interval)},
+        'StdConvert': {'target_unit': 'US'},
+        'AqiService': {
+            'standard': {'data_binding': 'aqi_binding', 'standard': standard},
+            'air_sensor': air_sensor,
+        },
+        'DataBindings': {
+            'wx_binding': {
+                'database': 'bench_weather',
+                'table_name': 'archive',
+                'manager': 'weewx.manager.Manager',
+                'schema': 'benchmarks.synthetic.weather_schema',
+            },
+            'aqi_binding': {
+                'database': aqi_database,
+                'table_name': 'archive',
+                'manager': 'weewx.manager.DaySummaryManager',
+                'schema': 'user.aqi.service.schema',
+            },
+            'bench_sensor_binding': {
+                'database': 'bench_sensor',
+                'table_name': 'archive',
+                'manager': 'weewx.manager.Manager',
+                'schema': 'benchmarks.synthetic.sensor_schema',
+            },
+        },
+        'Databases': databases,
+    })
+
+class Engine(object):
+    '''The parts of weewx.engine.StdEngine used by AqiService.'''
+    def __init__(self, config_dict):
+        self.db_binder = weewx.manager.DBBinder(config_dict)
+
+    def bind(self, event_type, callback):
+        pass
+
+def create_databases(config_dict, start_time, end_time, cadence, seed=1, so2_episodes=False):
+    '''Creates and fills the synthetic sensor and weather databases.'''
+    for name in ['bench_sensor', 'bench_weather']:
+        path = config_dict['Databases'][name]['database_name']
+        if os.path.exists(path):
+            os.unlink(path)
+    binder = weewx.manager.DBBinder(config_dict)
+    try:
+        sensor_dbm = binder.get_manager('bench_sensor_binding', initialize=True)
+        sensor_dbm.addRecord(gen_sensor_readings(start_time, end_time, cadence, seed, so2_episodes), log_success=False)
+        weather_dbm = binder.get_manager('wx_binding', initialize=True)
+        weather_dbm.addRecord(gen_weather_records(start_time, end_time,
+            int(config_dict['StdArchive']['archive_interval'])), log_success=False)
+    finally:
+        binder.close()
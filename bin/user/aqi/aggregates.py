@@ -0,0 +1,304 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import syslog
+
+import weedb
+import weewx.units
+
+from . import calculators
+
+POLLUTANTS = [
+    calculators.PM2_5,
+    calculators.PM10_0,
+    calculators.CO,
+    calculators.NO2,
+    calculators.SO2,
+    calculators.O3,
+    calculators.NH3,
+    calculators.PB,
+]
+
+def make_schema():
+    '''Returns the schema of an aggregate table. Each row summarizes the raw
+    sensor readings in the bucket (dateTime - interval, dateTime], using the
+    same end-of-interval convention as the weewx archive. Values are stored in
+    the sensor's own units, as described by usUnits and weather_usUnits.'''
+    schema = [
+        ('dateTime', 'INTEGER NOT NULL PRIMARY KEY'),
+        ('interval', 'INTEGER NOT NULL'),
+        ('usUnits', 'INTEGER'),
+        ('weather_usUnits', 'INTEGER'),
+        ('outTemp_mean', 'REAL'),
+        ('pressure_mean', 'REAL'),
+    ]
+    for pollutant in POLLUTANTS:
+        schema.extend([
+            (pollutant + '_sum', 'REAL'),
+            (pollutant + '_count', 'INTEGER'),
+            (pollutant + '_min', 'REAL'),
+            (pollutant + '_max', 'REAL'),
+        ])
+    return schema
+
+schema = make_schema()
+
+def bucket_sql(column, bucket_secs):
+    '''Returns SQL that maps the epoch second `column` to the end of its bucket.
+    The SQL holds no modulo operator, since the MySQL driver treats every % in
+    a statement as a format character. Dividing integers truncates in SQLite
+    but rounds in MySQL, so the quotient is corrected when it overshoots.'''
+    shifted = '(%s + %d)' % (column, bucket_secs - 1)
+    quotient = 'CAST(%s / %d AS SIGNED INTEGER)' % (shifted, bucket_secs)
+    return '((%s - CASE WHEN %s * %d > %s THEN 1 ELSE 0 END) * %d)' % (
+        quotient, quotient, bucket_secs, shifted, bucket_secs)
+
+def bucket_end(timestamp, bucket_secs):
+    '''Returns the end of the bucket containing timestamp.'''
+    return int(timestamp) + ((bucket_secs - (int(timestamp) % bucket_secs)) % bucket_secs)
+
+def _gen_unit_groups(rows):
+    '''Groups rows of (bucket, usUnits, ...) that are grouped by bucket and
+    usUnits into (bucket, [rows]), for each bucket.'''
+    buckets = {}
+    for row in rows:
+        buckets.setdefault(row[0], []).append(row)
+    for bucket in sorted(buckets):
+        yield (bucket, buckets[bucket])
+
+def _target_units(groups):
+    '''Returns the unit system that the readings of a bucket, grouped by
+    their unit system, are stored in: the largest, like MAX(usUnits).'''
+    systems = [row[1] for row in groups if row[1] is not None]
+    return max(systems) if systems else None
+
+def _get_converter(column, from_us_units, to_us_units):
+    '''Returns a function that converts values of column from one weewx unit
+    system to another, or None if they can not be converted.'''
+    if from_us_units is None or to_us_units is None:
+        return lambda x: x
+    from_unit = weewx.units.getStandardUnitType(from_us_units, column)[0]
+    to_unit = weewx.units.getStandardUnitType(to_us_units, column)[0]
+    if from_unit == to_unit:
+        return lambda x: x
+    try:
+        return weewx.units.conversionDict[from_unit][to_unit]
+    except KeyError:
+        return None
+
+class AggregateTable(object):
+    '''Maintains a table of the sum, count, minimum and maximum of each
+    pollutant, along with the mean temperature and pressure, over fixed width
+    buckets of the raw sensor readings.
+
+    The table lives in the AQI database. It is updated incrementally as archive
+    records arrive, and can be rebuilt from scratch with a single GROUP BY
+    query over the sensor table.'''
+    def __init__(self, dbm, table_name, bucket_secs,
+                 sensor_dbm, sensor_columns,
+                 weather_dbm, weather_table_name, weather_columns):
+        '''Creates a new AggregateTable. The table is created if it does not
+        already exist.
+
+            dbm
+                manager of the database holding the aggregate table
+            table_name
+                name of the aggregate table
+            bucket_secs
+                width of each bucket in seconds
+            sensor_dbm
+                manager of the air sensor database
+            sensor_columns
+                map from canonical names (dateTime, usUnits and the pollutants)
+                to the sensor's column names
+            weather_dbm
+                manager of the database holding temperature and pressure
+            weather_table_name
+                table holding temperature and pressure
+            weather_columns
+                map from canonical names (dateTime, weather_usUnits, outTemp,
+                pressure) to the weather table's column names
+        '''
+        self.dbm = dbm
+        self.table_name = table_name
+        self.bucket_secs = int(bucket_secs)
+        self.sensor_dbm = sensor_dbm
+        self.sensor_columns = sensor_columns
+        self.weather_dbm = weather_dbm
+        self.weather_table_name = weather_table_name
+        self.weather_columns = weather_columns
+        self.pollutants = [p for p in POLLUTANTS if p in sensor_columns]
+        self.last_update = None
+
+        if self.table_name not in self.dbm.connection.tables():
+            with weedb.Transaction(self.dbm.connection) as cursor:
+                cursor.execute('CREATE TABLE %s (%s)' % (self.table_name,
+                    ', '.join(['%s %s' % col for col in schema])))
+            syslog.syslog(syslog.LOG_INFO, "AqiService: created aggregate table %s" % (self.table_name))
+        else:
+            row = self.dbm.getSql('SELECT MAX(dateTime) FROM %s' % (self.table_name))
+            if row is not None and row[0] is not None:
+                self.last_update = row[0]
+
+    def _gen_sensor_buckets(self, start_time, end_time):
+        '''Yields (dateTime, values) for each bucket of sensor readings with
+        timestamps in (start_time, end_time]. Readings are aggregated for each
+        unit system separately, then converted to the bucket's unit system.'''
+        ts = self.sensor_columns['dateTime']
+        us_units = self.sensor_columns['usUnits']
+        sql = 'SELECT %s AS bucket, %s' % (bucket_sql(ts, self.bucket_secs), us_units)
+        for pollutant in self.pollutants:
+            col = self.sensor_columns[pollutant]
+            sql += ', SUM(%s), COUNT(%s), MIN(%s), MAX(%s)' % (col, col, col, col)
+        sql += ' FROM %s WHERE %s > ? AND %s <= ? GROUP BY bucket, %s' % (self.sensor_dbm.table_name, ts, ts, us_units)
+        for (bucket, groups) in _gen_unit_groups(self.sensor_dbm.genSql(sql, (start_time, end_time))):
+            target = _target_units(groups)
+            values = {'usUnits': target}
+            for i in range(len(self.pollutants)):
+                pollutant = self.pollutants[i]
+                columns = slice(2 + (4 * i), 6 + (4 * i))
+                if len(groups) == 1:
+                    # a single unit system is stored exactly as the database aggregated it
+                    (total, count, low, high) = groups[0][columns]
+                else:
+                    (total, count, low, high) = (None, 0, None, None)
+                    for row in groups:
+                        (row_sum, row_count, row_min, row_max) = row[columns]
+                        if not row_count:
+                            continue
+                        convert = _get_converter(self.sensor_columns[pollutant], row[1], target)
+                        if convert is None:
+                            syslog.syslog(syslog.LOG_ERR, "AqiService: can not convert %s readings from unit system %s to %s, skipping %d readings in %s bucket %s" % (
+                                pollutant, row[1], target, row_count, self.table_name, bucket))
+                            continue
+                        # sums are converted by way of their mean, so affine conversions work too
+                        total = (total or 0.0) + convert(row_sum / float(row_count)) * row_count
+                        count += row_count
+                        low = convert(row_min) if low is None else min(low, convert(row_min))
+                        high = convert(row_max) if high is None else max(high, convert(row_max))
+                values[pollutant + '_sum'] = total
+                values[pollutant + '_count'] = count
+                values[pollutant + '_min'] = low
+                values[pollutant + '_max'] = high
+            yield (bucket, values)
+
+    def _gen_weather_buckets(self, start_time, end_time):
+        '''Yields (dateTime, values) for each bucket of temperature and pressure
+        readings with timestamps in (start_time, end_time]. Readings are
+        averaged for each unit system separately, then converted to the
+        bucket's unit system.'''
+        ts = self.weather_columns['dateTime']
+        us_units = self.weather_columns['weather_usUnits']
+        sql = 'SELECT %s AS bucket, %s, AVG(%s), COUNT(%s), AVG(%s), COUNT(%s) FROM %s WHERE %s > ? AND %s <= ? GROUP BY bucket, %s' % (
+            bucket_sql(ts, self.bucket_secs), us_units,
+            self.weather_columns['outTemp'], self.weather_columns['outTemp'],
+            self.weather_columns['pressure'], self.weather_columns['pressure'],
+            self.weather_table_name, ts, ts, us_units)
+        for (bucket, groups) in _gen_unit_groups(self.weather_dbm.genSql(sql, (start_time, end_time))):
+            target = _target_units(groups)
+            values = {'weather_usUnits': target}
+            for (name, i) in [('outTemp', 2), ('pressure', 4)]:
+                if len(groups) == 1:
+                    values[name + '_mean'] = groups[0][i]
+                    continue
+                total = 0.0
+                count = 0
+                for row in groups:
+                    if not row[i + 1]:
+                        continue
+                    convert = _get_converter(self.weather_columns[name], row[1], target)
+                    if convert is None:
+                        syslog.syslog(syslog.LOG_ERR, "AqiService: can not convert %s readings from unit system %s to %s, skipping %d readings in %s bucket %s" % (
+                            name, row[1], target, row[i + 1], self.table_name, bucket))
+                        continue
+                    total += convert(row[i]) * row[i + 1]
+                    count += row[i + 1]
+                values[name + '_mean'] = total / count if count else None
+            yield (bucket, values)
+
+    def _store(self, start_time, end_time, discard=False):
+        '''Recomputes every bucket holding readings in (start_time, end_time]
+        and stores them in a single transaction. If discard is set, the buckets
+        ending in (start_time, end_time] are deleted first, in the same
+        transaction. Returns the number of buckets written.'''
+        buckets = {}
+        for (ts, values) in self._gen_sensor_buckets(start_time, end_time):
+            buckets[ts] = values
+        for (ts, values) in self._gen_weather_buckets(start_time, end_time):
+            # only keep buckets that have pollutant readings
+            if ts in buckets:
+                buckets[ts].update(values)
+
+        with weedb.Transaction(self.dbm.connection) as cursor:
+            if discard:
+                cursor.execute('DELETE FROM %s WHERE dateTime > ? AND dateTime <= ?' % (self.table_name), (start_time, end_time))
+            for ts in sorted(buckets):
+                record = buckets[ts]
+                record['dateTime'] = ts
+                record['interval'] = self.bucket_secs
+                cols = list(record.keys())
+                cursor.execute('REPLACE INTO %s (%s) VALUES (%s)' % (
+                    self.table_name, ', '.join(cols), ', '.join(['?'] * len(cols))),
+                    tuple([record[c] for c in cols]))
+        return len(buckets)
+
+    def update(self, now, lookback_secs):
+        '''Brings the table up to date with readings up to and including `now`.
+        Only the bucket that was partially filled during the last update, and
+        the buckets after it, are recomputed. If the table has never been
+        updated, the preceding `lookback_secs` of readings are summarized.'''
+        if self.last_update is not None and now <= self.last_update:
+            return 0
+        if self.last_update is None:
+            start_time = now - lookback_secs
+        else:
+            start_time = bucket_end(self.last_update, self.bucket_secs) - self.bucket_secs
+        n = self._store(start_time, now)
+        self.last_update = now
+        return n
+
+    def rebuild(self, start_time, end_time):
+        '''Discards and recomputes all buckets covering (start_time, end_time].'''
+        first = bucket_end(start_time + 1, self.bucket_secs)
+        last = bucket_end(end_time, self.bucket_secs)
+        n = self._store(first - self.bucket_secs, last, discard=True)
+        if self.last_update is None or last > self.last_update:
+            self.last_update = last
+        return n
+
+    def gen_buckets(self, start_time, end_time):
+        '''Yields rows of the aggregate table as dicts, for the buckets ending
+        in (start_time, end_time], in ascending order.'''
+        cols = [c[0] for c in schema]
+        sql = 'SELECT %s FROM %s WHERE dateTime > ? AND dateTime <= ? ORDER BY dateTime ASC' % (', '.join(cols), self.table_name)
+        for row in self.dbm.genSql(sql, (start_time, end_time)):
+            yield dict(zip(cols, row))
+
+    def get_means(self, pollutant, start_time, end_time):
+        '''Returns a list of (dateTime, mean, count) for each bucket of
+        `pollutant` ending in (start_time, end_time], newest first. Means are
+        in the sensor's units.'''
+        sql = 'SELECT dateTime, %s_sum, %s_count FROM %s WHERE dateTime > ? AND dateTime <= ? AND %s_count > 0 ORDER BY dateTime DESC' % (
+            pollutant, pollutant, self.table_name, pollutant)
+        means = []
+        for row in self.dbm.genSql(sql, (start_time, end_time)):
+            means.append((row[0], row[1] / float(row[2]), row[2]))
+        return means
+
+def gen_pollutant_stats(dbm, table_name, pollutant, start_time, end_time):
+    '''Yields the statistics of `pollutant` in each bucket of the aggregate
+    table `table_name` ending in (start_time, end_time], in ascending order, as
+    dicts of its dateTime, mean, min, max, count, and the usUnits of the
+    values. Buckets without readings of the pollutant are skipped.'''
+    sql = 'SELECT dateTime, usUnits, %s_sum, %s_count, %s_min, %s_max FROM %s WHERE dateTime > ? AND dateTime <= ? AND %s_count > 0 ORDER BY dateTime ASC' % (
+        pollutant, pollutant, pollutant, pollutant, table_name, pollutant)
+    for row in dbm.genSql(sql, (start_time, end_time)):
+        yield {
+            'dateTime': row[0],
+            'usUnits': row[1],
+            'mean': row[2] / float(row[3]),
+            'count': row[3],
+            'min': row[4],
+            'max': row[5],
+        }
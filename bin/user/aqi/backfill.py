@@ -0,0 +1,49 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import weewx
+
+def gen_archive_records(wx_dbm, start_time, end_time):
+    '''Yields the records of the main weather archive with timestamps in
+    [start_time, end_time), in ascending order, as dicts.'''
+    cols = wx_dbm.connection.columnsOf(wx_dbm.table_name)
+    sql = 'SELECT %s FROM %s WHERE dateTime >= ? AND dateTime < ? ORDER BY dateTime ASC' % (
+        ', '.join(cols), wx_dbm.table_name)
+    for row in wx_dbm.genSql(sql, (start_time, end_time)):
+        yield dict(zip(cols, row))
+
+def backfill(service, wx_dbm, start_time, end_time, progress_fn=None):
+    '''Replays the weather archive records in [start_time, end_time) through
+    the AqiService, as if they had just arrived. progress_fn, if provided, is
+    called with each record after it has been processed. Returns the number of
+    records processed.'''
+    last = wx_dbm.lastGoodStamp()
+    if last is not None:
+        # rebuild the aggregates in one pass, rather than once per interval
+        if service.hourly_aggregates is not None:
+            service.hourly_aggregates.rebuild(start_time, min(end_time, last))
+        if service.bucket_aggregates is not None:
+            # including the buckets in the window of the first record
+            service.bucket_aggregates.rebuild(start_time - service.aqi_standard.max_duration(), min(end_time, last))
+
+    n = 0
+    first = None
+    last = None
+    for record in gen_archive_records(wx_dbm, start_time, end_time):
+        service.new_archive_record(weewx.Event(weewx.NEW_ARCHIVE_RECORD, record=record))
+        n += 1
+        if first is None:
+            first = record['dateTime']
+        last = record['dateTime']
+        if progress_fn is not None:
+            progress_fn(record)
+
+    if n > 0:
+        # Replayed records may have replaced stored ones, which the rollups
+        # ignore, so recompute the days they cover.
+        service.flush()
+        for rollup in [service.category_rollup, service.quantile_rollup]:
+            if rollup is not None:
+                rollup.rebuild(first, last)
+    return n
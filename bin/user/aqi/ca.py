@@ -2,6 +2,7 @@
 # Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
 # License: GPL 3
 
+import bisect
 from . import calculators
 import math
 from . import standards
@@ -27,15 +28,16 @@ class AirQualityHealthIndex(standards.AqiStandards):
             [COLOR_1, COLOR_2, COLOR_3, COLOR_4, COLOR_5, COLOR_6, COLOR_7, COLOR_8, COLOR_9, COLOR_10, COLOR_PLUS],
             ['Low', 'Low', 'Low', 'Moderate', 'Moderate', 'Moderate', 'High', 'High', 'High', 'High', 'Very High'],
             standards.CA_AQHI_GUID)
+        self.obs_frequency_in_sec = obs_frequency_in_sec
         self.calculators[calculators.O3] = calculators.ArithmeticMean(
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=3 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec,
             data_cleaner=calculators.TRUNCATE_TO_0,
             required_observation_ratio=0.6667,
         )
         self.calculators[calculators.NO2] = calculators.ArithmeticMean(
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=3 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec,
             data_cleaner=calculators.TRUNCATE_TO_0,
@@ -55,8 +57,12 @@ class AirQualityHealthIndex(standards.AqiStandards):
     def calculate_composite_aqi(self, pollutants_and_units, observations):
         '''Calcuations are based on the 3 hour average of O3 (ppb), NO2 (ppb), and PM2.5 (ug/m^3).
         Throws ValueError, if readings from all three pollutants are not available.'''
-        observations = observations[:get_last_valid_index(self, observations, 3 * calculators.HOUR) + 1]
-        validate_number_of_observations(observations, self.duration_in_secs, obs_frequency_in_sec, 0.67)
+        if not isinstance(observations, calculators.ObservationWindow):
+            observations = calculators.ObservationWindow(observations)
+        if len(observations) == 0:
+            raise ValueError('no observations')
+        start = bisect.bisect_right(observations.times, observations.times[-1] - 3 * calculators.HOUR)
+        calculators.validate_number_of_observations(observations[start:], 3 * calculators.HOUR, self.obs_frequency_in_sec, 0.67)
 
         # calculate features
         try:
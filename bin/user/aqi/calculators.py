@@ -3,11 +3,15 @@
 # License: GPL 3
 
 from abc import ABCMeta, abstractmethod
+import bisect
+import collections
 import operator
-import syslog
 
+import six
 from six import with_metaclass
 
+from . import logsummary
+
 # number of seconds
 MINUTE = 60
 HOUR = 3600
@@ -32,6 +36,155 @@ O3 = 'o3'
 NH3 = 'nh3'
 PB = 'pb'
 
+_MISSING = object()
+
+class Observation(object):
+    '''A pollutant reading, a weather reading, or the two joined, holding only
+    the columns it was read with. Columns are read and written by key, like a
+    dict, but are kept in slots, so a window of observations takes a fraction
+    of the memory. Reading a missing column raises KeyError.'''
+    __slots__ = ('dateTime', 'usUnits', 'weather_usUnits', 'outTemp', 'pressure',
+        PM2_5, PM10_0, CO, NO2, SO2, O3, NH3, PB)
+
+    def __getitem__(self, column):
+        if column not in _COLUMNS:
+            raise KeyError(column)
+        try:
+            return object.__getattribute__(self, column)
+        except AttributeError:
+            raise KeyError(column)
+
+    def __setitem__(self, column, value):
+        if column not in _COLUMNS:
+            raise KeyError(column)
+        object.__setattr__(self, column, value)
+
+    def __init__(self, columns=(), **kwargs):
+        '''columns is a mapping, or an iterable of (column, value) pairs.'''
+        if hasattr(columns, 'items'):
+            columns = columns.items()
+        for (column, value) in columns:
+            object.__setattr__(self, column, value)
+        for (column, value) in list(kwargs.items()):
+            object.__setattr__(self, column, value)
+
+    def __contains__(self, column):
+        return column in _COLUMNS and hasattr(self, column)
+
+    def get(self, column, default=None):
+        if column not in _COLUMNS:
+            return default
+        return getattr(self, column, default)
+
+    def items(self):
+        items = []
+        for column in Observation.__slots__:
+            value = getattr(self, column, _MISSING)
+            if value is not _MISSING:
+                items.append((column, value))
+        return items
+
+    def keys(self):
+        return [column for (column, value) in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def copy(self):
+        return Observation(self.items())
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+        return dict(self.items()) == dict(list(other.items()))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Observation(%r)' % (dict(self.items()))
+
+_COLUMNS = frozenset(Observation.__slots__)
+
+_BreakpointFields = collections.namedtuple('Breakpoint', ['low_aqi', 'high_aqi', 'low_obs', 'high_obs', 'function'])
+
+class Breakpoint(_BreakpointFields):
+    '''An entry of a BreakpointTable, mapping a range of observations to a
+    range of AQIs. Fields can also be read by name, e.g. breakpoint['low_obs'],
+    like the dicts breakpoints used to be.'''
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, six.string_types):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+class ObservationWindow(object):
+    '''The window of observations an AQI is calculated from, maps containing
+    `dateTime` and pollutant keys, in ascending order of dateTime. Observations
+    that are already in ascending order, like the ones the service reads, are
+    flagged with ascending, and kept as they are; others are sorted once. Each
+    calculator then reads only the observations within its duration, found by
+    a binary search of the timestamps, newest first.'''
+    def __init__(self, observations, ascending=False):
+        observations = list(observations)
+        self.getter = operator.itemgetter
+        if len(observations) > 0 and all([isinstance(o, Observation) for o in observations]):
+            # a window of only Observations has its columns read as
+            # attributes, which is faster than by key
+            self.getter = operator.attrgetter
+        get_time = self.getter('dateTime')
+        if not ascending:
+            observations = sorted(observations, key=get_time)
+        self.observations = observations
+        self.times = [get_time(observation) for observation in observations]
+
+    def __len__(self):
+        return len(self.observations)
+
+    def __iter__(self):
+        return iter(self.observations)
+
+    def __getitem__(self, index):
+        return self.observations[index]
+
+    def newest_first(self, pollutant, data_cleaner, duration_in_secs):
+        '''Returns the cleaned observations of the pollutant, as (dateTime,
+        value) pairs, newest first, back to duration_in_secs before the newest.
+        These are the observations that get_last_valid_index() keeps of all of
+        the cleaned observations, sorted newest first.'''
+        get_value = self.getter(pollutant)
+        times = self.times
+        cleaned = []
+        start = 0
+        i = len(self.observations) - 1
+        while i >= start:
+            value = get_value(self.observations[i])
+            if value is not None:
+                try:
+                    cleaned.append((times[i], data_cleaner(value)))
+                except TypeError as e:
+                    logsummary.event_warnings.warn('cleaning failed', pollutant, "%s at %d threw exception %s", pollutant, times[i], str(e))
+                else:
+                    if len(cleaned) == 1:
+                        # the first invalid timestamp, and everything before it
+                        start = bisect.bisect_right(times, times[i] - duration_in_secs)
+            i -= 1
+        if len(cleaned) == 0:
+            raise ValueError('no observations')
+        return cleaned
+
 def get_last_valid_index(observations, duration_in_secs):
     '''Returns index into observations of the observation that is the
     closest, but not earlier than the earliest valid timestamp.'''
@@ -76,9 +229,9 @@ def validate_number_of_observations(observations, duration_in_secs, obs_frequenc
         raise ValueError('Not enough observations wanted %d, but got %d' % (num_required, len(observations)))
 
 def linear_interpolate(breakpoint, obs_mean):
-    numerator = (obs_mean - breakpoint['low_obs']) * (breakpoint['high_aqi'] - breakpoint['low_aqi'])
-    denominator = breakpoint['high_obs'] - breakpoint['low_obs']
-    return int(round((numerator / float(denominator)) + breakpoint['low_aqi']))
+    numerator = (obs_mean - breakpoint.low_obs) * (breakpoint.high_aqi - breakpoint.low_aqi)
+    denominator = breakpoint.high_obs - breakpoint.low_obs
+    return int(round((numerator / float(denominator)) + breakpoint.low_aqi))
 
 def arithmetic_mean(observations):
     '''Calculates the arithmetic mean from a set of observations.
@@ -90,6 +243,11 @@ def arithmetic_mean(observations):
         obs_mean = obs_mean + obs[1]
     return obs_mean / float(len(observations))
 
+def maximum(observations):
+    '''Returns the maximum measurement from a set of observations, in the same
+    format used by arithmetic_mean().'''
+    return max([obs[1] for obs in observations])
+
 class AqiCalculator(with_metaclass(ABCMeta)):
     def __init__(self, **kwargs):
         '''Creates a new AqiCalculator. Takes the following keyword arguments:
@@ -146,44 +304,35 @@ class AqiCalculator(with_metaclass(ABCMeta)):
         '''Returns the AQI index for the set of observations.
         Observations are recorded as an array of maps containing keys `dateTime`
         (containing epoch seconds for the observation) and the key specified by
-        `pollutant` with a value recorded in units of `observation_unit`.
+        `pollutant` with a value recorded in units of `observation_unit`, or as
+        an ObservationWindow of them.
         Returns a pair containing the AQI and the index to the AQI category.
 
         NOTE: It is imperative that implementations verify the units of
         observations (performing conversions if appropriate), prior calculation.
         Raises ValueError if the observations are somehow invalid (e.g. wrong
         units, wrong time range, too many missing values, etc.).'''
+        return self._calculate_index_from_mean(self.calculate_mean(pollutant, observation_unit, observations))
+
+    def calculate_mean(self, pollutant, observation_unit, observations):
+        '''Returns the cleaned mean of the observations, that calculate() maps
+        to an AQI. Raises ValueError like calculate().'''
         if observation_unit != self.unit:
             raise ValueError('inappropriate units, expected %s, but got %s' % (self.unit, observation_unit))
 
-        # clean the data
-        observations = sorted(observations, key=operator.itemgetter('dateTime'), reverse=True)
-
-        j = 0
-        clean_observations = [None] * len(observations)
-        for i in range(len(observations)):
-            if observations[i][pollutant] is None:
-                continue
-            try:
-                clean_observations[j] = (observations[i]['dateTime'], self.data_cleaner(observations[i][pollutant]))
-                j += 1
-            except TypeError as e:
-                syslog.syslog(syslog.LOG_WARNING, "%s at %d threw exception %s" % (pollutant, observations[i]['dateTime'], str(e)))
-        observations = clean_observations[:j]
+        # clean the observations in the duration
+        if not isinstance(observations, ObservationWindow):
+            observations = ObservationWindow(observations)
+        observations = observations.newest_first(pollutant, self.data_cleaner, self.duration_in_secs)
 
         # validate observations
-        last_valid_index = get_last_valid_index(observations, self.duration_in_secs)
-        observations = observations[:last_valid_index + 1]
         validate_number_of_observations(observations,
             self.duration_in_secs,
             self.obs_frequency_in_sec,
             self.required_observation_ratio)
 
         # calculate the mean observation
-        obs_mean = self.mean_cleaner(self.mean_calculator(observations))
-
-        # map the mean to an AQI value
-        return self._calculate_index_from_mean(obs_mean)
+        return self.mean_cleaner(self.mean_calculator(observations))
 
     @abstractmethod
     def _calculate_index_from_mean(self, mean):
@@ -268,28 +417,22 @@ class BreakpointTable(AqiCalculator):
 
     def add_breakpoint(self, low_aqi, high_aqi, low_obs, high_obs, function=linear_interpolate):
         '''Adds an entry to the table, mapping a range of AQIs to a range of observations.'''
-        self.breakpoints.append({
-            'low_aqi':  low_aqi,
-            'high_aqi': high_aqi,
-            'low_obs':  low_obs,
-            'high_obs': high_obs,
-            'function': function,
-        })
-        self.breakpoints = sorted(self.breakpoints, key=operator.itemgetter('low_obs'))
+        self.breakpoints.append(Breakpoint(low_aqi, high_aqi, low_obs, high_obs, function))
+        self.breakpoints = sorted(self.breakpoints, key=operator.attrgetter('low_obs'))
         return self
 
     def _calculate_index_from_mean(self, obs_mean):
         for bp_index in range(len(self.breakpoints)):
             breakpoint = self.breakpoints[bp_index]
-            if breakpoint['low_obs'] <= obs_mean and obs_mean <= breakpoint['high_obs']:
-                return (breakpoint['function'](breakpoint, obs_mean), bp_index + self.bp_index_offset)
+            if breakpoint.low_obs <= obs_mean and obs_mean <= breakpoint.high_obs:
+                return (breakpoint.function(breakpoint, obs_mean), bp_index + self.bp_index_offset)
         raise IndexError('AQI can not be calculated from this table')
 
 class ArithmeticMean(AqiCalculator):
     '''Simply calculates the arithmetic mean of a set of observations.'''
     def __init__(self, **kwargs):
         kwargs['mean_calculator'] = arithmetic_mean
-        super(ArithmeticMean, self).__init__(kwargs)
+        super(ArithmeticMean, self).__init__(**kwargs)
 
     def _calculate_index_from_mean(self, obs_mean):
         return (obs_mean, None)
@@ -310,12 +453,12 @@ class LinearScale(AqiCalculator):
     '''
     def __init__(self, **kwargs):
         super(LinearScale, self).__init__(**kwargs)
-        self.interpolation_config = {
-            'low_obs': kwargs.get('low_obs', 0),
-            'high_obs': kwargs['high_obs'],
-            'low_aqi': kwargs.get('low_aqi', 0),
-            'high_aqi': kwargs.get('high_aqi', 100)
-        }
+        self.interpolation_config = Breakpoint(
+            kwargs.get('low_aqi', 0),
+            kwargs.get('high_aqi', 100),
+            kwargs.get('low_obs', 0),
+            kwargs['high_obs'],
+            linear_interpolate)
         self.breakpoints = kwargs['breakpoints']
 
     def _calculate_index_from_mean(self, obs_mean):
@@ -136,7 +136,7 @@ class CommonAirQualityHourlyIndex(standards.AqiStandards):
     Section 4.1, Table 7.
     '''
     def __init__(self, obs_frequency_in_sec):
-        super(CommonAirQualityIndex, self).__init__(
+        super(CommonAirQualityHourlyIndex, self).__init__(
             [CAQI_GREEN, CAQI_LIGHT_GREEN, CAQI_YELLOW, CAQI_ORANGE, CAQI_RED],
             ['Very Low', 'Low', 'Medium', 'High', 'Very High'],
             standards.EU_CAQI_H_GUID)
@@ -0,0 +1,241 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import json
+import os
+import re
+import syslog
+import time
+
+import weeutil.weeutil
+import weewx.reportengine
+
+from . import aggregates
+from . import fileutil
+from . import rollups
+from . import standards
+
+FORMATS = ['json', 'csv']
+AGGREGATE_TYPES = {
+    'max': 'MAX',
+    'min': 'MIN',
+    'mean': 'AVG',
+}
+
+# how far, as a fraction of its length, a feed may grow past its span before
+# it is compacted
+DEFAULT_SLACK = 0.1
+
+# seconds of points before the last one that are rewritten with each update,
+# since the AqiService may store an AQI deferred by its time budget after the
+# record's point was written
+DEFAULT_REFRESH = 3600
+
+# the start of each point, and its timestamp, with the offset from the start
+# of the match at which the points from that one on are cut off
+_POINTS = {
+    'json': (re.compile(r'[,\[]\[(\d+),'), 0),
+    'csv': (re.compile(r'\n(\d+),'), 1),
+}
+
+def _format_value(value):
+    if value is None:
+        return None
+    return round(value, 2)
+
+def _format_points(points, fmt):
+    '''Returns the points, a list of (dateTime, aqi), as the text appended to
+    a feed.'''
+    if fmt == 'json':
+        return ','.join([json.dumps([ts, _format_value(v)], separators=(',', ':')) for (ts, v) in points])
+    return ''.join(['%d,%s\n' % (ts, '' if v is None else repr(_format_value(v))) for (ts, v) in points])
+
+def _parse_timestamp(text, fmt):
+    '''Returns the timestamp of the point at the start of text.'''
+    if fmt == 'json':
+        return int(text.lstrip('[,').split(',', 1)[0])
+    return int(text.split(',', 1)[0])
+
+def read_bounds(path, fmt):
+    '''Returns the timestamps of the first and last points of the feed, or
+    None if the feed does not exist, is empty, or can not be parsed.'''
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(64).decode('ascii')
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 64))
+            tail = f.read().decode('ascii')
+    except (IOError, OSError, UnicodeDecodeError):
+        return None
+    try:
+        if fmt == 'json':
+            if not head.startswith('[[') or not tail.endswith(']]'):
+                return None
+            first = _parse_timestamp(head[1:], fmt)
+            last = _parse_timestamp(tail[tail.rindex('[', 0, len(tail) - 1):], fmt)
+        else:
+            lines = head.split('\n')
+            if len(lines) < 3 or not tail.endswith('\n'):
+                return None
+            first = _parse_timestamp(lines[1], fmt)
+            last = _parse_timestamp(tail[:-1].split('\n')[-1], fmt)
+    except ValueError:
+        return None
+    return (first, last)
+
+def _find_cut(f, fmt, since):
+    '''Returns the offset in the open feed file f from which its points after
+    the timestamp since are written, or None if the first point is after
+    since. The file is read backwards from its end, as far as needed.'''
+    (pattern, shift) = _POINTS[fmt]
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    if fmt == 'json':
+        # before the closing bracket
+        end -= 1
+    block = 4096
+    while True:
+        start = max(0, end - block)
+        f.seek(start)
+        text = f.read(end - start).decode('ascii')
+        points = [(start + m.start() + shift, int(m.group(1))) for m in pattern.finditer(text)]
+        if len(points) > 0 and points[0][1] <= since:
+            cut = end
+            for (offset, ts) in reversed(points):
+                if ts <= since:
+                    return cut
+                cut = offset
+        if start == 0:
+            return None
+        block *= 2
+
+class Feed(object):
+    '''A series of one pollutant's AQIs over a span ending with the latest AQI
+    record, kept in a JSON or CSV file. New points are appended to the file,
+    and the points of the `refresh` seconds before them are rewritten, so
+    that AQIs stored after their record's point was written are picked up.
+    Once the oldest point is more than `slack` of the length older than the
+    span, the file is rewritten with only the points in the span.
+
+    Points are either the AQI records themselves, or if aggregate_interval is
+    set, the max, min, or mean AQI of each complete interval, timestamped with
+    the end of the interval. JSON feeds are an array of [dateTime, aqi]
+    pairs. CSV feeds have a header row, followed by dateTime,aqi rows.'''
+    def __init__(self, path, fmt, pollutant, length, aggregate_interval=None, aggregate_type='max', slack=DEFAULT_SLACK,
+            refresh=DEFAULT_REFRESH):
+        if fmt not in FORMATS:
+            raise ValueError('unknown feed format %s' % (fmt))
+        if pollutant not in rollups.POLLUTANTS:
+            raise ValueError('unknown pollutant %s' % (pollutant))
+        if aggregate_type not in AGGREGATE_TYPES:
+            raise ValueError('unknown aggregate type %s' % (aggregate_type))
+        self.path = path
+        self.fmt = fmt
+        self.pollutant = pollutant
+        self.length = length
+        self.aggregate_interval = aggregate_interval
+        self.aggregate_type = aggregate_type
+        self.slack = slack
+        self.refresh = refresh
+
+    def _query(self, dbm, aqi_standard, start_time, end_time):
+        '''Returns the points in (start_time, end_time].'''
+        column = 'aqi_' + self.pollutant
+        if self.aggregate_interval:
+            # only complete intervals
+            end_time = aggregates.bucket_end(end_time + 1, self.aggregate_interval) - self.aggregate_interval
+            sql = 'SELECT %s AS bucket, %s(%s) FROM %s WHERE dateTime > ? AND dateTime <= ? AND aqi_standard = ? ' \
+                'GROUP BY bucket ORDER BY bucket ASC' % (
+                aggregates.bucket_sql('dateTime', self.aggregate_interval),
+                AGGREGATE_TYPES[self.aggregate_type], column, dbm.table_name)
+        else:
+            sql = 'SELECT dateTime, %s FROM %s WHERE dateTime > ? AND dateTime <= ? AND aqi_standard = ? ' \
+                'ORDER BY dateTime ASC' % (column, dbm.table_name)
+        if end_time <= start_time:
+            return []
+        return [tuple(row) for row in dbm.genSql(sql, (start_time, end_time, aqi_standard))]
+
+    def rebuild(self, dbm, aqi_standard, now):
+        '''Rewrites the feed with the points in the span ending at now.
+        Returns the number of points written.'''
+        points = self._query(dbm, aqi_standard, now - self.length, now)
+        if self.fmt == 'json':
+            contents = '[' + _format_points(points, self.fmt) + ']'
+        else:
+            contents = 'dateTime,aqi_%s\n' % (self.pollutant) + _format_points(points, self.fmt)
+        fileutil.atomic_write(self.path, contents)
+        return len(points)
+
+    def update(self, dbm, aqi_standard, now):
+        '''Brings the feed up to date with the AQI records up to now, appending
+        the new points and rewriting those of the last `refresh` seconds, or
+        rebuilding the feed if it is missing or due for compaction. Returns
+        the number of points written.'''
+        bounds = read_bounds(self.path, self.fmt)
+        if bounds is None or bounds[0] <= now - (self.length * (1 + self.slack)) or bounds[1] > now:
+            return self.rebuild(dbm, aqi_standard, now)
+        since = bounds[1] - self.refresh
+        if self.aggregate_interval:
+            # whole intervals
+            since -= since % self.aggregate_interval
+        points = self._query(dbm, aqi_standard, since, now)
+        with open(self.path, 'r+b') as f:
+            cut = _find_cut(f, self.fmt, since)
+            if cut is not None:
+                f.seek(cut)
+                f.truncate()
+                text = _format_points(points, self.fmt)
+                if self.fmt == 'json':
+                    f.write(((',' if len(points) > 0 else '') + text + ']').encode('ascii'))
+                else:
+                    f.write(text.encode('ascii'))
+        if cut is None:
+            # the refreshed points start before the feed
+            return self.rebuild(dbm, aqi_standard, now)
+        return len(points)
+
+def make_feeds(feeds_dict, directory):
+    '''Returns the Feeds configured by the [AqiFeeds] section of a skin.'''
+    pollutants = weeutil.weeutil.option_as_list(feeds_dict.get('pollutants', [rollups.COMPOSITE]))
+    formats = weeutil.weeutil.option_as_list(feeds_dict.get('formats', ['json']))
+    slack = float(feeds_dict.get('slack', DEFAULT_SLACK))
+    refresh = int(feeds_dict.get('refresh', DEFAULT_REFRESH))
+    feeds = []
+    for span in getattr(feeds_dict, 'sections', []):
+        span_dict = feeds_dict[span]
+        aggregate_interval = int(span_dict.get('aggregate_interval', 0)) or None
+        for pollutant in pollutants:
+            for fmt in formats:
+                feeds.append(Feed(os.path.join(directory, 'aqi_%s_%s.%s' % (pollutant, span, fmt)), fmt, pollutant,
+                    int(span_dict['length']), aggregate_interval, span_dict.get('aggregate_type', 'max'), slack, refresh))
+    return feeds
+
+class AqiFeedGenerator(weewx.reportengine.ReportGenerator):
+    '''Report generator that keeps chart data feeds of the AQI history up to
+    date, appending the newest points each time it runs. It is
+    configured by the [AqiFeeds] section of its skin.'''
+    def run(self):
+        aqi_config_dict = self.config_dict['AqiService']['standard']
+        feeds_dict = self.skin_dict.get('AqiFeeds', {})
+        data_binding = feeds_dict.get('data_binding', aqi_config_dict['data_binding'])
+        aqi_standard = standards.get_standard(aqi_config_dict['standard'],
+            int(self.config_dict['StdArchive']['archive_interval']))
+        directory = os.path.join(self.config_dict['WEEWX_ROOT'], self.skin_dict['HTML_ROOT'])
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        start = time.time()
+        dbm = self.db_binder.get_manager(data_binding)
+        now = dbm.lastGoodStamp()
+        if now is None:
+            return
+        n = 0
+        feeds = make_feeds(feeds_dict, directory)
+        for feed in feeds:
+            try:
+                n += feed.update(dbm, aqi_standard.guid, now)
+            except (IOError, OSError) as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not update feed %s: %s" % (feed.path, str(e)))
+        syslog.syslog(syslog.LOG_INFO, "AqiService: wrote %d points to %d feeds in %.2f seconds" % (n, len(feeds), time.time() - start))
@@ -0,0 +1,25 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import os
+import tempfile
+
+def atomic_write(path, contents):
+    '''Replaces the file at path with contents, such that readers only ever
+    see the old or the new file, never a partially written one. The temporary
+    file is created in the same directory, so the final rename does not cross
+    file systems.'''
+    directory = os.path.dirname(os.path.abspath(path))
+    (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(contents)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -76,14 +76,14 @@ class NationalAirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.O3].add_calculator(calculators.BreakpointTable(
             data_cleaner=calculators.ROUND_TO_0,
             mean_cleaner=calculators.ROUND_TO_0,
-            mean_calculator=max,            # not average, it's a maximum
+            mean_calculator=calculators.maximum,    # not average, it's a maximum
             unit='microgram_per_meter_cubed',
             duration_in_secs=8 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  0,  50,   0,  50) \
             .add_breakpoint( 51, 100,  51, 100) \
             .add_breakpoint(101, 200, 101, 168) \
-            .add_breakpoint(201, 300, 169, 208)
+            .add_breakpoint(201, 300, 169, 208))
         self.calculators[calculators.O3].add_calculator(calculators.BreakpointTable(
             data_cleaner=calculators.ROUND_TO_0,
             mean_cleaner=calculators.ROUND_TO_0,
@@ -91,13 +91,13 @@ class NationalAirQualityIndex(standards.AqiStandards):
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec,
             bp_index_offset=4) \
-            .add_breakpoint(301, 400, 209,  748) \     # lower bound not defined(!) Pure speculation.
-            .add_breakpoint(401, 500, 749, 1288)       # upper bound not defined(!) Pure speculation.
+            .add_breakpoint(301, 400, 209,  748)       # lower bound not defined(!) Pure speculation.
+            .add_breakpoint(401, 500, 749, 1288))      # upper bound not defined(!) Pure speculation.
 
         self.calculators[calculators.CO] = calculators.BreakpointTable(
             data_cleaner=calculators.ROUND_TO_1,
             mean_cleaner=calculators.ROUND_TO_1,
-            mean_calculator=max,            # not average, it's a maximum
+            mean_calculator=calculators.maximum,    # not average, it's a maximum
             unit='milligram_per_meter_cubed',
             duration_in_secs=8 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
@@ -0,0 +1,414 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import copy
+import json
+import syslog
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+from . import fileutil
+
+# perf_counter is only available in python 3
+clock = getattr(time, 'perf_counter', time.time)
+
+# upper bounds, in seconds, of the histogram buckets
+BUCKET_BOUNDS = [
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0,
+    10.0, 25.0, 60.0,
+]
+
+class Histogram(object):
+    '''Histogram of durations with fixed, logarithmically spaced buckets. The
+    final bucket holds everything larger than the last bound.'''
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, secs):
+        i = 0
+        while i < len(BUCKET_BOUNDS) and secs > BUCKET_BOUNDS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += secs
+        if secs > self.max:
+            self.max = secs
+
+    def quantile(self, q):
+        '''Returns the upper bound of the bucket holding the q-th quantile. For
+        the overflow bucket, the maximum observed value is returned.'''
+        if self.count == 0:
+            return 0.0
+        needed = q * self.count
+        seen = 0
+        for i in range(len(self.counts)):
+            seen += self.counts[i]
+            if seen >= needed and self.counts[i] > 0:
+                if i < len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[i], self.max)
+                break
+        return self.max
+
+    def to_dict(self):
+        buckets = {}
+        for i in range(len(BUCKET_BOUNDS)):
+            buckets['%g' % BUCKET_BOUNDS[i]] = self.counts[i]
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'buckets': buckets,
+        }
+
+class _Stage(object):
+    '''Context manager timing a single stage.'''
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer._push(self.name)
+        return self
+
+    def __exit__(self, etype, evalue, etb):
+        self.timer._pop()
+        return False
+
+class _Event(object):
+    '''Context manager timing an entire event.'''
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.timer._begin_event()
+        return self
+
+    def __exit__(self, etype, evalue, etb):
+        self.timer._end_event()
+        return False
+
+def describe_calculator(pollutant, calculator):
+    '''Returns a stage name describing calculator, e.g. calculator.o3.BreakpointTable.8h'''
+    duration = calculator.max_duration()
+    if duration is None:
+        return 'calculator.%s.%s' % (pollutant, type(calculator).__name__)
+    return 'calculator.%s.%s.%gh' % (pollutant, type(calculator).__name__, duration / 3600.0)
+
+class _TimedCalculator(object):
+    '''Wraps a calculator, timing its calculate() as the named stage.'''
+    def __init__(self, timer, name, calculator):
+        self.timer = timer
+        self.name = name
+        self.calculator = calculator
+
+    def calculate(self, pollutant, observation_unit, observations):
+        with self.timer.stage(self.name):
+            return self.calculator.calculate(pollutant, observation_unit, observations)
+
+    def __getattr__(self, name):
+        return getattr(self.calculator, name)
+
+class StageTimer(object):
+    '''Times the stages of processing an event. Stages may be nested. The time
+    recorded for a stage excludes the time spent in the stages nested inside
+    it, so the stages of an event add up to the `event` total. The residual
+    that is not covered by any stage is recorded as `other`.
+
+    Each stage's total time per event is added to a histogram. Every
+    `emit_interval` seconds, the histograms are summarized to syslog at debug
+    priority, optionally written as JSON to `stats_file`, and then reset.'''
+    def __init__(self, emit_interval=3600, stats_file=None):
+        self.emit_interval = emit_interval
+        self.stats_file = stats_file
+        self.histograms = {}
+        self.window_start = time.time()
+        self._stack = []
+        self._event_totals = {}
+
+    def event(self):
+        '''Returns a context manager that times an entire event.'''
+        return _Event(self)
+
+    def stage(self, name):
+        '''Returns a context manager that times the named stage.'''
+        return _Stage(self, name)
+
+    def timed_iter(self, name, iterable):
+        '''Wraps iterable so that the time spent producing its items is
+        attributed to the named stage. This is used for lazy database cursors,
+        where the query runs as rows are consumed. Each row is only timed with
+        the clock, and the stage is recorded once, when the iteration ends, so
+        the loop consuming the rows is not slowed down by the timer.'''
+        it = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += clock() - start
+                yield item
+        finally:
+            self._add(name, elapsed)
+
+    def timed_standard(self, standard):
+        '''Returns a copy of standard that times every calculator individually,
+        including the calculators inside of a CalculatorCollection. Standards
+        are shared by every service in the process, so standard itself is left
+        untouched.'''
+        timed = copy.copy(standard)
+        timed.calculators = {}
+        for (pollutant, calculator) in list(standard.calculators.items()):
+            if hasattr(calculator, 'calculators'):
+                calculator = copy.copy(calculator)
+                calculator.calculators = [_TimedCalculator(self, describe_calculator(pollutant, sub_calculator), sub_calculator)
+                    for sub_calculator in calculator.calculators]
+            timed.calculators[pollutant] = _TimedCalculator(self, describe_calculator(pollutant, calculator), calculator)
+        return timed
+
+    def _push(self, name):
+        self._stack.append([name, clock(), 0.0])
+
+    def _pop(self):
+        (name, start, nested) = self._stack.pop()
+        elapsed = clock() - start
+        self._event_totals[name] = self._event_totals.get(name, 0.0) + elapsed - nested
+        if len(self._stack) > 0:
+            self._stack[-1][2] += elapsed
+        return elapsed
+
+    def _add(self, name, secs):
+        '''Attributes secs to the named stage, nested in the current stage.'''
+        self._event_totals[name] = self._event_totals.get(name, 0.0) + secs
+        if len(self._stack) > 0:
+            self._stack[-1][2] += secs
+
+    def _begin_event(self):
+        self._stack = []
+        self._event_totals = {}
+        self._push('other')
+
+    def _end_event(self):
+        self._record_event(self._pop())
+        if time.time() - self.window_start >= self.emit_interval:
+            self.emit()
+
+    def _record_event(self, elapsed):
+        self._event_totals['event'] = elapsed
+        for (name, secs) in list(self._event_totals.items()):
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(secs)
+        self._event_totals = {}
+
+    def emit(self):
+        '''Summarizes the histograms to syslog, and the stats file if
+        configured, then starts a new window.'''
+        if len(self.histograms) == 0:
+            return
+        now = time.time()
+        names = sorted(self.histograms, key=lambda n: self.histograms[n].total, reverse=True)
+        for name in names:
+            h = self.histograms[name]
+            syslog.syslog(syslog.LOG_DEBUG, "AqiService: timing %s: %d events, mean %.2f ms, p50 %.2f ms, p95 %.2f ms, max %.2f ms" % (
+                name, h.count, 1000.0 * h.total / h.count, 1000.0 * h.quantile(0.50),
+                1000.0 * h.quantile(0.95), 1000.0 * h.max))
+        if self.stats_file:
+            stats = {
+                'window_start': self.window_start,
+                'window_end': now,
+                'stages': dict([(name, self.histograms[name].to_dict()) for name in names]),
+            }
+            try:
+                fileutil.atomic_write(self.stats_file, json.dumps(stats, indent=2, sort_keys=True))
+            except (IOError, OSError) as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not write timing stats to %s: %s" % (self.stats_file, str(e)))
+        self.histograms = {}
+        self.window_start = now
+
+def format_bytes(n):
+    '''Returns n bytes in human readable units.'''
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(n) < 1024.0:
+            return '%.1f %s' % (n, unit)
+        n /= 1024.0
+    return '%.1f GiB' % (n)
+
+def memory_profiling_available():
+    '''Per-stage peaks need tracemalloc.reset_peak(), which was added in
+    python 3.9.'''
+    return tracemalloc is not None and hasattr(tracemalloc, 'reset_peak')
+
+class MemoryProfiler(StageTimer):
+    '''StageTimer that also traces python memory allocations with
+    tracemalloc. For every stage of an event, it records the peak memory
+    allocated while the stage ran, above what was allocated when it started.
+    Unlike times, peaks include the stages nested inside the stage. Memory is
+    only sampled when a stage starts and ends, never per row of a timed
+    iterator, so the rows' allocations count towards the stage consuming them.
+    Each event's peaks are written to syslog.
+
+    Whenever a stage ends with the live allocations 10% beyond the largest
+    seen in the window, a snapshot of them is taken, replacing the previous
+    one. At the end of the window the `top_allocations` sites of that
+    snapshot, along with the stages' peaks, are written to syslog and, if
+    configured, as JSON to `report_file`.
+
+    Tracing slows down processing considerably, so the times are only
+    emitted if `log_timing` is set.'''
+    def __init__(self, emit_interval=3600, stats_file=None, report_file=None, top_allocations=10, frames=1, log_timing=False):
+        super(MemoryProfiler, self).__init__(emit_interval, stats_file)
+        self.report_file = report_file
+        self.top_allocations = top_allocations
+        self.frames = frames
+        self.log_timing = log_timing
+        self.peaks = {}
+        self.snapshot = None
+        self.snapshot_size = 0
+        self._memory_stack = []
+        self._event_peaks = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def _push(self, name):
+        (current, peak) = tracemalloc.get_traced_memory()
+        if len(self._memory_stack) > 0:
+            parent = self._memory_stack[-1]
+            parent[1] = max(parent[1], peak)
+        tracemalloc.reset_peak()
+        self._memory_stack.append([current, current])
+        super(MemoryProfiler, self)._push(name)
+
+    def _pop(self):
+        name = self._stack[-1][0]
+        elapsed = super(MemoryProfiler, self)._pop()
+        (current, peak) = tracemalloc.get_traced_memory()
+        (start, stage_peak) = self._memory_stack.pop()
+        stage_peak = max(stage_peak, peak)
+        if len(self._memory_stack) > 0:
+            parent = self._memory_stack[-1]
+            parent[1] = max(parent[1], stage_peak)
+        else:
+            # the bottom of the stack covers the entire event
+            name = 'event'
+        self._event_peaks[name] = max(self._event_peaks.get(name, 0), stage_peak - start)
+        tracemalloc.reset_peak()
+
+        # snapshots are expensive, so only take one when the live allocations
+        # have grown significantly
+        if current > self.snapshot_size * 1.1:
+            self.snapshot_size = current
+            self.snapshot = tracemalloc.take_snapshot()
+        return elapsed
+
+    def _begin_event(self):
+        self._memory_stack = []
+        self._event_peaks = {}
+        super(MemoryProfiler, self)._begin_event()
+
+    def _record_event(self, elapsed):
+        super(MemoryProfiler, self)._record_event(elapsed)
+        peaks = self._event_peaks
+        self._event_peaks = {}
+        for (name, peak) in list(peaks.items()):
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        names = sorted([n for n in peaks if n != 'event' and peaks[n] > 0], key=lambda n: peaks[n], reverse=True)
+        syslog.syslog(syslog.LOG_INFO, "AqiService: memory peak %s (%s)" % (
+            format_bytes(peaks.get('event', 0)),
+            ', '.join(['%s %s' % (n, format_bytes(peaks[n])) for n in names])))
+
+    def top_allocation_sites(self):
+        '''Returns the largest allocation sites in the snapshot, as a list of
+        dicts. Tracebacks list the most recent frame first.'''
+        if self.snapshot is None:
+            return []
+        snapshot = self.snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        sites = []
+        for stat in snapshot.statistics('traceback' if self.frames > 1 else 'lineno')[:self.top_allocations]:
+            sites.append({
+                'size': stat.size,
+                'count': stat.count,
+                'traceback': ['%s:%d' % (frame.filename, frame.lineno) for frame in reversed(list(stat.traceback))],
+            })
+        return sites
+
+    def emit(self):
+        '''Summarizes the peaks and the top allocation sites to syslog, and
+        the report file if configured, then starts a new window.'''
+        window_start = self.window_start
+        if self.log_timing:
+            super(MemoryProfiler, self).emit()
+        else:
+            self.histograms = {}
+            self.window_start = time.time()
+        if len(self.peaks) == 0:
+            return
+
+        sites = self.top_allocation_sites()
+        for site in sites:
+            syslog.syslog(syslog.LOG_INFO, "AqiService: memory %s in %d blocks allocated at %s" % (
+                format_bytes(site['size']), site['count'], ' < '.join(site['traceback'])))
+        if self.report_file:
+            report = {
+                'window_start': window_start,
+                'window_end': self.window_start,
+                'peaks': self.peaks,
+                'top_allocations': sites,
+            }
+            try:
+                fileutil.atomic_write(self.report_file, json.dumps(report, indent=2, sort_keys=True))
+            except (IOError, OSError) as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not write memory report to %s: %s" % (self.report_file, str(e)))
+        self.peaks = {}
+        self.snapshot = None
+        self.snapshot_size = 0
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, etb):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+class NullTimer(object):
+    '''Drop in replacement for StageTimer that does nothing. Used when
+    instrumentation is disabled.'''
+    def event(self):
+        return _NULL_CONTEXT
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def timed_iter(self, name, iterable):
+        return iterable
+
+    def timed_standard(self, standard):
+        return standard
+
+    def emit(self):
+        pass
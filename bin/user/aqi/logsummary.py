@@ -0,0 +1,78 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import syslog
+import time
+
+class WarningSummary(object):
+    '''Collects the warnings raised while processing an event, counting them by
+    cause and pollutant, instead of writing each one to syslog. At the end of
+    the event, flush() writes a single summary line. Identical summaries, i.e.
+    those with the same causes and pollutants, are written at most once every
+    `interval` seconds. Suppressed summaries are counted, and the count is
+    reported with the next summary that is written.'''
+    def __init__(self, interval=3600):
+        self.interval = interval
+        self.counts = {}
+        self.examples = {}
+        self.last_emitted = {}
+        self.suppressed = {}
+
+    def warn(self, cause, pollutant, fmt, *args):
+        '''Records a warning. The message is only formatted for the first
+        warning of each cause and pollutant in the event, where it is kept as
+        an example.'''
+        key = (cause, pollutant)
+        n = self.counts.get(key)
+        if n is None:
+            self.counts[key] = 1
+            self.examples[key] = fmt % args
+        else:
+            self.counts[key] = n + 1
+
+    def summarize(self):
+        '''Returns a description of the warnings collected, or None if there
+        were none.'''
+        if len(self.counts) == 0:
+            return None
+        parts = []
+        for key in sorted(self.counts, key=lambda k: (k[0], k[1] or '')):
+            (cause, pollutant) = key
+            name = cause if pollutant is None else '%s %s' % (cause, pollutant)
+            parts.append('%s x%d (e.g. %s)' % (name, self.counts[key], self.examples[key]))
+        return '; '.join(parts)
+
+    def flush(self, prefix, now=None):
+        '''Writes the summary of the collected warnings to syslog, unless an
+        identical summary was written in the last `interval` seconds, then
+        clears the counters. Returns the line written, or None.'''
+        if len(self.counts) == 0:
+            return None
+        if now is None:
+            now = time.time()
+        signature = tuple(sorted(self.counts, key=lambda k: (k[0], k[1] or '')))
+        line = None
+        last = self.last_emitted.get(signature)
+        if last is None or (now - last) >= self.interval:
+            line = prefix + self.summarize()
+            suppressed = self.suppressed.pop(signature, 0)
+            if suppressed > 0:
+                line += ' (%d similar summaries suppressed)' % (suppressed)
+            syslog.syslog(syslog.LOG_WARNING, line)
+            self.last_emitted[signature] = now
+        else:
+            self.suppressed[signature] = self.suppressed.get(signature, 0) + 1
+
+        # forget summaries that can no longer be suppressed
+        for (sig, emitted) in list(self.last_emitted.items()):
+            if (now - emitted) >= self.interval and sig not in self.suppressed:
+                del self.last_emitted[sig]
+
+        self.counts = {}
+        self.examples = {}
+        return line
+
+# Warnings raised while processing the current event. The calculators record
+# their warnings here, and AqiService flushes it at the end of each event.
+event_warnings = WarningSummary()
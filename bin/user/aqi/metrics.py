@@ -0,0 +1,96 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+from . import fileutil
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class Metrics(object):
+    '''A small registry of counters and gauges, that can be rendered in the
+    Prometheus text exposition format. Every metric must be declared with
+    counter() or gauge() before it is used. Names are prefixed with `prefix`.'''
+    def __init__(self, prefix='weewx_aqi'):
+        self.prefix = prefix
+        self.declarations = {}
+        self.values = {}
+
+    def counter(self, name, help_text):
+        '''Declares a counter, a value that only ever increases.'''
+        self.declarations[name] = (COUNTER, help_text)
+        self.values.setdefault(name, {})
+
+    def gauge(self, name, help_text):
+        '''Declares a gauge, a value that may go up or down.'''
+        self.declarations[name] = (GAUGE, help_text)
+        self.values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        '''Increments the counter `name` with the specified labels.'''
+        series = self.values[name]
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        '''Sets the gauge `name` with the specified labels.'''
+        self.values[name][tuple(sorted(labels.items()))] = value
+
+    def get(self, name, **labels):
+        '''Returns the current value of the metric, or 0 if it has never been set.'''
+        return self.values[name].get(tuple(sorted(labels.items())), 0)
+
+    def to_prometheus(self):
+        '''Returns all metrics in the Prometheus text exposition format.'''
+        lines = []
+        for name in sorted(self.declarations):
+            (metric_type, help_text) = self.declarations[name]
+            full_name = self.prefix + '_' + name
+            lines.append('# HELP %s %s' % (full_name, help_text))
+            lines.append('# TYPE %s %s' % (full_name, metric_type))
+            series = self.values[name]
+            if len(series) == 0 and metric_type == COUNTER:
+                # counters without labels are exported from the start, so rates work
+                series = {(): 0}
+            for key in sorted(series):
+                if len(key) == 0:
+                    lines.append('%s %s' % (full_name, _format_value(series[key])))
+                else:
+                    labels = ','.join(['%s="%s"' % (k, _escape_label_value(v)) for (k, v) in key])
+                    lines.append('%s{%s} %s' % (full_name, labels, _format_value(series[key])))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Atomically replaces the file at path with the current metrics. This
+        is suitable for the node_exporter textfile collector, which must never
+        see a partially written file.'''
+        fileutil.atomic_write(path, self.to_prometheus())
+
+def service_metrics():
+    '''Returns the Metrics maintained by AqiService.'''
+    m = Metrics()
+    m.counter('events_total', 'Archive records processed.')
+    m.counter('rows_fetched_total', 'Rows read from the sensor and weather databases.')
+    m.counter('rows_joined_total', 'Pollutant rows that were joined with a weather row.')
+    m.counter('rows_dropped_total', 'Pollutant rows that were read, but could not be joined with a weather row.')
+    m.counter('calculation_failures_total', 'AQI calculations that failed, by pollutant and exception type.')
+    m.counter('warnings_total', 'Warnings raised while processing archive records, by cause and pollutant.')
+    m.counter('records_written_total', 'AQI records written to the aqi store.')
+    m.counter('records_skipped_total', 'Archive records for which no AQI could be calculated.')
+    m.counter('catchup_batches_total', 'Batches of backlogged archive records processed together.')
+    m.counter('retention_rows_total', 'AQI records compacted by the retention policy.')
+    m.counter('deferred_aqis_total', 'AQIs deferred by the time budget, by pollutant.')
+    m.gauge('pending_records', 'Backlogged archive records held to be processed in a batch.')
+    m.gauge('deferred_records', 'Archive records with AQIs deferred by the time budget.')
+    m.gauge('event_duration_seconds', 'Time taken to process the most recent archive record.')
+    m.gauge('lag_seconds', 'Wall clock time minus the timestamp of the most recent archive record, when it finished processing.')
+    m.gauge('last_record_timestamp_seconds', 'Timestamp of the most recent archive record processed.')
+    return m
@@ -30,7 +30,7 @@ class IndiceMetropolitanoCalidadAire(standards.AqiStandards):
 
         self.calculators[calculators.O3] = calculators.BreakpointTable(
             mean_cleaner=calculators.ROUND_TO_3,
-            unit='microgram_per_meter_cubed',
+            unit='part_per_million',
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  1,  50, 0.000, 0.055, lambda bp, obs: obs * 100.0 / 0.11) \
@@ -41,7 +41,7 @@ class IndiceMetropolitanoCalidadAire(standards.AqiStandards):
 
         self.calculators[calculators.NO2] = calculators.BreakpointTable(
             mean_cleaner=calculators.ROUND_TO_3,
-            unit='microgram_per_meter_cubed',
+            unit='part_per_million',
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  1,  50, 0.000, 0.105, lambda bp, obs: obs * 100.0 / 0.21) \
@@ -52,7 +52,7 @@ class IndiceMetropolitanoCalidadAire(standards.AqiStandards):
 
         self.calculators[calculators.SO2] = calculators.BreakpointTable(
             mean_cleaner=calculators.ROUND_TO_3,
-            unit='microgram_per_meter_cubed',
+            unit='part_per_million',
             duration_in_secs=24 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  1,  50, 0.000, 0.065, lambda bp, obs: obs * 100.0 / 0.13) \
@@ -63,7 +63,7 @@ class IndiceMetropolitanoCalidadAire(standards.AqiStandards):
 
         self.calculators[calculators.CO] = calculators.BreakpointTable(
             mean_cleaner=calculators.ROUND_TO_2,
-            unit='microgram_per_meter_cubed',
+            unit='part_per_million',
             duration_in_secs=8 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  1,  50,  0.00,  5.50, lambda bp, obs: obs * 100.0 / 11.0) \
@@ -0,0 +1,246 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import bisect
+import syslog
+import threading
+import time
+
+from six.moves import queue
+
+import weewx.manager
+
+# rows passed from a worker to the reader at a time
+CHUNK_SIZE = 256
+
+# chunks a worker reads ahead of the reader, before it waits for the reader
+MAX_CHUNKS = 8
+
+# seconds between a waiting worker's checks for an abandoned reader
+CANCEL_POLL_SECS = 0.1
+
+_END = object()
+
+class _Failure(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+class _Worker(threading.Thread):
+    '''Runs queries from the task queue on its own database connections, which
+    are opened on first use and never shared with other threads.'''
+    def __init__(self, config_dict, tasks):
+        super(_Worker, self).__init__()
+        self.daemon = True
+        self.config_dict = config_dict
+        self.tasks = tasks
+        self.managers = {}
+
+    def _get_manager(self, data_binding):
+        if data_binding not in self.managers:
+            self.managers[data_binding] = weewx.manager.open_manager_with_config(self.config_dict, data_binding)
+        return self.managers[data_binding]
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            (data_binding, sql, params, results, cancelled) = task
+            try:
+                chunk = []
+                for row in self._get_manager(data_binding).genSql(sql, params):
+                    chunk.append(row)
+                    if len(chunk) == CHUNK_SIZE:
+                        if not _put(results, cancelled, chunk):
+                            break
+                        chunk = []
+                else:
+                    # every row was read
+                    if len(chunk) > 0:
+                        _put(results, cancelled, chunk)
+                    _put(results, cancelled, _END)
+            except Exception as e:
+                _put(results, cancelled, _Failure(e))
+        for dbm in list(self.managers.values()):
+            try:
+                dbm.close()
+            except Exception:
+                pass
+
+def _put(results, cancelled, item):
+    '''Puts item on the bounded results queue, waiting for the reader to make
+    room. Returns False, without putting it, if the reader has abandoned the
+    results.'''
+    while not cancelled.is_set():
+        try:
+            results.put(item, True, CANCEL_POLL_SECS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _gen_results(results, cancelled):
+    '''Yields the rows put on the results queue by a worker as they arrive,
+    raising the worker's exception if its query failed. If the rows are
+    abandoned, the worker is told to stop reading them.'''
+    try:
+        while True:
+            item = results.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            for row in item:
+                yield row
+    finally:
+        cancelled.set()
+
+class QueryPool(object):
+    '''A small pool of threads, each with its own database connections, that
+    run independent queries concurrently. Queries are submitted together, and
+    their rows are streamed to the caller as they arrive, so a join can start
+    on the first rows of both while the rest are still being read.'''
+    def __init__(self, config_dict, threads=2):
+        self.tasks = queue.Queue()
+        self.workers = [_Worker(config_dict, self.tasks) for i in range(threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, data_binding, sql, params):
+        '''Queues the query on the data binding, and returns an iterator over
+        its rows. The worker reads at most MAX_CHUNKS chunks ahead of the
+        iterator, and stops reading once the iterator is abandoned.'''
+        results = queue.Queue(MAX_CHUNKS)
+        cancelled = threading.Event()
+        self.tasks.put((data_binding, sql, params, results, cancelled))
+        return _gen_results(results, cancelled)
+
+    def close(self):
+        '''Stops the workers once they finish the queued queries, and closes
+        their connections.'''
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(10)
+            if worker.is_alive():
+                syslog.syslog(syslog.LOG_ERR, "AqiService: query pool thread did not stop")
+
+class WindowCache(object):
+    '''Keeps the rows of a window query, a query of the rows with timestamps
+    between two parameters, inclusive, in ascending order, with the timestamp
+    in column time_index. Successive windows overlap almost entirely, so only
+    the rows that arrived since the last window are read, either at the next
+    window, or earlier by prefetch(). The rows of the last `overlap` seconds
+    are read again with each window, in case they were written out of order.'''
+    def __init__(self, sql, overlap, time_index=0):
+        self.sql = sql
+        self.overlap = overlap
+        self.time_index = time_index
+        self.rows = []
+        self.times = []
+        self.lock = threading.Lock()
+
+    def _replace_tail(self, since, rows):
+        '''Replaces the rows after the timestamp since with rows.'''
+        k = bisect.bisect_right(self.times, since)
+        del self.rows[k:]
+        del self.times[k:]
+        self.rows.extend(rows)
+        self.times.extend([row[self.time_index] for row in rows])
+
+    def prefetch(self, dbm, now):
+        '''Reads the rows that arrived since the last read, up to now, using
+        the calling thread's database manager. Returns the number of rows
+        read.'''
+        with self.lock:
+            if len(self.times) == 0:
+                # the first window is read in full
+                return 0
+            since = self.times[-1]
+        rows = list(dbm.genSql(self.sql, (since + 1, now)))
+        with self.lock:
+            # unless a window was read in the meantime
+            if len(self.times) > 0 and self.times[-1] == since:
+                self._replace_tail(since, rows)
+        return len(rows)
+
+    def get(self, dbm, start_time, end_time):
+        '''Returns the rows of the window [start_time, end_time], reading
+        those that are not cached with dbm.'''
+        with self.lock:
+            if len(self.times) == 0 or start_time < self.times[0]:
+                self.rows = list(dbm.genSql(self.sql, (start_time, end_time)))
+                self.times = [row[self.time_index] for row in self.rows]
+            else:
+                since = max(self.times[-1] - self.overlap, start_time - 1)
+                self._replace_tail(since, list(dbm.genSql(self.sql, (since + 1, end_time))))
+                k = bisect.bisect_left(self.times, start_time)
+                del self.rows[:k]
+                del self.times[:k]
+            return self.rows[:bisect.bisect_right(self.times, end_time)]
+
+class IdlePrefetcher(threading.Thread):
+    '''Tops up WindowCaches in the background, once per archive interval, at
+    the time set by schedule(), so that little is left to read when the next
+    archive record arrives. The caches are read with the thread's own
+    database connections. Nothing is calculated ahead of time: the joins,
+    conversions, means, and aggregate buckets depend on the next window, so
+    they are left to the archive record.'''
+    def __init__(self, config_dict, caches):
+        '''caches is a list of (data_binding, WindowCache).'''
+        super(IdlePrefetcher, self).__init__()
+        self.daemon = True
+        self.config_dict = config_dict
+        self.caches = caches
+        self.due = None
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.wakeup = threading.Event()
+        self.managers = {}
+
+    def schedule(self, due):
+        '''Prefetches at the epoch second due.'''
+        with self.lock:
+            self.due = due
+        self.wakeup.set()
+
+    def close(self):
+        '''Stops the thread, and closes its connections.'''
+        self.stopped = True
+        self.wakeup.set()
+        self.join(10)
+
+    def _prefetch(self):
+        now = int(time.time())
+        for (data_binding, cache) in self.caches:
+            try:
+                if data_binding not in self.managers:
+                    self.managers[data_binding] = weewx.manager.open_manager_with_config(self.config_dict, data_binding)
+                cache.prefetch(self.managers[data_binding], now)
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not prefetch from %s: %s" % (data_binding, str(e)))
+
+    def run(self):
+        while True:
+            # cleared before stopped and due are read, so that a close() or
+            # schedule() after this point ends the wait below
+            self.wakeup.clear()
+            if self.stopped:
+                break
+            with self.lock:
+                due = self.due
+                now = time.time()
+                if due is not None and due <= now:
+                    self.due = None
+            if due is None:
+                self.wakeup.wait()
+            elif due > now:
+                self.wakeup.wait(due - now)
+            else:
+                self._prefetch()
+        for dbm in list(self.managers.values()):
+            try:
+                dbm.close()
+            except Exception:
+                pass
@@ -0,0 +1,134 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import syslog
+
+import weedb
+import weeutil.weeutil
+
+from . import aggregates
+from . import calculators
+from . import rollups
+
+DEFAULT_MAX_ROWS = 2000
+
+def _bucket_end(timestamp, interval_secs):
+    '''Returns the end of the compacted row holding timestamp. Daily rows
+    end at local midnight, like the daily summaries; shorter ones are aligned
+    to the epoch.'''
+    if interval_secs == calculators.DAY:
+        return int(weeutil.weeutil.archiveDaySpan(timestamp).stop)
+    return aggregates.bucket_end(timestamp, interval_secs)
+
+def compact_rows(rows, interval_secs, aggregate_type='max'):
+    '''Returns the compacted row of a bucket of AQI rows, given as dicts. Each
+    pollutant's AQI is the max or mean of its AQIs, and its category is the
+    worst category. Means are weighted by the rows' intervals, so a row
+    compacted earlier can be compacted again with rows that arrived late.'''
+    last = rows[-1]
+    compacted = {
+        'dateTime': _bucket_end(last['dateTime'], interval_secs),
+        'interval': interval_secs // 60,
+        'usUnits': last['usUnits'],
+        'aqi_standard': last['aqi_standard'],
+    }
+    for pollutant in rollups.POLLUTANTS:
+        aqis = [(r['aqi_' + pollutant], r['interval']) for r in rows if r['aqi_' + pollutant] is not None]
+        categories = [r['aqi_' + pollutant + '_category'] for r in rows if r['aqi_' + pollutant + '_category'] is not None]
+        aqi = None
+        if len(aqis) > 0:
+            if aggregate_type == 'max':
+                aqi = max([a for (a, interval) in aqis])
+            else:
+                aqi = sum([a * interval for (a, interval) in aqis]) / float(sum([interval for (a, interval) in aqis]))
+        compacted['aqi_' + pollutant] = aqi
+        compacted['aqi_' + pollutant + '_category'] = max(categories) if len(categories) > 0 else None
+    return compacted
+
+def compact(dbm, older_than, interval_secs, max_rows=DEFAULT_MAX_ROWS, aggregate_type='max'):
+    '''Replaces the AQI rows of the archive with timestamps up to older_than,
+    and shorter intervals than interval_secs, with one row per interval_secs.
+    At most about max_rows rows are read, so each call does a bounded amount
+    of work; call it again until it returns 0. Returns the number of rows
+    replaced.
+
+    Rows are deleted and inserted with SQL, in a single transaction, rather
+    than with addRecord(), so the daily summaries of a DaySummaryManager are
+    not counted twice, and keep their full resolution statistics.'''
+    # only compact complete buckets
+    if interval_secs == calculators.DAY:
+        older_than = int(weeutil.weeutil.archiveDaySpan(older_than + 1).start)
+    else:
+        older_than = _bucket_end(older_than + 1, interval_secs) - interval_secs
+
+    cols = [col for col in dbm.sqlkeys]
+    sql = 'SELECT %s FROM %s WHERE dateTime <= ? AND `interval` < ? ORDER BY dateTime ASC LIMIT %d' % (
+        ', '.join(cols), dbm.table_name, int(max_rows))
+    rows = [dict(zip(cols, row)) for row in dbm.genSql(sql, (older_than, interval_secs // 60))]
+    if len(rows) == 0:
+        return 0
+
+    buckets = []
+    for row in rows:
+        end = _bucket_end(row['dateTime'], interval_secs)
+        if len(buckets) == 0 or buckets[-1][0] != end:
+            buckets.append((end, []))
+        buckets[-1][1].append(row)
+    if len(rows) == max_rows:
+        if len(buckets) > 1:
+            # the last bucket may continue past the rows read
+            buckets.pop()
+        else:
+            # a single bucket holds more than max_rows, read all of it
+            end = buckets[0][0]
+            buckets = [(end, [dict(zip(cols, row)) for row in dbm.genSql(
+                'SELECT %s FROM %s WHERE dateTime > ? AND dateTime <= ? AND `interval` < ? ORDER BY dateTime ASC' % (
+                ', '.join(cols), dbm.table_name), (end - interval_secs, end, interval_secs // 60))])]
+
+    n = 0
+    with weedb.Transaction(dbm.connection) as cursor:
+        for (end, bucket_rows) in buckets:
+            cursor.execute('DELETE FROM %s WHERE dateTime >= ? AND dateTime <= ? AND `interval` < ?' % (dbm.table_name),
+                (bucket_rows[0]['dateTime'], bucket_rows[-1]['dateTime'], interval_secs // 60))
+            n += len(bucket_rows)
+            # a row compacted earlier, if rows arrived late
+            cursor.execute('SELECT %s FROM %s WHERE dateTime = ? AND `interval` >= ?' % (', '.join(cols), dbm.table_name),
+                (end, interval_secs // 60))
+            row = cursor.fetchone()
+            if row is not None:
+                bucket_rows.append(dict(zip(cols, row)))
+            compacted = compact_rows(bucket_rows, interval_secs, aggregate_type)
+            names = [c for c in cols if c in compacted]
+            cursor.execute('REPLACE INTO %s (%s) VALUES (%s)' % (dbm.table_name,
+                ', '.join(['`%s`' % c for c in names]), ', '.join(['?'] * len(names))),
+                tuple([compacted[c] for c in names]))
+    return n
+
+class RetentionPolicy(object):
+    '''Keeps the AQI archive at full resolution for full_days, then compacts
+    it into hourly rows, and after hourly_days, into daily rows. Each call to
+    run() replaces at most about max_rows rows.'''
+    def __init__(self, dbm, full_days, hourly_days=None, max_rows=DEFAULT_MAX_ROWS, aggregate_type='max'):
+        if aggregate_type not in ['max', 'mean']:
+            raise ValueError('unknown aggregate type %s' % (aggregate_type))
+        self.dbm = dbm
+        self.tiers = [(full_days * calculators.DAY, calculators.HOUR)]
+        if hourly_days is not None:
+            self.tiers.append((hourly_days * calculators.DAY, calculators.DAY))
+        self.max_rows = max_rows
+        self.aggregate_type = aggregate_type
+
+    def run(self, now):
+        '''Compacts rows that have aged out of their tier, oldest tiers first,
+        within the budget of max_rows. Returns the number of rows replaced.'''
+        n = 0
+        for (age, interval_secs) in reversed(self.tiers):
+            while n < self.max_rows:
+                replaced = compact(self.dbm, now - age, interval_secs, self.max_rows - n, self.aggregate_type)
+                if replaced == 0:
+                    break
+                n += replaced
+        if n > 0:
+            syslog.syslog(syslog.LOG_INFO, "AqiService: retention compacted %d AQI records" % (n))
+        return n
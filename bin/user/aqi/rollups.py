@@ -0,0 +1,231 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import syslog
+
+import weedb
+import weeutil.weeutil
+
+from . import aggregates
+from . import sketches
+
+COMPOSITE = 'composite'
+
+# The pollutants of each record that are rolled up, by the name used in the
+# aqi_<pollutant> and aqi_<pollutant>_category columns.
+POLLUTANTS = [COMPOSITE] + aggregates.POLLUTANTS
+
+class DailyRollup(object):
+    '''Base class of the tables summarizing the AQI records of each day.
+
+    Each row is keyed by the start of the day, the standard's guid, the
+    pollutant, and the columns in extra_key. Days follow the weewx archive's
+    convention, so the record at midnight belongs to the day before.
+
+    The table lives in the AQI database. It is updated incrementally as AQI
+    records are stored, and can be rebuilt from the AQI archive. Subclasses
+    define the schema, and how records are summarized and combined.'''
+    schema = []
+    extra_key = []
+
+    def __init__(self, dbm, table_name, create=True):
+        '''Creates a new rollup over the AQI archive managed by dbm. If create
+        is true, and the table does not already exist, it is created and
+        filled from the AQI archive.'''
+        self.dbm = dbm
+        self.table_name = table_name
+        self.last_update = None
+        self.key_columns = ['dateTime', 'aqi_standard', 'pollutant'] + self.extra_key
+        self.value_columns = [col[0] for col in self.schema if col[0] not in self.key_columns]
+
+        if not create:
+            return
+        if self.table_name not in self.dbm.connection.tables():
+            with weedb.Transaction(self.dbm.connection) as cursor:
+                cursor.execute('CREATE TABLE %s (%s, PRIMARY KEY (%s))' % (self.table_name,
+                    ', '.join(['%s %s' % col for col in self.schema]), ', '.join(self.key_columns)))
+            syslog.syslog(syslog.LOG_INFO, "AqiService: created rollup table %s" % (self.table_name))
+            first = self.dbm.firstGoodStamp()
+            last = self.dbm.lastGoodStamp()
+            if first is not None and last is not None:
+                self.rebuild(first, last)
+        else:
+            row = self.dbm.getSql('SELECT MAX(last_update) FROM %s' % (self.table_name))
+            if row is not None and row[0] is not None:
+                self.last_update = row[0]
+
+    def _accumulate(self, rollup, day, pollutant, record):
+        '''Adds the pollutant of the AQI record to the rollup, a dict from keys
+        to the summaries of the day.'''
+        raise NotImplementedError()
+
+    def _combine(self, value, row):
+        '''Returns the summary combined with a stored row of value_columns.'''
+        raise NotImplementedError()
+
+    def _to_row(self, value):
+        '''Returns the values of value_columns for the summary.'''
+        raise NotImplementedError()
+
+    def _add(self, rollup, record):
+        day = weeutil.weeutil.startOfArchiveDay(record['dateTime'])
+        for pollutant in POLLUTANTS:
+            self._accumulate(rollup, day, pollutant, record)
+
+    def _store(self, rollup, replace_days=None):
+        '''Writes the rollup in a single transaction, combining it with the
+        existing rows. If replace_days is a pair of days, the rows of the days
+        between them, inclusive, are deleted first.'''
+        where = ' AND '.join(['%s = ?' % c for c in self.key_columns])
+        with weedb.Transaction(self.dbm.connection) as cursor:
+            if replace_days is not None:
+                cursor.execute('DELETE FROM %s WHERE dateTime >= ? AND dateTime <= ?' % (self.table_name), replace_days)
+            for key in sorted(rollup):
+                cursor.execute('SELECT %s FROM %s WHERE %s' % (', '.join(self.value_columns), self.table_name, where), key)
+                row = cursor.fetchone()
+                if row is None:
+                    cols = self.key_columns + self.value_columns
+                    cursor.execute('INSERT INTO %s (%s) VALUES (%s)' % (self.table_name, ', '.join(cols), ', '.join(['?'] * len(cols))),
+                        key + tuple(self._to_row(rollup[key])))
+                else:
+                    cursor.execute('UPDATE %s SET %s WHERE %s' % (self.table_name,
+                        ', '.join(['%s = ?' % c for c in self.value_columns]), where),
+                        tuple(self._to_row(self._combine(rollup[key], row))) + key)
+
+    def add_records(self, records):
+        '''Adds the AQI records to the rollup. Records that are not newer than
+        the last update are ignored, so replaying records does not count them
+        twice; use rebuild() after replacing records. Returns the number of
+        records added.'''
+        rollup = {}
+        n = 0
+        last = self.last_update
+        for record in records:
+            if self.last_update is not None and record['dateTime'] <= self.last_update:
+                continue
+            self._add(rollup, record)
+            n += 1
+            if last is None or record['dateTime'] > last:
+                last = record['dateTime']
+        if n == 0:
+            return 0
+        self._store(rollup)
+        self.last_update = last
+        return n
+
+    def rebuild(self, start_time, end_time):
+        '''Discards and recomputes the days covering the AQI records with
+        timestamps in [start_time, end_time], from the AQI archive.'''
+        first_day = weeutil.weeutil.startOfArchiveDay(start_time)
+        last_day = weeutil.weeutil.startOfArchiveDay(end_time)
+        end_of_last_day = weeutil.weeutil.archiveDaySpan(end_time).stop
+
+        cols = ['dateTime', 'interval', 'aqi_standard']
+        for pollutant in POLLUTANTS:
+            cols.extend(['aqi_' + pollutant, 'aqi_' + pollutant + '_category'])
+        sql = 'SELECT %s FROM %s WHERE dateTime > ? AND dateTime <= ? ORDER BY dateTime ASC' % (
+            ', '.join(cols), self.dbm.table_name)
+        rollup = {}
+        n = 0
+        last = None
+        for row in self.dbm.genSql(sql, (first_day, end_of_last_day)):
+            self._add(rollup, dict(zip(cols, row)))
+            n += 1
+            last = row[0]
+
+        self._store(rollup, (first_day, last_day))
+        if last is not None and (self.last_update is None or last > self.last_update):
+            self.last_update = last
+        syslog.syslog(syslog.LOG_INFO, "AqiService: rebuilt %s from %d AQI records" % (self.table_name, n))
+        return n
+
+class CategoryRollup(DailyRollup):
+    '''Maintains a table of how long each pollutant, and the composite, spent
+    in each AQI category on each day, along with the maximum AQI. The duration
+    is the sum of the intervals of the AQI records in that category.'''
+    schema = [
+        ('dateTime', 'INTEGER NOT NULL'),
+        ('aqi_standard', 'INTEGER NOT NULL'),
+        ('pollutant', 'VARCHAR(16) NOT NULL'),
+        ('category', 'INTEGER NOT NULL'),
+        ('duration', 'INTEGER NOT NULL'),
+        ('count', 'INTEGER NOT NULL'),
+        ('max_aqi', 'REAL'),
+        ('last_update', 'INTEGER NOT NULL'),
+    ]
+    extra_key = ['category']
+
+    def _accumulate(self, rollup, day, pollutant, record):
+        category = record.get('aqi_' + pollutant + '_category')
+        if category is None:
+            return
+        key = (day, record['aqi_standard'], pollutant, int(category))
+        aqi = record.get('aqi_' + pollutant)
+        rollup[key] = self._combine([record['interval'] * 60, 1, aqi, record['dateTime']], rollup.get(key))
+
+    def _combine(self, value, row):
+        if row is None:
+            return value
+        (duration, count, max_aqi, last_update) = value
+        if max_aqi is None or (row[2] is not None and row[2] > max_aqi):
+            max_aqi = row[2]
+        return [duration + row[0], count + row[1], max_aqi, max(last_update, row[3])]
+
+    def _to_row(self, value):
+        return value
+
+    def get_durations(self, aqi_standard, pollutant, start_time, end_time):
+        '''Returns a list of (category, duration, count, max_aqi) for the days
+        starting in [start_time, end_time), in order of category. Durations
+        are in seconds.'''
+        sql = 'SELECT category, SUM(duration), SUM(count), MAX(max_aqi) FROM %s ' \
+            'WHERE dateTime >= ? AND dateTime < ? AND aqi_standard = ? AND pollutant = ? ' \
+            'GROUP BY category ORDER BY category ASC' % (self.table_name)
+        return [tuple(row) for row in self.dbm.genSql(sql, (start_time, end_time, aqi_standard, pollutant))]
+
+class QuantileRollup(DailyRollup):
+    '''Maintains a table of quantile sketches of the AQIs of each pollutant,
+    and the composite, on each day. Percentiles over any span of days are
+    estimated by merging the sketches of its days, so they cost the same no
+    matter how many AQI records the span holds.'''
+    schema = [
+        ('dateTime', 'INTEGER NOT NULL'),
+        ('aqi_standard', 'INTEGER NOT NULL'),
+        ('pollutant', 'VARCHAR(16) NOT NULL'),
+        ('count', 'INTEGER NOT NULL'),
+        ('sketch', 'TEXT NOT NULL'),
+        ('last_update', 'INTEGER NOT NULL'),
+    ]
+
+    def _accumulate(self, rollup, day, pollutant, record):
+        aqi = record.get('aqi_' + pollutant)
+        if aqi is None:
+            return
+        key = (day, record['aqi_standard'], pollutant)
+        value = rollup.get(key)
+        if value is None:
+            value = rollup[key] = [sketches.QuantileSketch(), record['dateTime']]
+        value[0].add(aqi)
+        value[1] = max(value[1], record['dateTime'])
+
+    def _combine(self, value, row):
+        return [sketches.QuantileSketch.from_json(row[1]).merge(value[0]), max(value[1], row[2])]
+
+    def _to_row(self, value):
+        return [value[0].count, value[0].to_json(), value[1]]
+
+    def get_sketch(self, aqi_standard, pollutant, start_time, end_time):
+        '''Returns the merged QuantileSketch of the days starting in
+        [start_time, end_time).'''
+        merged = None
+        sql = 'SELECT sketch FROM %s WHERE dateTime >= ? AND dateTime < ? AND aqi_standard = ? AND pollutant = ?' % (self.table_name)
+        for row in self.dbm.genSql(sql, (start_time, end_time, aqi_standard, pollutant)):
+            sketch = sketches.QuantileSketch.from_json(row[0])
+            if merged is None:
+                merged = sketch
+            else:
+                merged.merge(sketch)
+        if merged is None:
+            merged = sketches.QuantileSketch()
+        return merged
@@ -2,17 +2,27 @@
 # Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
 # License: GPL 3
 
-import sys
+import bisect
+import datetime
 import syslog
 import time
 
+import weedb
 import weeutil.weeutil
 import weewx
 import weewx.cheetahgenerator
 import weewx.engine
 import weewx.units
 
+from . import aggregates
 from . import calculators
+from . import instrumentation
+from . import logsummary
+from . import metrics
+from . import prefetch
+from . import retention
+from . import rollups
+from . import snapshot
 from . import standards
 from . import units
 
@@ -48,14 +58,173 @@ def _trim_dict(d):
             d.pop(k)
     return d
 
-def _make_dict(row, colnames):
-    if type(row) == dict:
+def _make_window_sql(as_column_to_real_column, table_name, epoch_seconds_column):
+    '''Returns SQL selecting the columns, renamed to their canonical names,
+    of the rows with epoch_seconds_column between two parameters, inclusive,
+    in ascending order.'''
+    cols = ', '.join([real_col + ' AS ' + as_col for (as_col, real_col) in list(as_column_to_real_column.items())])
+    return 'SELECT %s FROM %s WHERE %s >= ? AND %s <= ? ORDER BY %s ASC' % (cols, table_name,
+        epoch_seconds_column, epoch_seconds_column, epoch_seconds_column)
+
+def _make_observation(row, colnames):
+    '''Returns the row of a query, with the canonical column names, as an
+    Observation.'''
+    if isinstance(row, (dict, calculators.Observation)):
         return row
-    d = {}
-    for i in range(len(row)):
-        d[colnames[i]] = row[i]
+    return calculators.Observation(zip(colnames, row))
+
+def _merge_observations(po, wo):
+    '''Returns a copy of the pollutant observation, with the weather
+    observation's values filling in its missing columns.'''
+    d = po.copy()
+    for (k, v) in list(wo.items()):
+        if k not in d or d[k] is None:
+            d[k] = v
+    return d
+
+def _join_path(pollutant_times, weather_times, epsilon):
+    '''Joins the ascending pollutant and weather timestamps the same way as
+    AqiService._join_sensor_results(). Returns the joined pairs of indices, and
+    the states the join passed through, as a dict mapping each pollutant index
+    to the first and last weather index it was compared with.'''
+    pairs = []
+    states = {}
+    p = 0
+    w = 0
+    while p < len(pollutant_times) and w < len(weather_times):
+        if p in states:
+            states[p][1] = w
+        else:
+            states[p] = [w, w]
+        delta = pollutant_times[p] - weather_times[w]
+        if abs(delta) < epsilon:
+            pairs.append((p, w))
+            p += 1
+            w += 1
+        elif delta > 0:
+            w += 1
+        else:
+            p += 1
+    return (pairs, states)
+
+def _join_window(pollutant_times, weather_times, p, p_end, w, w_end, epsilon, states):
+    '''Joins the timestamps in [p, p_end) and [w, w_end) like _join_path(),
+    until the join reaches one of the states of _join_path(). From there on,
+    both joins make the same pairs. Returns the pairs joined before that, and the
+    pollutant index of the state reached, or None if none was reached.'''
+    pairs = []
+    while p < p_end and w < w_end:
+        state = states.get(p)
+        if state is not None and state[0] <= w and w <= state[1]:
+            return (pairs, p)
+        delta = pollutant_times[p] - weather_times[w]
+        if abs(delta) < epsilon:
+            pairs.append((p, w))
+            p += 1
+            w += 1
+        elif delta > 0:
+            w += 1
+        else:
+            p += 1
+    return (pairs, None)
+
+WEATHER_JOINS = ['pairwise', 'nearest', 'interpolate']
+
+def _nearest_match(t, weather_times, lo, hi, tolerance, interpolate):
+    '''Returns how the weather readings lo, at or before t, and hi, after t,
+    either of which may be None, fill in a pollutant reading at t: as (a, b,
+    fraction), where the reading is fraction of the way from weather reading a
+    to b, or None if neither is within tolerance seconds. Unless interpolate is
+    set, a and b are both the nearest reading.'''
+    if lo is not None and t - weather_times[lo] > tolerance:
+        lo = None
+    if hi is not None and weather_times[hi] - t > tolerance:
+        hi = None
+    if lo is None and hi is None:
+        return None
+    if lo is None:
+        return (hi, hi, 0.0)
+    if hi is None:
+        return (lo, lo, 0.0)
+    if interpolate:
+        return (lo, hi, float(t - weather_times[lo]) / (weather_times[hi] - weather_times[lo]))
+    if weather_times[hi] - t < t - weather_times[lo]:
+        return (hi, hi, 0.0)
+    return (lo, lo, 0.0)
+
+def _nearest_path(pollutant_times, weather_times, p, p_end, w, w_end, tolerance, interpolate):
+    '''Matches each ascending pollutant timestamp in [p, p_end) with the
+    nearest, or the two surrounding, ascending weather timestamps in [w, w_end)
+    in a single pass. Returns a list of (p, match) for the pollutant indices
+    that matched, where match is from _nearest_match().'''
+    w_start = w
+    matches = []
+    while p < p_end:
+        t = pollutant_times[p]
+        while w < w_end and weather_times[w] <= t:
+            w += 1
+        match = _nearest_match(t, weather_times, w - 1 if w > w_start else None, w if w < w_end else None,
+            tolerance, interpolate)
+        if match is not None:
+            matches.append((p, match))
+        p += 1
+    return matches
+
+def _apply_weather(po, weather_rows, match):
+    '''Fills in the pollutant observation's missing columns, in place, with
+    the weather readings of the match from _nearest_match(), interpolating
+    between them. Readings in different units are not interpolated, the nearer
+    one is used instead.'''
+    (a, b, fraction) = match
+    wa = weather_rows[a]
+    wb = weather_rows[b]
+    if a != b and wa['weather_usUnits'] != wb['weather_usUnits']:
+        if fraction > 0.5:
+            wa = wb
+        wb = wa
+        fraction = 0.0
+    for (k, v) in list(wa.items()):
+        if k in po and po[k] is not None:
+            continue
+        if wb is not wa and k in ('outTemp', 'pressure'):
+            vb = wb.get(k)
+            if v is None or vb is None:
+                v = vb if fraction > 0.5 else v
+            else:
+                v = v + (vb - v) * fraction
+        po[k] = v
+
+def _bucket_observation(bucket, pollutants):
+    '''Returns a row of an aggregate table as a joined observation, with the
+    mean of each pollutant, temperature and pressure in the bucket.'''
+    d = calculators.Observation(
+        dateTime=bucket['dateTime'],
+        usUnits=bucket['usUnits'],
+        weather_usUnits=bucket['weather_usUnits'],
+        outTemp=bucket['outTemp_mean'],
+        pressure=bucket['pressure_mean'])
+    for pollutant in pollutants:
+        count = bucket[pollutant + '_count']
+        d[pollutant] = bucket[pollutant + '_sum'] / count if count else None
     return d
 
+class _CountingIterator(object):
+    '''Wraps an iterator, counting the number of items consumed from it.'''
+    def __init__(self, iterable):
+        self.it = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.it)
+        self.count += 1
+        return item
+
+    # python 2
+    next = __next__
+
 def get_unit_from_column(obs_column, usUnits):
     pollutant_group = weewx.units.obs_group_dict.get(obs_column)
     obs_unit = None
@@ -73,14 +242,14 @@ class AqiService(weewx.engine.StdService):
     [AqiService]
         [standard]
         data_binding = aqi_binding       -- Required
-        standard = user.aqi.us.NowCast   -- Required.
+        standard = user.aqi.us.NowCast   -- Required. Fully qualified class, or short name (e.g. us_nowcast), of the standard.
 
         [air_sensor]                     -- Required.
         data_binding = purpleair_binding -- Required.
         usUnits = usUnits                -- Optional. Column indicating the data's units. Default: usUnits
         dateTime = dateTime              -- Optional. Column in sensor_data_binding indicating when the reading was taken in epoch seconds. Default: dateTime
-        temp = purple_temperature        -- Optional. Suggested if sensor measures temperature. Column in sensor_data_binding of air temperature. Default: reads from wx_archive.
-        pressure = purple_pressure       -- Optional. Suggested if sensor measures air pressure. Column in sensor_data_binding of air pressure. Default: reads from wx_archive.
+        temp = purple_temperature        -- Optional. Suggested if sensor measures temperature. Column in sensor_data_binding of air temperature. Default: reads from the weewx archive, i.e. the data_binding of [StdArchive].
+        pressure = purple_pressure       -- Optional. Suggested if sensor measures air pressure. Column in sensor_data_binding of air pressure. Default: reads from the weewx archive, i.e. the data_binding of [StdArchive].
         pm2_5 = pm2_5_atm                -- Optional. Column in sensor_data_binding measuring fine particulate matter <= 2.5 micrometers in width.
         pm10_0 = pm10_0_atm              -- Optional. Column in sensor_data_binding measuring particulate matter <= 10 micrometers in width.
         co =                             -- Optional. Column in sensor_data_binding measuring carbon monoxide concentrations.
@@ -89,18 +258,80 @@ class AqiService(weewx.engine.StdService):
         o3 =                             -- Optional. Column in sensor_data_binding measuring ozone concentrations.
         nh3 =                            -- Optional. Column in sensor_data_binding measuring ammonia concentrations.
         pb =                             -- Optional. Column in sensor_data_binding measuring lead concentrations.
+        weather_join = pairwise          -- Optional. How temperature and pressure readings are joined with pollutant readings. pairwise joins each weather reading with at most one pollutant reading. nearest joins every pollutant reading with the nearest weather reading, and interpolate with the weather interpolated between the two surrounding readings. Default: pairwise
+        weather_tolerance =              -- Optional. Maximum seconds between a pollutant reading and the weather readings joined with it by nearest or interpolate. Default: the archive interval
+
+        [hourly_aggregates]              -- Optional.
+        enable = false                   -- Optional. Maintain hourly sum, count, min, and max of each pollutant in the aqi store. Default: false
+        table_name = aqi_hourly          -- Optional. Table in the aqi store holding the hourly aggregates. Default: aqi_hourly
+
+        [pre_aggregation]                -- Optional.
+        enable = false                   -- Optional. Summarize the sensor readings into archive interval buckets as they arrive, and calculate AQIs from the bucket means rather than the raw readings. Default: false
+        table_name = aqi_buckets         -- Optional. Table in the aqi store holding the buckets. Default: aqi_buckets
+
+        [category_rollup]                -- Optional.
+        enable = false                   -- Optional. Maintain the time spent in each AQI category per day in the aqi store. Default: false
+        table_name = aqi_category_rollup -- Optional. Table in the aqi store holding the category rollup. Default: aqi_category_rollup
+
+        [quantile_sketches]              -- Optional.
+        enable = false                   -- Optional. Maintain daily quantile sketches of each AQI in the aqi store. Default: false
+        table_name = aqi_quantile_sketch -- Optional. Table in the aqi store holding the sketches. Default: aqi_quantile_sketch
+
+        [instrumentation]                -- Optional.
+        enable = false                   -- Optional. Time each stage of processing an archive record. Default: false
+        emit_interval = 3600             -- Optional. Seconds between timing summaries written to syslog at debug priority. Default: 3600
+        stats_file =                     -- Optional. Path of a JSON file rewritten with the timing histograms at each summary. Default: none
+
+        [memory_profiling]               -- Optional. Requires python 3.9 or later.
+        enable = false                   -- Optional. Trace the peak memory allocated by each stage of processing an archive record. Slows processing considerably. Default: false
+        emit_interval = 3600             -- Optional. Seconds between reports of the top allocation sites. Default: 3600
+        report_file =                    -- Optional. Path of a JSON file rewritten with the peaks and top allocation sites at each report. Default: none
+        top_allocations = 10             -- Optional. Number of allocation sites reported. Default: 10
+        frames = 1                       -- Optional. Number of stack frames recorded for each allocation site. Default: 1
+
+        [catchup]                        -- Optional.
+        enable = false                   -- Optional. Process a backlog of archive records, e.g. after downtime, in batches. Default: false
+        min_lag = 900                    -- Optional. Archive records at least this many seconds old are held, and processed in a batch with the first recent record. Default: 900
+        max_records = 288                -- Optional. Maximum number of archive records held. Default: 288
+
+        [retention]                      -- Optional.
+        enable = false                   -- Optional. Compact old AQI records into hourly, then daily, records. The daily summaries keep their full resolution. Default: false
+        full_days = 30                   -- Optional. Days AQI records are kept at full resolution. Default: 30
+        hourly_days =                    -- Optional. Days hourly records are kept before they are compacted into daily records. Default: none, kept forever
+        aggregate_type = max             -- Optional. Compacted records hold the max or mean AQI, and the worst category. Default: max
+        max_rows = 2000                  -- Optional. Maximum number of AQI records compacted each run. Default: 2000
+        run_interval = 3600              -- Optional. Minimum seconds between runs. Default: 3600
+
+        [budget]                         -- Optional.
+        event_seconds =                  -- Optional. Seconds each archive record may take. Once they have passed, only the priority AQIs are calculated, and the rest are deferred until an archive record takes less. Default: none
+        priority = composite             -- Optional. AQIs, composite or pollutants, always calculated, in order. Default: composite
+        max_deferred = 288               -- Optional. Maximum number of archive records with deferred AQIs. Default: 288
+
+        [prefetch]                       -- Optional.
+        enable = false                   -- Optional. Query the air sensor and weather readings concurrently, on threads with their own database connections. Default: false
+        threads = 2                      -- Optional. Number of query threads. Default: 2
+
+        [idle_prefetch]                  -- Optional. Ignored with pre_aggregation.
+        enable = false                   -- Optional. Keep the readings of the last window in memory, and read the newly arrived readings in the background partway through each archive interval, so only the last few are read when the archive record arrives. Default: false
+        fraction = 0.5                   -- Optional. How far through the archive interval the readings are read. Default: 0.5
+        overlap =                        -- Optional. Seconds of cached readings read again with each archive record, in case they were written out of order. Default: the archive interval
+
+        [snapshot]                       -- Optional.
+        file =                           -- Optional. Path of a JSON file atomically replaced with the latest AQI record, read by AqiSearchList's $aqi_latest. Default: none
+
+        [metrics]                        -- Optional.
+        textfile =                       -- Optional. Path of a file rewritten after each archive record with the service's metrics in Prometheus text format. Default: none
+
+        [logging]                        -- Optional.
+        warning_interval = 3600          -- Optional. Minimum seconds between identical warning summaries. Default: 3600
     '''
     def __init__(self, engine, config_dict):
         super(AqiService, self).__init__(engine, config_dict)
 
         # configure the aqi standard
         standard_config_dict = config_dict['AqiService']['standard']
-        fq_standard = standard_config_dict['standard']
-        standard_path = '.'.join(fq_standard.split('.')[:-1])
-        standard_name = fq_standard.split('.')[-1]
-        __import__(standard_path)
-        standard_class = getattr(sys.modules[standard_path], standard_name)
-        self.aqi_standard = standard_class(int(config_dict['StdArchive']['archive_interval']))
+        self.aqi_standard = standards.get_standard(standard_config_dict['standard'],
+            int(config_dict['StdArchive']['archive_interval']))
 
         # open the aqi data store
         aqi_data_binding_name = standard_config_dict['data_binding']
@@ -130,13 +361,21 @@ class AqiService(weewx.engine.StdService):
         self.sensor_o3_column = sensor_config_dict.get('o3', None)
         self.sensor_nh3_column = sensor_config_dict.get('nh3', None)
         self.sensor_pb_column = sensor_config_dict.get('pb', None)
-        self.sensor_dbm = self.engine.db_binder.get_manager(data_binding=sensor_config_dict['data_binding'], initialize=True)
+        self.sensor_data_binding = sensor_config_dict['data_binding']
+        self.sensor_dbm = self.engine.db_binder.get_manager(data_binding=self.sensor_data_binding, initialize=True)
+        self.weather_join = sensor_config_dict.get('weather_join', 'pairwise')
+        if self.weather_join not in WEATHER_JOINS:
+            raise Exception('unknown weather_join %s, expected one of %s' % (self.weather_join, ', '.join(WEATHER_JOINS)))
+        self.weather_tolerance = sensor_config_dict.get('weather_tolerance', None)
+        if self.weather_tolerance:
+            self.weather_tolerance = int(self.weather_tolerance)
 
         # configure the main weather sensor if needed
         self.use_weather_temp = (self.sensor_temp_column is None)
         self.use_weather_pressure = (self.sensor_pressure_column is None)
         self.weather_us_units = weewx.units.unit_constants[config_dict['StdConvert']['target_unit']]
-        self.weather_dbm = self.engine.db_binder.get_manager()
+        self.weather_data_binding = config_dict['StdArchive'].get('data_binding', 'wx_binding')
+        self.weather_dbm = self.engine.db_binder.get_manager(data_binding=self.weather_data_binding)
 
         # confirm the sensor schema
         dbcols_set = set(self.sensor_dbm.connection.columnsOf(self.sensor_dbm.table_name))
@@ -144,6 +383,141 @@ class AqiService(weewx.engine.StdService):
             if (needle != None) and (needle not in dbcols_set):
                 raise Exception('air sensor schema mismatch. %s not found in %s' % (needle, dbcols_set))
 
+        # configure the hourly aggregates
+        hourly_config_dict = config_dict['AqiService'].get('hourly_aggregates', {})
+        self.hourly_aggregates = None
+        if weeutil.weeutil.to_bool(hourly_config_dict.get('enable', False)):
+            (weather_dbm, weather_table_name, weather_columns) = self._get_weather_source()
+            self.hourly_aggregates = aggregates.AggregateTable(
+                self.aqi_dbm,
+                hourly_config_dict.get('table_name', 'aqi_hourly'),
+                calculators.HOUR,
+                self.sensor_dbm, self._get_polution_sensor_columns(),
+                weather_dbm, weather_table_name, weather_columns)
+
+        # configure the pre-aggregation of sensor readings into archive interval buckets
+        bucket_config_dict = config_dict['AqiService'].get('pre_aggregation', {})
+        self.bucket_aggregates = None
+        if weeutil.weeutil.to_bool(bucket_config_dict.get('enable', False)):
+            (weather_dbm, weather_table_name, weather_columns) = self._get_weather_source()
+            self.bucket_aggregates = aggregates.AggregateTable(
+                self.aqi_dbm,
+                bucket_config_dict.get('table_name', 'aqi_buckets'),
+                int(config_dict['StdArchive']['archive_interval']),
+                self.sensor_dbm, self._get_polution_sensor_columns(),
+                weather_dbm, weather_table_name, weather_columns)
+
+        # configure the category rollup
+        rollup_config_dict = config_dict['AqiService'].get('category_rollup', {})
+        self.category_rollup = None
+        if weeutil.weeutil.to_bool(rollup_config_dict.get('enable', False)):
+            self.category_rollup = rollups.CategoryRollup(self.aqi_dbm,
+                rollup_config_dict.get('table_name', 'aqi_category_rollup'))
+
+        # configure the quantile sketches
+        sketch_config_dict = config_dict['AqiService'].get('quantile_sketches', {})
+        self.quantile_rollup = None
+        if weeutil.weeutil.to_bool(sketch_config_dict.get('enable', False)):
+            self.quantile_rollup = rollups.QuantileRollup(self.aqi_dbm,
+                sketch_config_dict.get('table_name', 'aqi_quantile_sketch'))
+
+        # configure the stage timing
+        instrumentation_config_dict = config_dict['AqiService'].get('instrumentation', {})
+        timing = weeutil.weeutil.to_bool(instrumentation_config_dict.get('enable', False))
+        memory_config_dict = config_dict['AqiService'].get('memory_profiling', {})
+        memory_profiling = weeutil.weeutil.to_bool(memory_config_dict.get('enable', False))
+        if memory_profiling and not instrumentation.memory_profiling_available():
+            syslog.syslog(syslog.LOG_ERR, "AqiService: memory profiling requires python 3.9 or later, disabling it")
+            memory_profiling = False
+        if memory_profiling:
+            self.timer = instrumentation.MemoryProfiler(
+                int(memory_config_dict.get('emit_interval', 3600)),
+                instrumentation_config_dict.get('stats_file', None) if timing else None,
+                memory_config_dict.get('report_file', None),
+                int(memory_config_dict.get('top_allocations', 10)),
+                int(memory_config_dict.get('frames', 1)),
+                log_timing=timing)
+        elif timing:
+            self.timer = instrumentation.StageTimer(
+                int(instrumentation_config_dict.get('emit_interval', 3600)),
+                instrumentation_config_dict.get('stats_file', None))
+        else:
+            self.timer = instrumentation.NullTimer()
+        self.aqi_standard = self.timer.timed_standard(self.aqi_standard)
+
+        # configure the metrics
+        self.metrics = metrics.service_metrics()
+        self.metrics_file = config_dict['AqiService'].get('metrics', {}).get('textfile', None)
+
+        # configure the latest AQI snapshot
+        self.snapshot_file = config_dict['AqiService'].get('snapshot', {}).get('file', None)
+        self.snapshot_time = None
+        if self.snapshot_file:
+            latest = snapshot.SnapshotReader(self.snapshot_file).read()
+            if latest is not None:
+                self.snapshot_time = latest.get('dateTime')
+
+        # configure the catch up of a backlog of archive records
+        catchup_config_dict = config_dict['AqiService'].get('catchup', {})
+        self.pending = []
+        self.catchup_min_lag = None
+        self.catchup_max_records = 1
+        if weeutil.weeutil.to_bool(catchup_config_dict.get('enable', False)):
+            self.catchup_min_lag = int(catchup_config_dict.get('min_lag', 900))
+            self.catchup_max_records = int(catchup_config_dict.get('max_records', 288))
+
+        # configure the retention policy
+        retention_config_dict = config_dict['AqiService'].get('retention', {})
+        self.retention = None
+        self.retention_run_interval = None
+        self.retention_time = None
+        if weeutil.weeutil.to_bool(retention_config_dict.get('enable', False)):
+            hourly_days = retention_config_dict.get('hourly_days', None)
+            self.retention = retention.RetentionPolicy(self.aqi_dbm,
+                int(retention_config_dict.get('full_days', 30)),
+                int(hourly_days) if hourly_days else None,
+                int(retention_config_dict.get('max_rows', retention.DEFAULT_MAX_ROWS)),
+                retention_config_dict.get('aggregate_type', 'max'))
+            self.retention_run_interval = int(retention_config_dict.get('run_interval', 3600))
+
+        # configure the per event time budget
+        budget_config_dict = config_dict['AqiService'].get('budget', {})
+        self.budget_seconds = None
+        self.budget_priority = []
+        self.deferred = []
+        self.max_deferred = int(budget_config_dict.get('max_deferred', 288))
+        if budget_config_dict.get('event_seconds', None):
+            self.budget_seconds = float(budget_config_dict['event_seconds'])
+            self.budget_priority = weeutil.weeutil.option_as_list(budget_config_dict.get('priority', [rollups.COMPOSITE]))
+        self.combines_aqis = type(self.aqi_standard).calculate_composite_aqi == standards.AqiStandards.calculate_composite_aqi
+
+        # configure the concurrent queries
+        prefetch_config_dict = config_dict['AqiService'].get('prefetch', {})
+        self.query_pool = None
+        if weeutil.weeutil.to_bool(prefetch_config_dict.get('enable', False)):
+            self.query_pool = prefetch.QueryPool(config_dict, int(prefetch_config_dict.get('threads', 2)))
+
+        # configure the idle time prefetch of the next window
+        idle_config_dict = config_dict['AqiService'].get('idle_prefetch', {})
+        self.window_caches = None
+        self.idle_prefetcher = None
+        self.idle_fraction = float(idle_config_dict.get('fraction', 0.5))
+        if weeutil.weeutil.to_bool(idle_config_dict.get('enable', False)) and self.bucket_aggregates is None:
+            archive_interval = int(config_dict['StdArchive']['archive_interval'])
+            overlap = int(idle_config_dict.get('overlap', None) or archive_interval)
+            (pollutant_sql, pollutant_cols, pollutant_real_cols) = self._get_pollutant_query()
+            (weather_dbm, weather_sql, weather_cols, weather_real_cols) = self._get_weather_query()
+            self.window_caches = (
+                prefetch.WindowCache(pollutant_sql, overlap, pollutant_cols.index('dateTime')),
+                prefetch.WindowCache(weather_sql, overlap, weather_cols.index('dateTime')))
+            self.idle_prefetcher = prefetch.IdlePrefetcher(config_dict, [
+                (self.sensor_data_binding, self.window_caches[0]),
+                (self._get_weather_data_binding(weather_dbm), self.window_caches[1])])
+            self.idle_prefetcher.start()
+
+        # configure the warning summaries
+        self.warnings = logsummary.event_warnings
+        self.warnings.interval = int(config_dict['AqiService'].get('logging', {}).get('warning_interval', 3600))
 
         # listen for NEW_ARCHIVE_RECORDS
         self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
@@ -174,38 +548,90 @@ class AqiService(weewx.engine.StdService):
             'pressure': self.sensor_pressure_column,
         })
 
+    def _get_weather_source(self):
+        '''Returns the database manager, table name, and a mapping from
+        canonical to real column names for the temperature and pressure
+        readings. These come from the air sensor if it has been configured
+        with them, otherwise they come from the main weather archive.'''
+        weather_cols = self._get_weather_sensor_columns()
+        if len(weather_cols) == 4:
+            return (self.sensor_dbm, self.sensor_dbm.table_name, weather_cols)
+        return (self.weather_dbm, self.weather_dbm.table_name, {
+            'dateTime': 'dateTime',
+            'weather_usUnits': 'usUnits',
+            'outTemp': 'outTemp',
+            'pressure': 'barometer',
+        })
+
     def _join_sensor_results(self, pollutant_observations, pollutant_cols, weather_observations, weather_cols, epsilon):
         '''Returns an array containing the join of the pollutant and weather
         observations. All joined observations must have occured within epsilon
         seconds of each other.'''
         joined = []
         try:
-            po = _make_dict(next(pollutant_observations), pollutant_cols)
-            wo = _make_dict(next(weather_observations), weather_cols)
+            po = _make_observation(next(pollutant_observations), pollutant_cols)
+            wo = _make_observation(next(weather_observations), weather_cols)
             while True:
                 delta = po['dateTime'] - wo['dateTime']
                 if abs(delta) < epsilon:
                     # close enough.
-                    d = dict.copy(po)
-                    for (k, v) in list(wo.items()):
-                        if k not in d or d[k] is None:
-                            d[k] = v
-                    joined.append(d)
-                    po = _make_dict(next(pollutant_observations), pollutant_cols)
-                    wo = _make_dict(next(weather_observations), weather_cols)
+                    joined.append(_merge_observations(po, wo))
+                    po = _make_observation(next(pollutant_observations), pollutant_cols)
+                    wo = _make_observation(next(weather_observations), weather_cols)
                 elif delta > 0:
                     # pollutant is future, increment weather
-                    wo = _make_dict(next(weather_observations), weather_cols)
+                    wo = _make_observation(next(weather_observations), weather_cols)
                 else:
                     # Weather is future, increment pollutant
-                    po = _make_dict(next(pollutant_observations), pollutant_cols)
+                    po = _make_observation(next(pollutant_observations), pollutant_cols)
         except StopIteration:
             pass
 
         return joined
 
+    def _join_nearest(self, pollutant_observations, pollutant_cols, weather_observations, weather_cols, tolerance):
+        '''Returns the pollutant observations that have weather observations
+        within tolerance seconds, with the nearest, or interpolated, weather
+        observation's values filling in their missing columns.'''
+        pollutant_rows = [_make_observation(row, pollutant_cols) for row in pollutant_observations]
+        weather_rows = [_make_observation(row, weather_cols) for row in weather_observations]
+        matches = _nearest_path([row['dateTime'] for row in pollutant_rows], [row['dateTime'] for row in weather_rows],
+            0, len(pollutant_rows), 0, len(weather_rows), tolerance, self.weather_join == 'interpolate')
+        for (p, match) in matches:
+            _apply_weather(pollutant_rows[p], weather_rows, match)
+        return [pollutant_rows[p] for (p, match) in matches]
+
+    def _get_weather_tolerance(self, archive_record):
+        '''Returns the maximum seconds between joined pollutant and weather
+        readings.'''
+        return self.weather_tolerance or archive_record['interval'] * 60
+
+    def flush(self):
+        '''Calculates and stores the AQIs that are still held back: those of
+        the archive records pending catch up, and those deferred by the time
+        budget.'''
+        if len(self.pending) > 0:
+            self._process_pending()
+        if len(self.deferred) > 0:
+            self._process_deferred()
+
     def shutDown(self):
         '''Service is shutting down.'''
+        if len(self.pending) > 0:
+            try:
+                self._process_pending()
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not process pending archive records: %s" % (str(e)))
+        if len(self.deferred) > 0:
+            try:
+                self._process_deferred()
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not process deferred AQIs: %s" % (str(e)))
+        self.timer.emit()
+        if self.query_pool is not None:
+            self.query_pool.close()
+        if self.idle_prefetcher is not None:
+            self.idle_prefetcher.close()
         try:
             self.aqi_dbm.close()
         except:
@@ -215,91 +641,12 @@ class AqiService(weewx.engine.StdService):
         except:
             pass
 
-    def new_archive_record(self, event):
-        '''This event is triggered when a new archive is ready from the main
-        weather sensor. PurpleAir (and presumably other air sensor plugins) uses
-        this event to query air sensor. This has the added benefit of
-        (approximately) syncing the readings from weather and air quality
-        sensors.'''
-        max_time_difference = event.record['interval'] * 60
-        now = event.record['dateTime']
-        start_time = now - self.aqi_standard.max_duration()
-        end_time = now - max_time_difference
-
-        # query the pollutant sensors
-        sql = 'SELECT '
-        pollution_sensor_real_cols = []
-        pollution_sensor_as_cols = []
-        first = True
-        for (as_col, real_col) in list(self._get_polution_sensor_columns().items()):
-            pollution_sensor_real_cols.append(real_col)
-            pollution_sensor_as_cols.append(as_col)
-            if not first:
-                sql += ', '
-            sql += real_col + ' AS ' + as_col
-            first = False
-        sql += ' FROM %s WHERE %s >= ? AND %s <= ? ORDER BY %s ASC' % (self.sensor_dbm.table_name,
-            self.sensor_epoch_seconds_column, self.sensor_epoch_seconds_column,
-            self.sensor_epoch_seconds_column)
-        pollutant_observations = self.sensor_dbm.genSql(sql, (start_time, end_time))
-
-        # query the weather sensors
-        weather_observations = iter([])
-        weather_cols = self._get_weather_sensor_columns()
-        weather_observations_real_cols = []
-        weather_observations_as_cols = []
-        if len(weather_cols) == 4:
-            # the sensor has the proper confiruration, so use it
-            sql = 'SELECT '
-            first = True
-            for (as_col, real_col) in list(weather_cols.items()):
-                weather_observations_real_cols.append(real_col)
-                weather_observations_as_cols.append(as_col)
-                if not first:
-                    sql += ', '
-                sql += real_col + ' AS ' + as_col
-                first = False
-            sql += ' FROM %s WHERE %s >= ? AND %s <= ? ORDER BY %s ASC' % (
-                self.sensor_dbm.table_name,
-                self.sensor_epoch_seconds_column,
-                self.sensor_epoch_seconds_column,
-                self.sensor_epoch_seconds_column)
-            weather_observations = self.sensor_dbm.genSql(sql, (start_time, end_time))
-        else:
-            # We can't get the weather data from the air sensor, so use the main sensor instead
-            # See https://github.com/weewx/weewx/wiki/Barometer,-pressure,-and-altimeter
-            weather_observations_real_cols = [ 'dateTime', 'outTemp', 'barometer', 'usUnits' ]
-            weather_observations_as_cols = [ 'dateTime', 'outTemp', 'pressure', 'weather_usUnits' ]
-            sql = 'SELECT '
-            first = True
-            for i in range(len(weather_observations_real_cols)):
-                real_col = weather_observations_real_cols[i]
-                as_col = weather_observations_as_cols[i]
-                if not first:
-                    sql += ', '
-                sql += real_col + ' AS ' + as_col
-                first = False
-            sql += ' FROM archive WHERE dateTime >= ? AND dateTime <= ? ORDER BY dateTime ASC'
-            weather_observations = self.weather_dbm.genSql(sql, (start_time, end_time))
-
-        # we need to be able to map back to underlying column for unit conversion
-        as_column_to_real_column = {}
-        for i in range(len(pollution_sensor_as_cols)):
-            as_column_to_real_column[pollution_sensor_as_cols[i]] = pollution_sensor_real_cols[i]
-        for i in range(len(weather_observations_as_cols)):
-            as_column_to_real_column[weather_observations_as_cols[i]] = weather_observations_real_cols[i]
-
-        # join the weather and pollutant tables. We do the join in code, because
-        # the data could have come through two different tables.
-        joined = self._join_sensor_results(
-            pollutant_observations, pollution_sensor_as_cols,
-            weather_observations, weather_observations_as_cols,
-            max_time_difference)
-
-        if len(joined) == 0:
-            return
-
-        # convert sensor units to aqi required units, possibly using the weather columns
+    def _convert_units(self, joined, as_column_to_real_column):
+        '''Converts the sensor units of the joined observations, in place, to
+        the units required by the aqi standard, possibly using the weather
+        columns. Each pollutant is converted a column at a time.'''
+        temps_kelvin = [None] * len(joined)
+        pressures_kilopascals = [None] * len(joined)
         for i in range(len(joined)):
             row = joined[i]
             # convert temperature to kelvin
@@ -312,7 +659,8 @@ class AqiService(weewx.engine.StdService):
                     else:
                         temp_kelvin = weewx.units.CtoK(weewx.units.FtoC(row['outTemp']))
             except TypeError:
-                syslog.syslog(syslog.LOG_WARNING, "AqiService: outTemp is missing, some AQIs may be skipped")
+                self.warnings.warn('outTemp missing', None, "outTemp at %s is %r, some AQIs may be skipped", row['dateTime'], row['outTemp'])
+            temps_kelvin[i] = temp_kelvin
 
             # convert pressure to pascals
             pressure_unit = get_unit_from_column(as_column_to_real_column['pressure'], row['weather_usUnits'])
@@ -322,75 +670,788 @@ class AqiService(weewx.engine.StdService):
                     press_kilopascals = weewx.units.conversionDict[pressure_unit]['hPa'](press_kilopascals)
                 press_kilopascals /= 10
             except TypeError:
-                syslog.syslog(syslog.LOG_WARNING, "AqiService: pressure is missing, some AQIs may be skipped")
-
-            for (pollutant, required_unit) in list(self.aqi_standard.get_pollutants().items()):
-                if pollutant in row:
-                    # convert the observed pollution units to what's required by the standard
-                    try:
-                        obs_unit = get_unit_from_column(as_column_to_real_column[pollutant], row['usUnits'])
-                    except KeyError:
-                        syslog.syslog(syslog.LOG_WARNING, "AqiService: AQI calculation could not find unit for column %s, assuming %s" \
-                            % (as_column_to_real_column[pollutant], required_unit))
-                        obs_unit = required_unit
-                    try:
-                        joined[i][pollutant] = units.convert_pollutant_units(pollutant, row[pollutant], obs_unit, required_unit, temp_kelvin, press_kilopascals)
-                    except TypeError:
-                        syslog.syslog(syslog.LOG_WARNING, "AqiService: Could not convert %s from %s units to %s units (%f %s, %f K, %f kPa)" \
-                            % (pollutant, obs_unit, required, row[pollutant], obs_unit, required_unit, temp_kelvin, press_kilopascals))
-                        joined[i][pollutant] = None
+                self.warnings.warn('pressure missing', None, "pressure at %s is %r, some AQIs may be skipped", row['dateTime'], row['pressure'])
+            pressures_kilopascals[i] = press_kilopascals
+
+        for (pollutant, required_unit) in list(self.aqi_standard.get_pollutants().items()):
+            # the rows observing the pollutant, by the units they were observed in
+            indices_by_units = {}
+            for i in range(len(joined)):
+                if pollutant in joined[i]:
+                    indices_by_units.setdefault(joined[i]['usUnits'], []).append(i)
+
+            for (usUnits, indices) in list(indices_by_units.items()):
+                # convert the observed pollution units to what's required by the standard
+                try:
+                    obs_unit = get_unit_from_column(as_column_to_real_column[pollutant], usUnits)
+                except KeyError:
+                    for i in indices:
+                        self.warnings.warn('unit unknown', pollutant, "could not find unit for column %s, assuming %s",
+                            as_column_to_real_column[pollutant], required_unit)
+                    obs_unit = required_unit
+                values = [joined[i][pollutant] for i in indices]
+                converted = units.convert_pollutant_units_column(pollutant, values, obs_unit, required_unit,
+                    [temps_kelvin[i] for i in indices], [pressures_kilopascals[i] for i in indices])
+                for (i, value, converted_value) in zip(indices, values, converted):
+                    if converted_value is None and obs_unit != required_unit:
+                        self.warnings.warn('conversion failed', pollutant, "could not convert %s from %s units to %s units (%r %s, %r K, %r kPa)",
+                            pollutant, obs_unit, required_unit, value, obs_unit, temps_kelvin[i], pressures_kilopascals[i])
+                    joined[i][pollutant] = converted_value
+
+    def new_archive_record(self, event):
+        '''This event is triggered when a new archive is ready from the main
+        weather sensor. PurpleAir (and presumably other air sensor plugins) uses
+        this event to query air sensor. This has the added benefit of
+        (approximately) syncing the readings from weather and air quality
+        sensors.'''
+        start = time.time()
+        with self.timer.event():
+            self.pending.append({
+                'dateTime': event.record['dateTime'],
+                'interval': event.record['interval'],
+            })
+            deadline = None
+            if self.budget_seconds is not None:
+                deadline = start + self.budget_seconds
+            if (self.catchup_min_lag is None) or \
+                    (start - event.record['dateTime'] <= self.catchup_min_lag) or \
+                    (len(self.pending) >= self.catchup_max_records):
+                self._process_pending(deadline)
+            self._apply_retention(start)
+            if len(self.deferred) > 0 and deadline is not None and time.time() < deadline:
+                with self.timer.stage('deferred'):
+                    self._process_deferred(deadline)
+        finished = time.time()
+
+        for ((cause, pollutant), n) in list(self.warnings.counts.items()):
+            self.metrics.inc('warnings_total', n, cause=cause, pollutant=pollutant or '')
+        self.warnings.flush("AqiService: warnings while processing %d: " % (event.record['dateTime']))
+
+        if self.idle_prefetcher is not None:
+            self.idle_prefetcher.schedule(finished + self.idle_fraction * event.record['interval'] * 60)
+
+        self.metrics.inc('events_total')
+        self.metrics.set('event_duration_seconds', finished - start)
+        self.metrics.set('lag_seconds', finished - event.record['dateTime'])
+        self.metrics.set('last_record_timestamp_seconds', event.record['dateTime'])
+        self.metrics.set('pending_records', len(self.pending))
+        self.metrics.set('deferred_records', len(self.deferred))
+        if self.metrics_file:
+            try:
+                self.metrics.write(self.metrics_file)
+            except (IOError, OSError) as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not write metrics to %s: %s" % (self.metrics_file, str(e)))
+
+    def _process_pending(self, deadline=None):
+        '''Calculates and stores the AQI records for the pending archive
+        records. After the deadline, if there is one, only the priority AQIs
+        are calculated, and the rest are deferred.'''
+        archive_records = self.pending
+        self.pending = []
+        if len(archive_records) == 1:
+            self._calculate_archive_record(archive_records[0], deadline)
+        elif len(archive_records) > 1:
+            self._calculate_archive_records(archive_records, deadline)
+
+    def _get_window(self, archive_record):
+        '''Returns the first and last timestamps of the readings used to
+        calculate the AQI of the archive record.'''
+        max_time_difference = archive_record['interval'] * 60
+        now = archive_record['dateTime']
+        return (now - self.aqi_standard.max_duration(), now - max_time_difference)
+
+    def _get_pollutant_query(self):
+        '''Returns the SQL selecting the pollutant readings in a window, the
+        canonical names of its columns, and a mapping from canonical to real
+        column names.'''
+        cols = self._get_polution_sensor_columns()
+        sql = _make_window_sql(cols, self.sensor_dbm.table_name, self.sensor_epoch_seconds_column)
+        return (sql, list(cols.keys()), cols)
+
+    def _query_window(self, pollutant_sql, weather_dbm, weather_sql, params):
+        '''Returns iterators over the rows of the pollutant and weather
+        queries. With a query pool, both queries are started at once on their
+        own connections, and their rows arrive as they are read.'''
+        if self.query_pool is None:
+            return (self.sensor_dbm.genSql(pollutant_sql, params), weather_dbm.genSql(weather_sql, params))
+        return (self.query_pool.submit(self.sensor_data_binding, pollutant_sql, params),
+                self.query_pool.submit(self._get_weather_data_binding(weather_dbm), weather_sql, params))
+
+    def _get_weather_data_binding(self, weather_dbm):
+        '''Returns the data binding of the weather readings' database manager.'''
+        return self.sensor_data_binding if weather_dbm is self.sensor_dbm else self.weather_data_binding
+
+    def _get_weather_query(self):
+        '''Returns the database manager and SQL selecting the weather readings
+        in a window, the canonical names of its columns, and a mapping from
+        canonical to real column names.'''
+        # If the sensor doesn't measure temperature and pressure, we use the main
+        # weather sensor instead.
+        # See https://github.com/weewx/weewx/wiki/Barometer,-pressure,-and-altimeter
+        (dbm, table_name, cols) = self._get_weather_source()
+        sql = _make_window_sql(cols, table_name, cols['dateTime'])
+        return (dbm, sql, list(cols.keys()), cols)
+
+    def _update_aggregates(self, now, lookback_secs):
+        '''Brings the aggregate tables up to date with the readings up to now.'''
+        for (name, table) in [('hourly_aggregates', self.hourly_aggregates), ('bucket_aggregates', self.bucket_aggregates)]:
+            if table is not None:
+                try:
+                    with self.timer.stage(name):
+                        table.update(now, lookback_secs)
+                except weedb.DatabaseError as e:
+                    syslog.syslog(syslog.LOG_ERR, "AqiService: could not update %s on %s: %s" % (table.table_name, now, str(e)))
+
+    def _get_real_columns(self):
+        '''Returns a mapping from the canonical names of the pollutant and
+        weather columns to their real names, needed for unit conversion.'''
+        as_column_to_real_column = dict(self._get_pollutant_query()[2])
+        as_column_to_real_column.update(self._get_weather_query()[3])
+        return as_column_to_real_column
+
+    def _get_bucket_observations(self, start_time, end_time):
+        '''Returns the pre-aggregated buckets ending in [start_time, end_time]
+        that have temperature and pressure readings, as joined observations,
+        and the timestamps of all of the buckets read.'''
+        buckets = list(self.timer.timed_iter('bucket_query',
+            self.bucket_aggregates.gen_buckets(start_time - 1, end_time)))
+        self.metrics.inc('rows_fetched_total', len(buckets), source='buckets')
+        observations = [_bucket_observation(bucket, self.bucket_aggregates.pollutants)
+            for bucket in buckets if bucket['weather_usUnits'] is not None]
+        return (observations, [bucket['dateTime'] for bucket in buckets])
+
+    def _apply_retention(self, now):
+        '''Compacts the AQI records that have aged out, at most once every
+        run_interval seconds.'''
+        if self.retention is None or \
+                (self.retention_time is not None and now - self.retention_time < self.retention_run_interval):
+            return
+        self.retention_time = now
+        try:
+            with self.timer.stage('retention'):
+                self.metrics.inc('retention_rows_total', self.retention.run(now))
+        except weedb.DatabaseError as e:
+            syslog.syslog(syslog.LOG_ERR, "AqiService: could not apply retention policy: %s" % (str(e)))
+
+    def _records_stored(self, records):
+        '''Updates everything derived from the newly stored AQI records.'''
+        for (name, rollup) in [('category_rollup', self.category_rollup), ('quantile_sketches', self.quantile_rollup)]:
+            if rollup is not None:
+                try:
+                    with self.timer.stage(name):
+                        rollup.add_records(records)
+                except weedb.DatabaseError as e:
+                    syslog.syslog(syslog.LOG_ERR, "AqiService: could not update %s on %s: %s" % (rollup.table_name, records[-1]['dateTime'], str(e)))
+
+        latest = max(records, key=lambda r: r['dateTime'])
+        if self.snapshot_file and (self.snapshot_time is None or latest['dateTime'] >= self.snapshot_time):
+            self._write_snapshot(latest)
+
+    def _write_snapshot(self, latest):
+        '''Replaces the snapshot with the latest AQI record.'''
+        try:
+            with self.timer.stage('snapshot'):
+                snapshot.write_snapshot(self.snapshot_file, snapshot.make_snapshot(latest, self.aqi_standard))
+            self.snapshot_time = latest['dateTime']
+        except (IOError, OSError) as e:
+            syslog.syslog(syslog.LOG_ERR, "AqiService: could not write snapshot to %s: %s" % (self.snapshot_file, str(e)))
+
+    def _calculate_archive_record(self, archive_record, deadline=None):
+        '''Calculates and stores the AQI record for the archive record.'''
+        self._update_aggregates(archive_record['dateTime'], self.aqi_standard.max_duration())
+        (joined, num_pollutant_observations) = self._get_joined(archive_record)
+        self._store_record(self._calculate_record(archive_record, joined, num_pollutant_observations, deadline))
+
+    def _get_joined(self, archive_record):
+        '''Returns the joined and converted observations in the window of the
+        archive record, and the number of pollutant observations read.'''
+        (start_time, end_time) = self._get_window(archive_record)
+        if self.bucket_aggregates is not None:
+            (joined, bucket_times) = self._get_bucket_observations(start_time, end_time)
+            with self.timer.stage('convert'):
+                self._convert_units(joined, self._get_real_columns())
+            return (joined, len(bucket_times))
+
+        (pollutant_sql, pollutant_cols, pollutant_real_cols) = self._get_pollutant_query()
+        (weather_dbm, weather_sql, weather_cols, weather_real_cols) = self._get_weather_query()
+        if self.window_caches is not None:
+            # only the readings that arrived since the last prefetch are read
+            with self.timer.stage('sensor_query'):
+                pollutant_rows = self.window_caches[0].get(self.sensor_dbm, start_time, end_time)
+            with self.timer.stage('weather_query'):
+                weather_rows = self.window_caches[1].get(weather_dbm, start_time, end_time)
+        else:
+            (pollutant_rows, weather_rows) = self._query_window(pollutant_sql, weather_dbm, weather_sql, (start_time, end_time))
+        pollutant_observations = _CountingIterator(self.timer.timed_iter('sensor_query', pollutant_rows))
+        weather_observations = _CountingIterator(self.timer.timed_iter('weather_query', weather_rows))
+
+        # we need to be able to map back to underlying column for unit conversion
+        as_column_to_real_column = dict(pollutant_real_cols)
+        as_column_to_real_column.update(weather_real_cols)
+
+        # join the weather and pollutant tables. We do the join in code, because
+        # the data could have come through two different tables.
+        with self.timer.stage('join'):
+            if self.weather_join == 'pairwise':
+                joined = self._join_sensor_results(
+                    pollutant_observations, pollutant_cols,
+                    weather_observations, weather_cols,
+                    archive_record['interval'] * 60)
+            else:
+                joined = self._join_nearest(
+                    pollutant_observations, pollutant_cols,
+                    weather_observations, weather_cols,
+                    self._get_weather_tolerance(archive_record))
+
+        # convert sensor units to aqi required units, possibly using the weather columns
+        with self.timer.stage('convert'):
+            self._convert_units(joined, as_column_to_real_column)
+
+        self.metrics.inc('rows_fetched_total', pollutant_observations.count, source='sensor')
+        self.metrics.inc('rows_fetched_total', weather_observations.count, source='weather')
+        return (joined, pollutant_observations.count)
+
+    def _store_record(self, record):
+        '''Stores the AQI record, if there is one.'''
+        if record is not None:
+            with self.timer.stage('store'):
+                self.aqi_dbm.addRecord(record)
+            self.metrics.inc('records_written_total')
+            self._records_stored([record])
+
+    def _calculate_archive_records(self, archive_records, deadline=None):
+        '''Calculates and stores the AQI records for a backlog of archive
+        records. The readings covering all of their windows are queried, joined,
+        and converted once, and the records are written with a single call to
+        addRecord. Each record is calculated from exactly the readings it would
+        have been calculated from on its own.'''
+        windows = [self._get_window(r) for r in archive_records]
+        start_time = min([w[0] for w in windows])
+        end_time = max([w[1] for w in windows])
+        first = min([r['dateTime'] for r in archive_records])
+        last = max([r['dateTime'] for r in archive_records])
+        self._update_aggregates(last, self.aqi_standard.max_duration() + last - first)
+        if self.bucket_aggregates is not None:
+            windows_joined = self._get_windows_bucket_observations(windows, start_time, end_time)
+        else:
+            windows_joined = self._get_windows_joined(archive_records, windows, start_time, end_time)
+
+        records = []
+        for (archive_record, (window_joined, num_pollutant_observations)) in zip(archive_records, windows_joined):
+            record = self._calculate_record(archive_record, window_joined, num_pollutant_observations, deadline)
+            if record is not None:
+                records.append(record)
+
+        if len(records) > 0:
+            with self.timer.stage('store'):
+                self.aqi_dbm.addRecord(records, log_success=False)
+            self.metrics.inc('records_written_total', len(records))
+            self._records_stored(records)
+        self.metrics.inc('catchup_batches_total')
+        syslog.syslog(syslog.LOG_INFO, "AqiService: caught up on %d archive records from %d to %d, stored %d" % (
+            len(archive_records), first, last, len(records)))
+
+    def _get_windows_joined(self, archive_records, windows, start_time, end_time):
+        '''Yields the joined and converted observations of each window, and
+        its number of pollutant observations, from a single query of the
+        readings in [start_time, end_time].'''
+        (pollutant_sql, pollutant_cols, pollutant_real_cols) = self._get_pollutant_query()
+        (weather_dbm, weather_sql, weather_cols, weather_real_cols) = self._get_weather_query()
+        (pollutant_rows, weather_rows) = self._query_window(pollutant_sql, weather_dbm, weather_sql, (start_time, end_time))
+        pollutant_rows = [_make_observation(row, pollutant_cols) for row in self.timer.timed_iter('sensor_query', pollutant_rows)]
+        weather_rows = [_make_observation(row, weather_cols) for row in self.timer.timed_iter('weather_query', weather_rows)]
+        self.metrics.inc('rows_fetched_total', len(pollutant_rows), source='sensor')
+        self.metrics.inc('rows_fetched_total', len(weather_rows), source='weather')
+
+        as_column_to_real_column = dict(pollutant_real_cols)
+        as_column_to_real_column.update(weather_real_cols)
+
+        pollutant_times = [row['dateTime'] for row in pollutant_rows]
+        weather_times = [row['dateTime'] for row in weather_rows]
+        bounds = []
+        for (window_start, window_end) in windows:
+            bounds.append((bisect.bisect_left(pollutant_times, window_start),
+                           bisect.bisect_right(pollutant_times, window_end),
+                           bisect.bisect_left(weather_times, window_start),
+                           bisect.bisect_right(weather_times, window_end)))
+        if self.weather_join == 'pairwise':
+            windows_joined = self._join_windows_pairwise(archive_records, bounds, pollutant_rows, pollutant_times,
+                weather_rows, weather_times, as_column_to_real_column)
+        else:
+            windows_joined = self._join_windows_nearest(archive_records, bounds, pollutant_rows, pollutant_times,
+                weather_rows, weather_times, as_column_to_real_column)
+        for ((p_start, p_end, w_start, w_end), window_joined) in zip(bounds, windows_joined):
+            yield (window_joined, p_end - p_start)
+
+    def _get_windows_bucket_observations(self, windows, start_time, end_time):
+        '''Returns the converted bucket observations of each window, and its
+        number of buckets, from a single query of the buckets ending in
+        [start_time, end_time].'''
+        (observations, bucket_times) = self._get_bucket_observations(start_time, end_time)
+        with self.timer.stage('convert'):
+            self._convert_units(observations, self._get_real_columns())
+        observation_times = [o['dateTime'] for o in observations]
+        windows_observations = []
+        for (window_start, window_end) in windows:
+            windows_observations.append((
+                observations[bisect.bisect_left(observation_times, window_start):bisect.bisect_right(observation_times, window_end)],
+                bisect.bisect_right(bucket_times, window_end) - bisect.bisect_left(bucket_times, window_start)))
+        return windows_observations
+
+    def _join_windows_pairwise(self, archive_records, bounds, pollutant_rows, pollutant_times,
+            weather_rows, weather_times, as_column_to_real_column):
+        '''Yields the joined and converted observations of each window in
+        bounds, a list of the windows' pollutant and weather index ranges,
+        exactly as _join_sensor_results() would join them.'''
+        # Join all of the readings once. A record's window starts at a
+        # different reading, so the greedy join may pair the readings at the
+        # start of the window differently, but once it reaches a state of the
+        # full join, the two make the same pairs.
+        epsilon = archive_records[0]['interval'] * 60
+        with self.timer.stage('join'):
+            (pairs, states) = _join_path(pollutant_times, weather_times, epsilon)
+            joined = [_merge_observations(pollutant_rows[p], weather_rows[w]) for (p, w) in pairs]
+        with self.timer.stage('convert'):
+            self._convert_units(joined, as_column_to_real_column)
+        joined_pollutants = [p for (p, w) in pairs]
+        joined_weather = [w for (p, w) in pairs]
+
+        for (archive_record, (p_start, p_end, w_start, w_end)) in zip(archive_records, bounds):
+            with self.timer.stage('join'):
+                (window_pairs, p_synced) = _join_window(pollutant_times, weather_times,
+                    p_start, p_end, w_start, w_end, archive_record['interval'] * 60,
+                    states if archive_record['interval'] * 60 == epsilon else {})
+                window_joined = [_merge_observations(pollutant_rows[p], weather_rows[w]) for (p, w) in window_pairs]
+            with self.timer.stage('convert'):
+                self._convert_units(window_joined, as_column_to_real_column)
+            if p_synced is not None:
+                k = bisect.bisect_left(joined_pollutants, p_synced)
+                window_joined.extend(joined[k:min(bisect.bisect_left(joined_pollutants, p_end, k),
+                                                  bisect.bisect_left(joined_weather, w_end, k))])
+            yield window_joined
+
+    def _join_windows_nearest(self, archive_records, bounds, pollutant_rows, pollutant_times,
+            weather_rows, weather_times, as_column_to_real_column):
+        '''Returns the joined and converted observations of each window in
+        bounds, a list of the windows' pollutant and weather index ranges,
+        exactly as _join_nearest() would join them.'''
+        # Match all of the readings once. A pollutant reading is matched the
+        # same way in a window as in the full join, unless the weather
+        # readings surrounding it fall outside the window, which only happens
+        # at the window's edges. Those readings are copied and filled in
+        # separately, before the pollutant readings are filled in, in place.
+        interpolate = self.weather_join == 'interpolate'
+        full_matches = [None] * len(pollutant_rows)
+        with self.timer.stage('join'):
+            for (p, match) in _nearest_path(pollutant_times, weather_times, 0, len(pollutant_times),
+                    0, len(weather_times), self._get_weather_tolerance(archive_records[0]), interpolate):
+                full_matches[p] = match
+            windows_matches = []
+            edges = []
+            for (archive_record, (p_start, p_end, w_start, w_end)) in zip(archive_records, bounds):
+                window_matches = []
+                for (p, match) in _nearest_path(pollutant_times, weather_times, p_start, p_end, w_start, w_end,
+                        self._get_weather_tolerance(archive_record), interpolate):
+                    if match == full_matches[p]:
+                        window_matches.append(p)
+                    else:
+                        po = pollutant_rows[p].copy()
+                        _apply_weather(po, weather_rows, match)
+                        window_matches.append(po)
+                        edges.append(po)
+                windows_matches.append(window_matches)
+            joined = []
+            for (p, match) in enumerate(full_matches):
+                if match is not None:
+                    _apply_weather(pollutant_rows[p], weather_rows, match)
+                    joined.append(pollutant_rows[p])
+        with self.timer.stage('convert'):
+            self._convert_units(joined, as_column_to_real_column)
+            self._convert_units(edges, as_column_to_real_column)
+        return [[pollutant_rows[m] if type(m) == int else m for m in window_matches]
+            for window_matches in windows_matches]
+
+    def _calculate_record(self, archive_record, joined, num_pollutant_observations, deadline=None):
+        '''Returns the AQI record for the archive record, calculated from the
+        joined and converted observations, or None if no AQI could be
+        calculated. After the deadline, if there is one, only the priority AQIs
+        are calculated, and the rest are deferred.'''
+        self.metrics.inc('rows_joined_total', len(joined))
+        self.metrics.inc('rows_dropped_total', num_pollutant_observations - len(joined))
+
+        if len(joined) == 0:
+            self.metrics.inc('records_skipped_total')
+            return None
 
         # calculate the AQIs
         record = {
-            'dateTime': event.record['dateTime'],
+            'dateTime': archive_record['dateTime'],
             'usUnits': weewx.US,
-            'interval': event.record['interval'],
+            'interval': archive_record['interval'],
             'aqi_standard': self.aqi_standard.guid,
         }
-        all_pollutants_available = True
-        for (pollutant, required_unit) in list(self.aqi_standard.get_pollutants().items()):
-            if pollutant in joined[0]:
-                try:
-                    (record['aqi_' + pollutant], record['aqi_' + pollutant + '_category']) = \
-                        self.aqi_standard.calculate_aqi(pollutant, required_unit, joined)
-                except ValueError as e:
-                    syslog.syslog(syslog.LOG_ERR, "AqiService: %s AQI calculation for %s on %s failed: %s" % (type(e).__name__, pollutant, event.record['dateTime'], str(e)))
-                except NotImplementedError as e:
-                    # Canada's AQHI does not define indcies for individual pollutants
-                    pass
+        deferred = self._calculate_aqis(archive_record, record, joined, self._get_calculation_order(joined[0]), deadline)
+        if len(deferred) > 0:
+            self._defer(archive_record, deferred)
+
+        if len(record) > 4:
+            return record
+        if len(deferred) == 0:
+            self.metrics.inc('records_skipped_total')
+            syslog.syslog(syslog.LOG_ERR, "AqiService: not storing record for dateTime %d" % (archive_record['dateTime']))
+        return None
+
+    def _get_calculation_order(self, observation):
+        '''Returns the AQIs that can be calculated from the observations, the
+        pollutants that were observed, and the composite if all of the
+        standard's pollutants were, with the priority AQIs first.'''
+        pollutants = [p for p in self.aqi_standard.get_pollutants() if p in observation]
+        names = list(pollutants)
+        if len(pollutants) == len(self.aqi_standard.get_pollutants()):
+            names.append(rollups.COMPOSITE)
+        order = [name for name in self.budget_priority if name in names]
+        return order + [name for name in names if name not in order]
+
+    def _calculate_aqis(self, archive_record, record, joined, names, deadline=None):
+        '''Calculates the AQIs of names, in order, into the record. After the
+        deadline, if there is one, only the priority AQIs are calculated.
+        Returns the names of the AQIs that were not calculated.'''
+        # the joined observations are in ascending order, like the readings
+        joined = calculators.ObservationWindow(joined, ascending=True)
+        aqis = {}
+        deferred = []
+        for name in names:
+            if name in aqis:
+                # already calculated for the composite
+                continue
+            if deadline is not None and name not in self.budget_priority and time.time() > deadline:
+                deferred.append(name)
+            elif name == rollups.COMPOSITE:
+                self._calculate_composite_aqi(archive_record, record, joined, aqis)
+            else:
+                self._calculate_aqi(archive_record, record, joined, name, aqis)
+        return deferred
+
+    def _calculate_aqi(self, archive_record, record, joined, pollutant, aqis):
+        '''Calculates the AQI of the pollutant into the record, unless it is
+        already in aqis, a map of pollutants to their (aqi, aqi_index), or None
+        if it could not be calculated.'''
+        if pollutant in aqis:
+            return
+        aqis[pollutant] = None
+        try:
+            with self.timer.stage('calculate.' + pollutant):
+                aqis[pollutant] = self.aqi_standard.calculate_aqi(pollutant, self.aqi_standard.get_pollutants()[pollutant], joined)
+            (record['aqi_' + pollutant], record['aqi_' + pollutant + '_category']) = aqis[pollutant]
+        except ValueError as e:
+            self.metrics.inc('calculation_failures_total', pollutant=pollutant, exception=type(e).__name__)
+            syslog.syslog(syslog.LOG_ERR, "AqiService: %s AQI calculation for %s on %s failed: %s" % (type(e).__name__, pollutant, archive_record['dateTime'], str(e)))
+        except NotImplementedError as e:
+            # Canada's AQHI does not define indcies for individual pollutants
+            pass
+
+    def _calculate_composite_aqi(self, archive_record, record, joined, aqis):
+        '''Calculates the composite AQI into the record. If the standard
+        combines the pollutants' AQIs, they are reused from aqis, or calculated
+        into it.'''
+        pollutants = self.aqi_standard.get_pollutants()
+        try:
+            if self.combines_aqis:
+                for pollutant in pollutants:
+                    self._calculate_aqi(archive_record, record, joined, pollutant, aqis)
+                    if aqis[pollutant] is None:
+                        raise ValueError('%s AQI could not be calculated' % (pollutant))
+                with self.timer.stage('composite'):
+                    (record['aqi_composite'], record['aqi_composite_category']) = \
+                        self.aqi_standard.combine_aqis([aqis[pollutant] for pollutant in pollutants])
             else:
-                all_pollutants_available = False
-        if all_pollutants_available:
+                with self.timer.stage('composite'):
+                    (record['aqi_composite'], record['aqi_composite_category']) = \
+                        self.aqi_standard.calculate_composite_aqi(pollutants, joined)
+        except (ValueError, TypeError) as e:
+            self.metrics.inc('calculation_failures_total', pollutant='composite', exception=type(e).__name__)
+            syslog.syslog(syslog.LOG_ERR, "AqiService: %s AQI calculation for composite on %s failed: %s" % (type(e).__name__, archive_record['dateTime'], str(e)))
+
+    def _defer(self, archive_record, names):
+        '''Queues the AQIs of the archive record that were not calculated
+        before the deadline.'''
+        for name in names:
+            self.metrics.inc('deferred_aqis_total', pollutant=name)
+        syslog.syslog(syslog.LOG_INFO, "AqiService: over budget on %d, deferred %s" % (archive_record['dateTime'], ', '.join(names)))
+        self.deferred.append((archive_record, names))
+        if len(self.deferred) > self.max_deferred:
+            (dropped, dropped_names) = self.deferred.pop(0)
+            syslog.syslog(syslog.LOG_ERR, "AqiService: too many deferred records, dropping %s on %d" % (', '.join(dropped_names), dropped['dateTime']))
+
+    def _process_deferred(self, deadline=None):
+        '''Calculates the deferred AQIs, oldest first, until the deadline if
+        there is one, and updates their stored records.'''
+        updated = []
+        while len(self.deferred) > 0 and (deadline is None or time.time() < deadline):
+            (archive_record, names) = self.deferred.pop(0)
+            (joined, num_pollutant_observations) = self._get_joined(archive_record)
+            if len(joined) == 0:
+                continue
+            record = {
+                'dateTime': archive_record['dateTime'],
+                'usUnits': weewx.US,
+                'interval': archive_record['interval'],
+                'aqi_standard': self.aqi_standard.guid,
+            }
+            self._calculate_aqis(archive_record, record, joined, names)
+            cols = [col for col in record if col.startswith('aqi_') and col != 'aqi_standard']
+            if len(cols) == 0:
+                continue
+            if self.aqi_dbm.getSql('SELECT dateTime FROM %s WHERE dateTime = ?' % (self.aqi_dbm.table_name), (record['dateTime'],)) is None:
+                # none of the priority AQIs could be calculated
+                self._store_record(record)
+                continue
+            with weedb.Transaction(self.aqi_dbm.connection) as cursor:
+                cursor.execute('UPDATE %s SET %s WHERE dateTime = ?' % (self.aqi_dbm.table_name,
+                    ', '.join(['%s = ?' % (col) for col in cols])), tuple([record[col] for col in cols] + [record['dateTime']]))
+            updated.append(record['dateTime'])
+        if len(updated) > 0:
+            self._records_updated(min(updated), max(updated))
+
+    def _records_updated(self, first, last):
+        '''Updates everything derived from the stored AQI records from first
+        to last, after they were updated in place.'''
+        if hasattr(self.aqi_dbm, 'backfill_day_summary'):
             try:
-                (record['aqi_composite'], record['aqi_composite_category']) = \
-                    self.aqi_standard.calculate_composite_aqi(self.aqi_standard.get_pollutants(), joined)
-            except (ValueError, TypeError) as e:
-                syslog.syslog(syslog.LOG_ERR, "AqiService: %s AQI calculation for composite on %s failed: %s" % (type(e).__name__, event.record['dateTime'], str(e)))
+                self.aqi_dbm.backfill_day_summary(
+                    start_d=datetime.date.fromtimestamp(weeutil.weeutil.startOfArchiveDay(first)),
+                    stop_d=datetime.date.fromtimestamp(weeutil.weeutil.startOfArchiveDay(last)),
+                    progress_fn=lambda *args: None)
+            except (weedb.DatabaseError, weewx.ViolatedPrecondition) as e:
+                syslog.syslog(syslog.LOG_ERR, "AqiService: could not update the daily summaries from %d to %d: %s" % (first, last, str(e)))
+        for rollup in [self.category_rollup, self.quantile_rollup]:
+            if rollup is not None:
+                try:
+                    rollup.rebuild(first, last)
+                except weedb.DatabaseError as e:
+                    syslog.syslog(syslog.LOG_ERR, "AqiService: could not update %s from %d to %d: %s" % (rollup.table_name, first, last, str(e)))
+        if self.snapshot_file and self.snapshot_time is not None and first <= self.snapshot_time <= last:
+            latest = self.aqi_dbm.getRecord(self.snapshot_time)
+            if latest is not None:
+                self._write_snapshot(latest)
 
-        if len(record) > 4:
-            self.aqi_dbm.addRecord(record)
-        else:
-            syslog.syslog(syslog.LOG_ERR, "AqiService: not storing record for dateTime %d" % (now))
 
+def _get_span(timespan, span):
+    '''Returns the timespan of span: 'day', 'week', 'month', or 'year'
+    ending with the report's timespan, 'all' for all time, a timespan, or
+    None for the report's timespan.'''
+    if span is None:
+        return timespan
+    elif span == 'day':
+        return weeutil.weeutil.archiveDaySpan(timespan.stop)
+    elif span == 'week':
+        return weeutil.weeutil.archiveWeekSpan(timespan.stop)
+    elif span == 'month':
+        return weeutil.weeutil.archiveMonthSpan(timespan.stop)
+    elif span == 'year':
+        return weeutil.weeutil.archiveYearSpan(timespan.stop)
+    elif span == 'all':
+        return weeutil.weeutil.TimeSpan(0, timespan.stop)
+    # e.g. $month, rather than $month.timespan
+    return getattr(span, 'timespan', span)
+
+class AqiSpanStats(object):
+    '''Statistics of a pollutant's AQI records in a timespan, for the
+    '$aqi.span()' tag. The scalar statistics are calculated together, by a
+    single aggregate query, the first time one of them is used. The results
+    are cached for the rest of the report run.'''
+    def __init__(self, dbm, aqi_standard, pollutant, timespan, cache):
+        if pollutant not in rollups.POLLUTANTS:
+            raise ValueError('unknown pollutant %s' % (pollutant))
+        self.dbm = dbm
+        self.aqi_standard = aqi_standard
+        self.pollutant = pollutant
+        self.timespan = timespan
+        self.cache = cache
+
+    def _query(self, name, sql):
+        key = (name, self.pollutant, self.timespan.start, self.timespan.stop)
+        if key not in self.cache:
+            self.cache[key] = list(self.dbm.genSql(sql % {
+                'aqi': 'aqi_' + self.pollutant,
+                'category': 'aqi_' + self.pollutant + '_category',
+                'table': self.dbm.table_name,
+            }, (self.timespan.start, self.timespan.stop, self.aqi_standard.guid)))
+        return self.cache[key]
+
+    def _stats(self):
+        return self._query('stats', 'SELECT MIN(%(aqi)s), MAX(%(aqi)s), AVG(%(aqi)s), COUNT(%(aqi)s), MAX(%(category)s) '
+            'FROM %(table)s WHERE dateTime > ? AND dateTime <= ? AND aqi_standard = ?')[0]
+
+    @property
+    def min(self):
+        return self._stats()[0]
+
+    @property
+    def max(self):
+        return self._stats()[1]
+
+    @property
+    def mean(self):
+        return self._stats()[2]
+
+    @property
+    def count(self):
+        return self._stats()[3]
+
+    @property
+    def max_category(self):
+        '''The interpretation of the worst category, with its index.'''
+        index = self._stats()[4]
+        d = dict(self.aqi_standard.interpret_aqi_index(index))
+        d['index'] = index
+        return d
+
+    @property
+    def category_counts(self):
+        '''The number of records, and their duration, in each category, in
+        order of category.'''
+        counts = []
+        for (category, count, duration) in self._query('category_counts', 'SELECT %(category)s, COUNT(*), SUM(interval) '
+                'FROM %(table)s WHERE dateTime > ? AND dateTime <= ? AND aqi_standard = ? AND %(category)s IS NOT NULL '
+                'GROUP BY %(category)s ORDER BY %(category)s ASC'):
+            d = dict(self.aqi_standard.interpret_aqi_index(category))
+            d.update({
+                'index': category,
+                'count': count,
+                'seconds': duration * 60,
+                'hours': duration / 60.0,
+            })
+            counts.append(d)
+        return counts
+
+class AqiTag(object):
+    '''The '$aqi' tag. Called with an aqi index, it returns its interpretation,
+    e.g. $aqi($current.aqi_pm2_5_category).color. span() returns the
+    statistics of a pollutant's AQIs over a timespan, e.g.
+    $aqi.span('pm2_5', 'month').max.'''
+    def __init__(self, aqi_standard, timespan, db_lookup, data_binding, cache):
+        self.aqi_standard = aqi_standard
+        self.timespan = timespan
+        self.db_lookup = db_lookup
+        self.data_binding = data_binding
+        self.cache = cache
+
+    def __call__(self, aqi_index):
+        return self.aqi_standard.interpret_aqi_index(getattr(aqi_index, 'raw', aqi_index))
+
+    def span(self, pollutant=rollups.COMPOSITE, span=None):
+        '''Returns the AqiSpanStats of the pollutant over the span, which
+        takes the same values as $aqi_categories.'''
+        return AqiSpanStats(self.db_lookup(self.data_binding), self.aqi_standard, pollutant,
+            _get_span(self.timespan, span), self.cache)
 
 class AqiSearchList(weewx.cheetahgenerator.SearchList):
-    '''Class that implements the '$aqi' tag in cheetah templates'''
+    '''Class that implements the '$aqi' and '$aqi_series' tags in cheetah
+    templates, and '$aqi.span()'. The '$aqi_hourly', '$aqi_categories',
+    '$aqi_percentile', and '$aqi_latest' tags are added when the hourly
+    aggregates, category rollup, quantile sketches, and snapshot are enabled.'''
     def __init__(self, generator):
         weewx.cheetahgenerator.SearchList.__init__(self, generator)
         config_dict = generator.config_dict
 
         # configure the aqi standard
         standard_config_dict = config_dict['AqiService']['standard']
-        fq_standard = standard_config_dict['standard']
-        standard_path = '.'.join(fq_standard.split('.')[:-1])
-        standard_name = fq_standard.split('.')[-1]
-        __import__(standard_path)
-        standard_class = getattr(sys.modules[standard_path], standard_name)
-        self.aqi_standard = standard_class(int(config_dict['StdArchive']['archive_interval']))
-
-        self.search_list_extension = {
-            'aqi': lambda x: self.aqi_standard.interpret_aqi_index(x.raw)
-        }
+        self.aqi_standard = standards.get_standard(standard_config_dict['standard'],
+            int(config_dict['StdArchive']['archive_interval']))
+        self.aqi_data_binding_name = standard_config_dict['data_binding']
+
+        rollup_config_dict = config_dict['AqiService'].get('category_rollup', {})
+        self.rollup_table_name = None
+        if weeutil.weeutil.to_bool(rollup_config_dict.get('enable', False)):
+            self.rollup_table_name = rollup_config_dict.get('table_name', 'aqi_category_rollup')
+        hourly_config_dict = config_dict['AqiService'].get('hourly_aggregates', {})
+        self.hourly_table_name = None
+        if weeutil.weeutil.to_bool(hourly_config_dict.get('enable', False)):
+            self.hourly_table_name = hourly_config_dict.get('table_name', 'aqi_hourly')
+        sketch_config_dict = config_dict['AqiService'].get('quantile_sketches', {})
+        self.sketch_table_name = None
+        if weeutil.weeutil.to_bool(sketch_config_dict.get('enable', False)):
+            self.sketch_table_name = sketch_config_dict.get('table_name', 'aqi_quantile_sketch')
+
+        self.snapshot_reader = None
+        snapshot_file = config_dict['AqiService'].get('snapshot', {}).get('file', None)
+        if snapshot_file:
+            self.snapshot_reader = snapshot.get_reader(snapshot_file)
+
+        # query results, shared by every template of the report run
+        self.cache = {}
+
+    def _interpret_series(self, indices, fmt=None):
+        '''Returns the interpretations of a series of aqi indices, or if fmt
+        is given, the concatenation of fmt formatted with each of them (e.g.
+        '<td style="background-color: #%(color)s">%(category)s</td>'). The
+        indices may be a list of numbers or tags, a tag holding a list, or a
+        weewx series.'''
+        indices = getattr(indices, 'data', indices)
+        indices = getattr(indices, 'raw', indices)
+        if isinstance(indices, weewx.units.ValueTuple):
+            indices = indices[0]
+        interpretations = self.aqi_standard.interpret_aqi_indices([getattr(i, 'raw', i) for i in indices])
+        if fmt is None:
+            return interpretations
+        return ''.join([fmt % interpretation for interpretation in interpretations])
 
     def get_extension_list(self, timespan, db_lookup):
-        return [self.search_list_extension]
+        extension = {
+            'aqi': AqiTag(self.aqi_standard, timespan, db_lookup, self.aqi_data_binding_name, self.cache),
+            'aqi_series': self._interpret_series,
+        }
+        if self.snapshot_reader is not None:
+            extension['aqi_latest'] = self.snapshot_reader.read() or {}
+        if self.rollup_table_name is not None:
+            extension['aqi_categories'] = lambda pollutant=rollups.COMPOSITE, span=None: \
+                self._get_category_durations(db_lookup, timespan, pollutant, span)
+        if self.hourly_table_name is not None:
+            extension['aqi_hourly'] = lambda pollutant=calculators.PM2_5, span=None: \
+                self._get_hourly(db_lookup, timespan, pollutant, span)
+        if self.sketch_table_name is not None:
+            extension['aqi_percentile'] = lambda percentile, pollutant=rollups.COMPOSITE, span=None: \
+                self._get_percentile(db_lookup, timespan, percentile, pollutant, span)
+        return [extension]
+
+    def _get_category_durations(self, db_lookup, timespan, pollutant, span):
+        '''Returns the time spent in each category by the pollutant, over the
+        whole days of the span.'''
+        span = _get_span(timespan, span)
+        rollup = rollups.CategoryRollup(db_lookup(self.aqi_data_binding_name), self.rollup_table_name, create=False)
+        durations = []
+        for (category, duration, count, max_aqi) in rollup.get_durations(self.aqi_standard.guid, pollutant, span.start, span.stop):
+            d = dict(self.aqi_standard.interpret_aqi_index(category))
+            d.update({
+                'index': category,
+                'seconds': duration,
+                'hours': duration / 3600.0,
+                'count': count,
+                'max_aqi': max_aqi,
+            })
+            durations.append(d)
+        return durations
+
+    def _get_hourly(self, db_lookup, timespan, pollutant, span):
+        '''Returns the hourly statistics of the pollutant's readings over the
+        span, from the hourly aggregates, oldest first.'''
+        if pollutant not in aggregates.POLLUTANTS:
+            raise ValueError('unknown pollutant %s' % (pollutant))
+        span = _get_span(timespan, span)
+        key = ('hourly', pollutant, span.start, span.stop)
+        if key not in self.cache:
+            self.cache[key] = list(aggregates.gen_pollutant_stats(db_lookup(self.aqi_data_binding_name),
+                self.hourly_table_name, pollutant, span.start, span.stop))
+        return self.cache[key]
+
+    def _get_percentile(self, db_lookup, timespan, percentile, pollutant, span):
+        '''Returns the estimated percentile, from 0 to 100, of the pollutant's
+        AQIs over the whole days of the span, or None if there are none.'''
+        span = _get_span(timespan, span)
+        # merged sketches are reused by every percentile of the same span
+        key = ('sketch', pollutant, span.start, span.stop)
+        if key not in self.cache:
+            rollup = rollups.QuantileRollup(db_lookup(self.aqi_data_binding_name), self.sketch_table_name, create=False)
+            self.cache[key] = rollup.get_sketch(self.aqi_standard.guid, pollutant, span.start, span.stop)
+        return self.cache[key].quantile(float(percentile) / 100.0)
@@ -0,0 +1,106 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import json
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+class QuantileSketch(object):
+    '''A mergeable sketch of a distribution of non-negative values, that
+    answers quantile queries with a bounded relative error (DDSketch).
+
+    Positive values are counted in logarithmically sized buckets, such that
+    every value in a bucket is within relative_accuracy of the bucket's
+    midpoint. Zero and negative values are counted in a single bucket reported
+    as the minimum. Merging two sketches adds their bucket counts, so merging
+    is exact and the order of merges does not matter.'''
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        '''Adds the value to the sketch, count times.'''
+        if value > 0:
+            i = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[i] = self.buckets.get(i, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        '''Adds the values of the other sketch to this one. Raises ValueError if
+        the sketches have different relative accuracies.'''
+        if other.gamma != self.gamma:
+            raise ValueError('can not merge sketches with relative accuracies %r and %r' % (self.relative_accuracy, other.relative_accuracy))
+        if other.count == 0:
+            return self
+        for (i, n) in list(other.buckets.items()):
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        return self
+
+    def quantile(self, q):
+        '''Returns the estimated q-quantile, with q between 0 and 1, or None if
+        the sketch is empty.'''
+        if self.count == 0:
+            return None
+        if q < 0 or q > 1:
+            raise ValueError('quantile %r is not between 0 and 1' % (q))
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                value = 2 * math.pow(self.gamma, i) / (self.gamma + 1)
+                return max(self.min, min(self.max, value))
+        return self.max
+
+    def to_json(self):
+        '''Returns the sketch as a compact JSON string. The buckets are stored
+        as the index of the first bucket, and the counts of the consecutive
+        buckets from there.'''
+        d = {
+            'a': self.relative_accuracy,
+            'n': self.count,
+            'z': self.zero_count,
+            'min': self.min,
+            'max': self.max,
+        }
+        if len(self.buckets) > 0:
+            first = min(self.buckets)
+            d['k'] = first
+            d['c'] = [self.buckets.get(i, 0) for i in range(first, max(self.buckets) + 1)]
+        return json.dumps(d, separators=(',', ':'))
+
+    @staticmethod
+    def from_json(s):
+        '''Returns the sketch stored by to_json().'''
+        d = json.loads(s)
+        sketch = QuantileSketch(d['a'])
+        sketch.count = d['n']
+        sketch.zero_count = d['z']
+        sketch.min = d['min']
+        sketch.max = d['max']
+        for (j, n) in enumerate(d.get('c', [])):
+            if n > 0:
+                sketch.buckets[d['k'] + j] = n
+        return sketch
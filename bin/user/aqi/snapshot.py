@@ -0,0 +1,71 @@
+# weewx-aqi
+# Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
+# License: GPL 3
+
+import json
+import os
+
+from . import fileutil
+from . import rollups
+
+def make_snapshot(record, aqi_standard):
+    '''Returns the snapshot of an AQI record: its timestamp, interval and
+    standard, and for the composite and each pollutant with an AQI, the AQI,
+    the category's index, and the color and category name from
+    interpret_aqi_index().'''
+    snapshot = {
+        'dateTime': record['dateTime'],
+        'interval': record['interval'],
+        'aqi_standard': record['aqi_standard'],
+    }
+    for pollutant in rollups.POLLUTANTS:
+        aqi = record.get('aqi_' + pollutant)
+        if aqi is None:
+            continue
+        index = record.get('aqi_' + pollutant + '_category')
+        d = dict(aqi_standard.interpret_aqi_index(index))
+        d.update({
+            'aqi': aqi,
+            'index': index,
+        })
+        snapshot[pollutant] = d
+    return snapshot
+
+def write_snapshot(path, snapshot):
+    '''Atomically replaces the snapshot file with the snapshot, as JSON.'''
+    fileutil.atomic_write(path, json.dumps(snapshot, sort_keys=True))
+
+_readers = {}
+
+def get_reader(path):
+    '''Returns the SnapshotReader of the path shared by the whole process.'''
+    if path not in _readers:
+        _readers[path] = SnapshotReader(path)
+    return _readers[path]
+
+class SnapshotReader(object):
+    '''Reads the snapshot file, only parsing it again after it has been
+    replaced, so every skin rendered in a report cycle shares one read.'''
+    def __init__(self, path):
+        self.path = path
+        self.stat = None
+        self.snapshot = None
+
+    def read(self):
+        '''Returns the latest snapshot, or None if there is none.'''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.stat = None
+            self.snapshot = None
+            return None
+        stat = (st.st_ino, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size)
+        if stat != self.stat:
+            try:
+                with open(self.path) as f:
+                    self.snapshot = json.load(f)
+                self.stat = stat
+            except (IOError, OSError, ValueError):
+                # replaced while reading, keep the last one
+                pass
+        return self.snapshot
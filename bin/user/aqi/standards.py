@@ -3,6 +3,9 @@
 # License: GPL 3
 
 from abc import ABCMeta, abstractmethod
+import importlib
+import sys
+import threading
 
 from six import with_metaclass
 
@@ -19,16 +22,94 @@ EU_CAQI_H_GUID = 8
 AU_AQI_GUID = 9
 AU_IWRPI_GUID = 10
 
+# The standards shipped with weewx-aqi: guid, module in this package, class,
+# and short name. Modules are only imported when their standard is first used.
+REGISTRY = [
+    (CA_AQHI_GUID, 'ca', 'AirQualityHealthIndex', 'ca_aqhi'),
+    (IN_NAQI_GUID, 'india', 'NationalAirQualityIndex', 'in_naqi'),
+    (MX_IMCA_GUID, 'mx', 'IndiceMetropolitanoCalidadAire', 'mx_imca'),
+    (UK_DAQI_GUID, 'uk', 'DailyAirQualityIndex', 'uk_daqi'),
+    (US_AQI_GUID, 'us', 'AirQualityIndex', 'us_aqi'),
+    (US_NOWCAST_GUID, 'us', 'NowCast', 'us_nowcast'),
+    (EU_EAQI_GUID, 'eu', 'EuropeanAirQualityIndex', 'eu_eaqi'),
+    (EU_CAQI_H_GUID, 'eu', 'CommonAirQualityHourlyIndex', 'eu_caqi_h'),
+    (AU_AQI_GUID, 'au', 'AirQualityIndex', 'au_aqi'),
+]
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+def _find_registered(name):
+    '''Returns the REGISTRY entry of a guid, short name, or fully qualified
+    class name (e.g. user.aqi.us.NowCast), or None.'''
+    for entry in REGISTRY:
+        (guid, module, class_name, short_name) = entry
+        if name == guid or name == str(guid) or name == short_name or \
+                str(name).endswith('.%s.%s.%s' % (__name__.split('.')[-2], module, class_name)):
+            return entry
+    return None
+
+def get_standard_name(guid):
+    '''Returns the short name of the standard stored as guid in the
+    aqi_standard column, without importing it, or None if it is unknown.'''
+    entry = _find_registered(guid)
+    if entry is None:
+        return None
+    return entry[3]
+
+def get_standard_class(name):
+    '''Returns the class of a standard, given its guid, short name, or fully
+    qualified class name. Standards that are not registered are imported by
+    their fully qualified class name. Raises KeyError if it can not be found.'''
+    entry = _find_registered(name)
+    if entry is not None:
+        module = importlib.import_module('.' + entry[1], __name__.rsplit('.', 1)[0])
+        return getattr(module, entry[2])
+    name = str(name)
+    if '.' not in name:
+        raise KeyError('unknown aqi standard %s' % (name))
+    module_name = '.'.join(name.split('.')[:-1])
+    __import__(module_name)
+    return getattr(sys.modules[module_name], name.split('.')[-1])
+
+def get_standard(name, obs_frequency_in_sec):
+    '''Returns the standard, given its guid, short name, or fully qualified
+    class name, for observations every obs_frequency_in_sec. Standards are
+    constructed once per process for each frequency, and shared, e.g. between
+    AqiService and AqiSearchList.'''
+    standard_class = get_standard_class(name)
+    key = (standard_class, int(obs_frequency_in_sec))
+    with _instances_lock:
+        if key not in _instances:
+            _instances[key] = standard_class(int(obs_frequency_in_sec))
+        return _instances[key]
+
+class Interpretation(dict):
+    '''The color, category name, and text label of an AQI category. These are
+    shared by every caller, so they are read only; copy them with dict() to
+    modify them.'''
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('AQI interpretations are read only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+UNKNOWN_INTERPRETATION = Interpretation(color='None', category='None', label='None')
+
 class AqiStandards(with_metaclass(ABCMeta)):
-    def __init__(self, colors, categories, guid):
+    def __init__(self, colors, categories, guid, labels=None):
         '''Creates an AqiStandard with the specified color and categorical scales.
+        labels are optional text labels for the categories, which default to
+        the category names.
         self.calculators is initalized to an empty dictionary. It is up to
         implementations to populate this dictionary as a map of pollutants to
         aqi.AqiCalculator calulators.'''
         self.colors = colors
         self.categories = categories
+        self.labels = labels or categories
         self.guid = guid
         self.calculators = {}
+        self.interpretations = tuple([Interpretation(color=color, category=category, label=label)
+            for (color, category, label) in zip(self.colors, self.categories, self.labels)])
 
     def max_duration(self):
         '''Returns the maximum duration window for the calculator.'''
@@ -65,25 +146,30 @@ class AqiStandards(with_metaclass(ABCMeta)):
         #
         # (Yes, the is a US-centric standard, but it also the most common method,
         # of combining AQIs.)
+        return self.combine_aqis([self.calculate_aqi(pollutant, pollutants_and_units[pollutant], observations)
+            for pollutant in pollutants_and_units])
+
+    def combine_aqis(self, aqis):
+        '''Returns the composite of the (aqi, aqi_index) pairs of individual
+        pollutants calculated by calculate_composite_aqi(), which is the pair
+        with the maximum AQI. Standards that override calculate_composite_aqi()
+        may not combine AQIs this way.'''
         max_aqi = -1
         max_aqi_index = -1
-        for pollutant in pollutants_and_units:
-            observation_unit = pollutants_and_units[pollutant]
-            (aqi, aqi_index) = self.calculate_aqi(pollutant, observation_unit, observations)
+        for (aqi, aqi_index) in aqis:
             if aqi > max_aqi:
                 max_aqi = aqi
                 max_aqi_index = aqi_index
         return (max_aqi, max_aqi_index)
 
     def interpret_aqi_index(self, aqi_index):
-        '''Returns the color and category name associated with the pollutant
-        with the aqi_index (not aqi value).'''
+        '''Returns the color, category name, and label associated with the
+        pollutant with the aqi_index (not aqi value).'''
         if aqi_index is None:
-            return {
-                'color': 'None',
-                'category': 'None'
-            }
-        return {
-            'color': self.colors[int(aqi_index)],
-            'category': self.categories[int(aqi_index)]
-        }
+            return UNKNOWN_INTERPRETATION
+        return self.interpretations[int(aqi_index)]
+
+    def interpret_aqi_indices(self, aqi_indices):
+        '''Returns the interpretations of a series of aqi indices.'''
+        interpretations = self.interpretations
+        return [UNKNOWN_INTERPRETATION if i is None else interpretations[int(i)] for i in aqi_indices]
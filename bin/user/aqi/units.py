@@ -47,7 +47,7 @@ def convert_pollutant_units(pollutant, obs_value, obs_unit, required_unit, temp_
             ug_per_m3 = weewx.units.conversionDict[obs_unit]['microgram_per_meter_cubed'](obs_value)
         ppb = microgram_per_meter_cubed_to_ppb(pollutant, ug_per_m3, temp_in_kelvin, pressure_in_kilopascals)
         if required_unit == 'part_per_billion':
-            return ug_per_m3
+            return ppb
         else:
             return weewx.units.conversionDict['part_per_billion'][required_unit](ppb)
 
@@ -64,6 +64,56 @@ def microgram_per_meter_cubed_to_ppb(pollutant, ug_per_m3, sensor_temp_in_kelvin
     ppb = (ug_per_m3 * sensor_temp_in_kelvin) / ((sensor_pressure_in_kilopascals / GAS_CONSTANT) * MOLAR_MASSES[pollutant])
     return round(ppb, 3)
 
+def _convert_column(values, convert):
+    return [None if value is None else convert(value) for value in values]
+
+def convert_pollutant_units_column(pollutant, obs_values, obs_unit, required_unit, temps_in_kelvin, pressures_in_kilopascals):
+    '''Converts a column of observations, with the temperature and pressure of
+    each, like convert_pollutant_units(), in one call. Returns a list of the
+    converted values. Where a value can not be converted, because it, or the
+    temperature or pressure it needs, is missing, it is None.'''
+    if obs_unit == required_unit:
+        return list(obs_values)
+
+    if (obs_unit[:9] == 'part_per_') and required_unit.endswith('_per_meter_cubed'):
+        ppbs = obs_values
+        if obs_unit == 'part_per_million':
+            ppbs = _convert_column(obs_values, weewx.units.conversionDict[obs_unit]['part_per_billion'])
+        ug_per_m3s = ppb_to_microgram_per_meter_cubed_column(pollutant, ppbs, temps_in_kelvin, pressures_in_kilopascals)
+        if required_unit == 'microgram_per_meter_cubed':
+            return ug_per_m3s
+        else:
+            return _convert_column(ug_per_m3s, weewx.units.conversionDict['microgram_per_meter_cubed'][required_unit])
+
+    elif (obs_unit[9:] == '_per_meter_cubed') and (required_unit[:9] == 'part_per_'):
+        ug_per_m3s = obs_values
+        if obs_unit == 'milligram_per_meter_cubed':
+            ug_per_m3s = _convert_column(obs_values, weewx.units.conversionDict[obs_unit]['microgram_per_meter_cubed'])
+        ppbs = microgram_per_meter_cubed_to_ppb_column(pollutant, ug_per_m3s, temps_in_kelvin, pressures_in_kilopascals)
+        if required_unit == 'part_per_billion':
+            return ppbs
+        else:
+            return _convert_column(ppbs, weewx.units.conversionDict['part_per_billion'][required_unit])
+
+    else:
+        return _convert_column(obs_values, weewx.units.conversionDict[obs_unit][required_unit])
+
+def ppb_to_microgram_per_meter_cubed_column(pollutant, ppbs, temps_in_kelvin, pressures_in_kilopascals):
+    '''Converts a column of parts per billion to micrograms per cubic meter,
+    rounded exactly like ppb_to_microgram_per_meter_cubed(). Values with a
+    missing temperature or pressure are None.'''
+    molar_mass = MOLAR_MASSES[pollutant]
+    return [None if (ppb is None or temp is None or pressure is None) else round(ppb * (pressure / GAS_CONSTANT) * molar_mass / temp, 3)
+        for (ppb, temp, pressure) in zip(ppbs, temps_in_kelvin, pressures_in_kilopascals)]
+
+def microgram_per_meter_cubed_to_ppb_column(pollutant, ug_per_m3s, temps_in_kelvin, pressures_in_kilopascals):
+    '''Converts a column of micrograms per cubic meter to parts per billion,
+    rounded exactly like microgram_per_meter_cubed_to_ppb(). Values with a
+    missing temperature or pressure are None.'''
+    molar_mass = MOLAR_MASSES[pollutant]
+    return [None if (ug_per_m3 is None or temp is None or pressure is None) else round((ug_per_m3 * temp) / ((pressure / GAS_CONSTANT) * molar_mass), 3)
+        for (ug_per_m3, temp, pressure) in zip(ug_per_m3s, temps_in_kelvin, pressures_in_kilopascals)]
+
 # Define unit group for AQI columns
 weewx.units.obs_group_dict['aqi_pm2_5'] = 'group_count'
 weewx.units.obs_group_dict['aqi_pm10_0']  = 'group_count'
@@ -86,7 +136,7 @@ if 'liter' not in weewx.units.conversionDict:
     weewx.units.conversionDict['liter'] = {}
 weewx.units.conversionDict['liter']['meter_cubed'] = lambda x: x / 1000.0
 weewx.units.conversionDict['meter_cubed'] = { 'liter': lambda x: x * 1000.0 }
-weewx.units.conversionDict['part_per_billion'] = { 'part_per_million': lambda x: x * 1000.0 }
-weewx.units.conversionDict['part_per_million'] = { 'part_per_billion': lambda x: x / 1000.0 }
+weewx.units.conversionDict['part_per_billion'] = { 'part_per_million': lambda x: x / 1000.0 }
+weewx.units.conversionDict['part_per_million'] = { 'part_per_billion': lambda x: x * 1000.0 }
 weewx.units.conversionDict['microgram_per_meter_cubed'] = { 'milligram_per_meter_cubed': lambda x: x / 1000.0 }
 weewx.units.conversionDict['milligram_per_meter_cubed'] = { 'microgram_per_meter_cubed': lambda x: x * 1000.0 }
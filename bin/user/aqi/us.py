@@ -2,7 +2,6 @@
 # Copyright 2018-2021 - Jonathan Koren <jonathan@jonathankoren.com>
 # License: GPL 3
 
-import operator
 import syslog
 
 from . import calculators
@@ -58,7 +57,7 @@ class AirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.CO] = calculators.BreakpointTable(
             data_cleaner=calculators.TRUNCATE_TO_1,
             mean_cleaner=calculators.TRUNCATE_TO_1,
-            unit='parts_per_million',
+            unit='part_per_million',
             duration_in_secs=8 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  0,  50,  0.0,  4.4) \
@@ -71,7 +70,7 @@ class AirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.NO2] = calculators.BreakpointTable(
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  0,  50,    0,   53) \
@@ -105,7 +104,7 @@ class AirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.SO2].add_calculator(calculators.BreakpointTable(
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  0,  50,   0,  35) \
@@ -115,7 +114,7 @@ class AirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.SO2].add_calculator(calculators.BreakpointTable(
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=24 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec,
             bp_index_offset=4) \
@@ -147,7 +146,7 @@ class AirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.O3].add_calculator(calculators.BreakpointTable(
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=8 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  0,  50,   0,  54) \
@@ -158,7 +157,7 @@ class AirQualityIndex(standards.AqiStandards):
         self.calculators[calculators.O3].add_calculator(calculators.BreakpointTable(
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec,
             bp_index_offset=2) \
@@ -170,35 +169,18 @@ class AirQualityIndex(standards.AqiStandards):
     def calculate_aqi(self, pollutant, observation_unit, observations):
         calculator = self.calculators[pollutant]
         try:
-            aqi_value = calculator.calculate(pollutant, observation_unit, observations)
-            return aqi_value
-        except IndexError as e:
+            return calculator.calculate(pollutant, observation_unit, observations)
+        except ValueError:
+            # The CalculatorCollection reports observations that are off the
+            # scale of both SO2 tables as a ValueError. Check if we fell in the
+            # hole between the tables.
             if pollutant == calculators.SO2:
-                # check if we fell in the hole between the tables.
-                calculator = self.calculators[pollutant]
-
-                observations = sorted(observations, key=operator.itemgetter(0), reverse=True)
-                for i in range(len(observations)):
-                    observations[i] = (observations[i][0], calculator.data_cleaner(observations[i][pollutant]))
-
-                last_valid_hour_index = calculator.breakpoint_tables[0].get_last_valid_index(observations, calculator.breakpoint_tables[0].duration_in_secs)
-                hour_ave = 0
-                for i in range(0, last_valid_hour_index + 1):
-                    hour_ave = hour_ave + observations[i][pollutant]
-                hour_ave = hour_ave / float(last_valid_hour_index + 1)
-
-                last_valid_day_index = calculator.breakpoint_tables[1].get_last_valid_index(observations, calculator.breakpoint_tables[1].duration_in_secs)
-                day_ave = 0
-                for i in range(0, last_valid_day_index + 1):
-                    day_ave = day_ave + observations[i][pollutant]
-                day_ave = day_ave / float(last_valid_day_index + 1)
-
-                if hour_ave >= 305 and day_ave < 305:
+                (hour_table, day_table) = calculator.calculators
+                hour_mean = hour_table.calculate_mean(pollutant, observation_unit, observations)
+                day_mean = day_table.calculate_mean(pollutant, observation_unit, observations)
+                if hour_mean >= 305 and day_mean < 305:
                     return (200, 3)
-                else:
-                    raise e
-            else:
-                raise e
+            raise
 
 def nowcast_pm_mean(observations, obs_frequency_in_sec, required_observation_ratio, min_hours):
     '''Calculates the NowCast weighted mean for a set of observations. Each
@@ -312,7 +294,7 @@ class NowCast(standards.AqiStandards):
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
             mean_calculator=lambda obs: nowcast_o3_mean(obs, obs_frequency_in_sec, 0.75, 1),
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=1 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec) \
             .add_breakpoint(  0,  50,   0,  54) \
@@ -324,7 +306,7 @@ class NowCast(standards.AqiStandards):
             data_cleaner=calculators.TRUNCATE_TO_0,
             mean_cleaner=calculators.TRUNCATE_TO_0,
             mean_calculator=lambda obs: nowcast_o3_mean(obs, obs_frequency_in_sec, 0.75, 1),
-            unit='parts_per_billion',
+            unit='part_per_billion',
             duration_in_secs=8 * calculators.HOUR,
             obs_frequency_in_sec=obs_frequency_in_sec,
             bp_index_offset=2) \
@@ -32,6 +32,11 @@ class AirQualityIndexInstaller(ExtensionInstaller):
                         'pm10_0': 'pm10_0_atm',
                     },
                 },
+                'StdReport': {
+                    'AqiFeeds': {
+                        'skin': 'AqiFeeds',
+                        'HTML_ROOT': 'public_html/aqi',
+                        'enable': 'false'}},
                 'DataBindings': {
                     'aqi_binding': {
                         'database': 'aqi_sqlite',
@@ -45,18 +50,33 @@ class AirQualityIndexInstaller(ExtensionInstaller):
             },
             files=[('bin/user',
                     [ 'bin/user/aqi/__init__.py',
+                    'bin/user/aqi/aggregates.py',
                     'bin/user/aqi/au.py',
+                    'bin/user/aqi/backfill.py',
                     'bin/user/aqi/ca.py',
                     'bin/user/aqi/calculators.py',
                     'bin/user/aqi/eu.py',
+                    'bin/user/aqi/feeds.py',
+                    'bin/user/aqi/fileutil.py',
                     'bin/user/aqi/india.py',
+                    'bin/user/aqi/instrumentation.py',
+                    'bin/user/aqi/logsummary.py',
+                    'bin/user/aqi/metrics.py',
                     'bin/user/aqi/mx.py',
+                    'bin/user/aqi/prefetch.py',
+                    'bin/user/aqi/retention.py',
+                    'bin/user/aqi/rollups.py',
                     'bin/user/aqi/service.py',
+                    'bin/user/aqi/sketches.py',
+                    'bin/user/aqi/snapshot.py',
                     'bin/user/aqi/standards.py',
                     'bin/user/aqi/uk.py',
                     'bin/user/aqi/units.py',
                     'bin/user/aqi/us.py' ]),
                 ('bin',
-                    [ 'bin/aqi_backfill' ])
+                    [ 'bin/aqi_backfill',
+                    'bin/aqi_retention' ]),
+                ('skins/AqiFeeds',
+                    [ 'skins/AqiFeeds/skin.conf' ])
             ]
         )
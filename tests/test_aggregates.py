@@ -0,0 +1,172 @@
+import unittest
+
+import weedb
+import weewx.manager
+import weewx.units
+
+from bin.user.aqi import aggregates
+from bin.user.aqi.aggregates import *
+from bin.user.aqi.calculators import *
+
+SENSOR_SCHEMA = [
+    ('dateTime', 'INTEGER NOT NULL PRIMARY KEY'),
+    ('usUnits', 'INTEGER NOT NULL'),
+    ('interval', 'INTEGER NOT NULL'),
+    ('pm2_5_atm', 'REAL'),
+    ('temperature', 'REAL'),
+    ('pressure', 'REAL'),
+]
+
+def open_memory_manager(schema):
+    return weewx.manager.Manager.open_with_create(
+        {'database_name': ':memory:', 'driver': 'weedb.sqlite'},
+        schema=schema)
+
+def make_table(sensor_dbm, aqi_dbm, bucket_secs):
+    return AggregateTable(aqi_dbm, 'aqi_hourly', bucket_secs,
+        sensor_dbm, {'dateTime': 'dateTime', 'usUnits': 'usUnits', PM2_5: 'pm2_5_atm'},
+        sensor_dbm, sensor_dbm.table_name,
+        {'dateTime': 'dateTime', 'weather_usUnits': 'usUnits', 'outTemp': 'temperature', 'pressure': 'pressure'})
+
+def add_readings(sensor_dbm, start, end, step, value):
+    records = []
+    for ts in range(start, end, step):
+        records.append({'dateTime': ts, 'usUnits': weewx.US, 'interval': 1,
+            'pm2_5_atm': value(ts), 'temperature': 50.0, 'pressure': 30.0})
+    sensor_dbm.addRecord(records, log_success=False)
+
+def format_like_mysql(dbm):
+    '''Makes dbm format each query the way the MySQL driver does, which turns
+    ? into %s and formats the statement with %, before running it.'''
+    gen_sql = dbm.genSql
+    def genSql(sql, sqlargs=()):
+        sql.replace('?', '%s') % tuple(sqlargs)
+        return gen_sql(sql, sqlargs)
+    dbm.genSql = genSql
+
+class TestAggregates(unittest.TestCase):
+    def test_bucket_end(self):
+        self.assertEqual(bucket_end(0, HOUR), 0)
+        self.assertEqual(bucket_end(1, HOUR), HOUR)
+        self.assertEqual(bucket_end(HOUR, HOUR), HOUR)
+        self.assertEqual(bucket_end(HOUR + 1, HOUR), 2 * HOUR)
+
+    def test_bucket_sql(self):
+        sql = 'SELECT %s FROM archive WHERE dateTime > ?' % (bucket_sql('dateTime', HOUR))
+        # the MySQL driver turns ? into %s, then formats the statement with %
+        self.assertEqual(sql.replace('?', '%s') % (0,), sql.replace('?', '0'))
+        dbm = open_memory_manager(SENSOR_SCHEMA)
+        for ts in [1, HOUR - 1, HOUR, HOUR + 1, (2 * HOUR) - 1, 2 * HOUR]:
+            row = dbm.getSql('SELECT %s' % (bucket_sql(str(ts), HOUR)))
+            self.assertEqual(row[0], bucket_end(ts, HOUR))
+
+    def test_rebuild(self):
+        sensor_dbm = open_memory_manager(SENSOR_SCHEMA)
+        aqi_dbm = open_memory_manager(SENSOR_SCHEMA)
+        # readings every minute, for two hours, starting just after the hour
+        add_readings(sensor_dbm, 60, (2 * HOUR) + 60, 60, lambda ts: ts / 60)
+        format_like_mysql(sensor_dbm)
+        table = make_table(sensor_dbm, aqi_dbm, HOUR)
+
+        self.assertEqual(table.rebuild(0, 2 * HOUR), 2)
+        buckets = list(table.gen_buckets(0, 2 * HOUR))
+        self.assertEqual([b['dateTime'] for b in buckets], [HOUR, 2 * HOUR])
+        self.assertEqual(buckets[0]['pm2_5_count'], 60)
+        self.assertEqual(buckets[0]['pm2_5_min'], 1)
+        self.assertEqual(buckets[0]['pm2_5_max'], 60)
+        self.assertEqual(buckets[0]['pm2_5_sum'], sum(range(1, 61)))
+        self.assertEqual(buckets[0]['outTemp_mean'], 50.0)
+        self.assertEqual(buckets[0]['pressure_mean'], 30.0)
+        self.assertEqual(buckets[0]['usUnits'], weewx.US)
+        self.assertIsNone(buckets[0]['co_count'])
+
+        means = table.get_means(PM2_5, 0, 2 * HOUR)
+        self.assertEqual(means[0], (2 * HOUR, sum(range(61, 121)) / 60.0, 60))
+        self.assertEqual(means[1], (HOUR, sum(range(1, 61)) / 60.0, 60))
+
+    def test_rebuild_is_atomic(self):
+        sensor_dbm = open_memory_manager(SENSOR_SCHEMA)
+        aqi_dbm = open_memory_manager(SENSOR_SCHEMA)
+        add_readings(sensor_dbm, 60, (2 * HOUR) + 60, 60, lambda ts: 1.0)
+        table = make_table(sensor_dbm, aqi_dbm, HOUR)
+        table.rebuild(0, 2 * HOUR)
+
+        # a failed rebuild leaves the buckets it would have replaced
+        def fail(*args):
+            raise weedb.DatabaseError('disk full')
+        table._gen_weather_buckets = fail
+        self.assertRaises(weedb.DatabaseError, table.rebuild, 0, 2 * HOUR)
+        self.assertEqual(len(list(table.gen_buckets(0, 2 * HOUR))), 2)
+
+    def test_pollutant_stats(self):
+        sensor_dbm = open_memory_manager(SENSOR_SCHEMA)
+        aqi_dbm = open_memory_manager(SENSOR_SCHEMA)
+        add_readings(sensor_dbm, 60, (2 * HOUR) + 60, 60, lambda ts: ts / 60)
+        table = make_table(sensor_dbm, aqi_dbm, HOUR)
+        table.rebuild(0, 2 * HOUR)
+        stats = list(gen_pollutant_stats(aqi_dbm, 'aqi_hourly', PM2_5, 0, 2 * HOUR))
+        self.assertEqual([s['dateTime'] for s in stats], [HOUR, 2 * HOUR])
+        self.assertEqual(stats[0], {'dateTime': HOUR, 'usUnits': weewx.US,
+            'mean': sum(range(1, 61)) / 60.0, 'count': 60, 'min': 1, 'max': 60})
+        self.assertEqual(list(gen_pollutant_stats(aqi_dbm, 'aqi_hourly', CO, 0, 2 * HOUR)), [])
+
+    def test_mixed_unit_systems(self):
+        # readings in different unit systems are converted before they are
+        # averaged together
+        schema = [
+            ('dateTime', 'INTEGER NOT NULL PRIMARY KEY'),
+            ('usUnits', 'INTEGER NOT NULL'),
+            ('interval', 'INTEGER NOT NULL'),
+            ('pm2_5_atm', 'REAL'),
+            ('outTemp', 'REAL'),
+            ('pressure', 'REAL'),
+        ]
+        sensor_dbm = open_memory_manager(schema)
+        aqi_dbm = open_memory_manager(SENSOR_SCHEMA)
+        records = []
+        for ts in range(60, HOUR + 60, 60):
+            if ts <= HOUR // 2:
+                records.append({'dateTime': ts, 'usUnits': weewx.US, 'interval': 1,
+                    'pm2_5_atm': 2.0, 'outTemp': 50.0, 'pressure': 1013.25 * weewx.units.INHG_PER_MBAR})
+            else:
+                records.append({'dateTime': ts, 'usUnits': weewx.METRIC, 'interval': 1,
+                    'pm2_5_atm': 4.0, 'outTemp': 10.0, 'pressure': 1013.25})
+        # addRecord() refuses records in a different unit system
+        with weedb.Transaction(sensor_dbm.connection) as cursor:
+            for record in records:
+                cols = list(record.keys())
+                cursor.execute('INSERT INTO archive (%s) VALUES (%s)' % (', '.join(cols), ', '.join(['?'] * len(cols))),
+                    tuple([record[c] for c in cols]))
+        format_like_mysql(sensor_dbm)
+        table = AggregateTable(aqi_dbm, 'aqi_hourly', HOUR,
+            sensor_dbm, {'dateTime': 'dateTime', 'usUnits': 'usUnits', PM2_5: 'pm2_5_atm'},
+            sensor_dbm, sensor_dbm.table_name,
+            {'dateTime': 'dateTime', 'weather_usUnits': 'usUnits', 'outTemp': 'outTemp', 'pressure': 'pressure'})
+        table.rebuild(0, HOUR)
+
+        bucket = list(table.gen_buckets(0, HOUR))[0]
+        self.assertEqual(bucket['usUnits'], weewx.METRIC)
+        self.assertEqual(bucket['weather_usUnits'], weewx.METRIC)
+        self.assertAlmostEqual(bucket['outTemp_mean'], 10.0)
+        self.assertAlmostEqual(bucket['pressure_mean'], 1013.25)
+        self.assertEqual(bucket['pm2_5_count'], 60)
+        self.assertEqual(bucket['pm2_5_sum'], 30 * 2.0 + 30 * 4.0)
+        self.assertEqual(bucket['pm2_5_min'], 2.0)
+        self.assertEqual(bucket['pm2_5_max'], 4.0)
+
+    def test_update(self):
+        sensor_dbm = open_memory_manager(SENSOR_SCHEMA)
+        aqi_dbm = open_memory_manager(SENSOR_SCHEMA)
+        table = make_table(sensor_dbm, aqi_dbm, HOUR)
+
+        add_readings(sensor_dbm, 60, (HOUR // 2) + 60, 60, lambda ts: 1.0)
+        table.update(HOUR // 2, DAY)
+        self.assertEqual(table.get_means(PM2_5, 0, HOUR), [(HOUR, 1.0, 30)])
+
+        # the partially filled bucket is recomputed on the next update
+        add_readings(sensor_dbm, (HOUR // 2) + 60, HOUR + 60, 60, lambda ts: 3.0)
+        table.update(HOUR, DAY)
+        self.assertEqual(table.get_means(PM2_5, 0, HOUR), [(HOUR, 2.0, 60)])
+
+        # updates in the past are ignored
+        self.assertEqual(table.update(HOUR // 2, DAY), 0)
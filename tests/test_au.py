@@ -0,0 +1,32 @@
+import unittest
+
+from bin.user.aqi.au import *
+
+def make_observations(n, obs_frequency_in_sec, **readings):
+    obs = []
+    for i in range(n):
+        o = {'dateTime': (i + 1) * obs_frequency_in_sec}
+        o.update(readings)
+        obs.append(o)
+    return obs
+
+class TestAirQualityIndex(unittest.TestCase):
+    def test_aqi(self):
+        obs_frequency_in_sec = 300
+        aqi = AirQualityIndex(obs_frequency_in_sec)
+        pollutants = aqi.get_pollutants()
+        for pollutant in [calculators.CO, calculators.NO2, calculators.O3, calculators.SO2]:
+            self.assertEqual(pollutants[pollutant], 'part_per_million')
+        obs = make_observations(288, obs_frequency_in_sec, co=4.5, no2=0.06, o3=0.05, pm10_0=40.0, pm2_5=12.5)
+        self.assertEqual(aqi.calculate_aqi(calculators.CO, pollutants[calculators.CO], obs), (50, 1))
+        self.assertEqual(aqi.calculate_aqi(calculators.NO2, pollutants[calculators.NO2], obs), (50, 1))
+        # the maximum of the 1 hour and 4 hour O3 scales
+        self.assertEqual(aqi.calculate_aqi(calculators.O3, pollutants[calculators.O3], obs), (62, 1))
+        self.assertEqual(aqi.calculate_aqi(calculators.PM10_0, pollutants[calculators.PM10_0], obs), (80, 1))
+        self.assertEqual(aqi.calculate_aqi(calculators.PM2_5, pollutants[calculators.PM2_5], obs), (50, 1))
+
+class TestInterimWebReportingParticulateIndex(unittest.TestCase):
+    def test_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            InterimWebReportingParticulateIndex(300)
+        self.assertIsNone(standards.get_standard_name(standards.AU_IWRPI_GUID))
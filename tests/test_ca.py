@@ -0,0 +1,32 @@
+import unittest
+
+from bin.user.aqi.ca import *
+
+def make_observations(n, obs_frequency_in_sec):
+    return [{
+        'dateTime': (i + 1) * obs_frequency_in_sec,
+        calculators.O3: 30.0,
+        calculators.NO2: 20.0,
+        calculators.PM2_5: 10.0,
+    } for i in range(n)]
+
+class TestAirQualityHealthIndex(unittest.TestCase):
+    def test_composite(self):
+        obs_frequency_in_sec = 300
+        aqhi = AirQualityHealthIndex(obs_frequency_in_sec)
+        pollutants = aqhi.get_pollutants()
+        self.assertEqual(pollutants[calculators.O3], 'part_per_billion')
+        self.assertEqual(pollutants[calculators.NO2], 'part_per_billion')
+        obs = make_observations(48, obs_frequency_in_sec)
+        self.assertEqual(aqhi.calculate_composite_aqi(pollutants, obs), (4, 3))
+        self.assertRaises(NotImplementedError, aqhi.calculate_aqi, calculators.O3, pollutants[calculators.O3], obs)
+
+    def test_composite_validation(self):
+        # 67% of the readings in the last 3 hours are required
+        obs_frequency_in_sec = 300
+        aqhi = AirQualityHealthIndex(obs_frequency_in_sec)
+        pollutants = aqhi.get_pollutants()
+        obs = make_observations(48, obs_frequency_in_sec)
+        self.assertEqual(aqhi.calculate_composite_aqi(pollutants, obs[:12] + obs[-25:]), (4, 3))
+        self.assertRaises(ValueError, aqhi.calculate_composite_aqi, pollutants, obs[:12] + obs[-24:])
+        self.assertRaises(ValueError, aqhi.calculate_composite_aqi, pollutants, [])
@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from bin.user.aqi.calculators import *
@@ -60,6 +61,25 @@ class TestCalculatorCollection(unittest.TestCase):
             actual_aqi = calculator.calculate(pollutant, obs_unit, obs)[0]
             self.assertEqual(actual_aqi, tc['expected'])
 
+            # the same, as Observations
+            actual_aqi = calculator.calculate(pollutant, obs_unit, [Observation(o) for o in obs])[0]
+            self.assertEqual(actual_aqi, tc['expected'])
+
+class TestObservationWindow(unittest.TestCase):
+    def test_newest_first(self):
+        rng = random.Random(3)
+        times = rng.sample(range(0, 20000), 400)
+        obs = [{'dateTime': t, PM2_5: None if rng.random() < 0.2 else rng.random() * 100} for t in times]
+        for duration in [60, 600, 3600, 86400]:
+            # the observations get_last_valid_index() keeps
+            pairs = sorted([(o['dateTime'], ROUND_TO_1(o[PM2_5])) for o in obs if o[PM2_5] is not None], reverse=True)
+            expected = pairs[:get_last_valid_index(pairs, duration) + 1]
+            self.assertEqual(ObservationWindow(obs).newest_first(PM2_5, ROUND_TO_1, duration), expected)
+            ascending = ObservationWindow([Observation(o) for o in sorted(obs, key=operator.itemgetter('dateTime'))], ascending=True)
+            self.assertEqual(ascending.newest_first(PM2_5, ROUND_TO_1, duration), expected)
+
+        self.assertRaises(ValueError, ObservationWindow([{'dateTime': 0, PM2_5: None}]).newest_first, PM2_5, IDENTITY, 60)
+
 class TestBreakpointTable(unittest.TestCase):
     def test__calculate_index_from_mean(self):
         bpt = BreakpointTable(
@@ -89,6 +109,40 @@ class TestBreakpointTable(unittest.TestCase):
 
         self.assertRaises(IndexError, bpt._calculate_index_from_mean, 501)
 
+        # breakpoints can be read by name, like the dicts they used to be
+        self.assertEqual(bpt.breakpoints[1]['low_obs'], 12.1)
+        self.assertEqual(bpt.breakpoints[1].high_aqi, 100)
+        self.assertEqual(bpt.breakpoints[1][0], 51)
+        self.assertRaises(KeyError, lambda: bpt.breakpoints[1]['nonexistent'])
+
+class TestObservation(unittest.TestCase):
+    def test_columns(self):
+        obs = Observation([('dateTime', 60), (PM2_5, 12.0)], outTemp=None)
+        self.assertEqual(obs['dateTime'], 60)
+        obs[PM2_5] = 13.0
+        self.assertEqual(obs, {'dateTime': 60, PM2_5: 13.0, 'outTemp': None})
+        self.assertTrue(PM2_5 in obs)
+        self.assertFalse(PM10_0 in obs)
+        self.assertFalse('items' in obs)
+        self.assertEqual(obs.get(PM10_0, 1.0), 1.0)
+        self.assertEqual(sorted(obs.keys()), sorted(['dateTime', PM2_5, 'outTemp']))
+
+        copy = obs.copy()
+        copy[PM10_0] = 20.0
+        self.assertFalse(PM10_0 in obs)
+        self.assertNotEqual(obs, copy)
+
+        # only the canonical columns can be set
+        self.assertRaises(AttributeError, Observation, {'nonexistent': 1})
+
+        # missing and unknown columns are reported like a dict's
+        self.assertRaises(KeyError, lambda: obs[PM10_0])
+        self.assertRaises(KeyError, lambda: obs['__class__'])
+        self.assertRaises(KeyError, lambda: obs['items'])
+        with self.assertRaises(KeyError):
+            obs['__class__'] = dict
+        self.assertIs(type(obs), Observation)
+
 class TestLinearScale(unittest.TestCase):
     def test__calculate_index_from_mean(self):
         ls = LinearScale(unit='firkins', obs_frequency_in_sec=300, duration_in_secs=3000,
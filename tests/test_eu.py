@@ -60,3 +60,12 @@ class TestEU(unittest.TestCase):
         obs = gen_obs()[:int(one_day_in_secs / obs_freq / 2)]
         min_hours = 18
         self.assertRaises(ValueError, eu_24hr_mean, obs, obs_freq, obs_ratio, min_hours)
+
+class TestCommonAirQualityHourlyIndex(unittest.TestCase):
+    def test_index(self):
+        obs_frequency_in_sec = 300
+        index = CommonAirQualityHourlyIndex(obs_frequency_in_sec)
+        pollutants = index.get_pollutants()
+        obs = [{'dateTime': (i + 1) * obs_frequency_in_sec, 'pm10_0': 40.0, 'pm2_5': 12.5} for i in range(288)]
+        self.assertEqual(index.calculate_aqi(calculators.PM10_0, pollutants[calculators.PM10_0], obs), (40, 1))
+        self.assertEqual(index.calculate_aqi(calculators.PM2_5, pollutants[calculators.PM2_5], obs), (20, 0))
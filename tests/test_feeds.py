@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import weewx.manager
+
+from bin.user.aqi.feeds import *
+from bin.user.aqi.service import schema
+from tests.test_aggregates import format_like_mysql
+
+def add_records(dbm, start, end):
+    dbm.addRecord([{'dateTime': ts, 'usUnits': weewx.US, 'interval': 5, 'aqi_standard': 6,
+        'aqi_pm2_5': float(ts % 7)} for ts in range(start, end + 1, 300)], log_success=False)
+
+class TestFeed(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbm = weewx.manager.Manager.open_with_create(
+            {'database_name': ':memory:', 'driver': 'weedb.sqlite'}, schema=schema)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_json(self):
+        path = os.path.join(self.tmpdir, 'aqi_pm2_5_day.json')
+        feed = Feed(path, 'json', 'pm2_5', 3600, slack=0.5, refresh=0)
+        add_records(self.dbm, 300, 3600)
+        self.assertEqual(feed.update(self.dbm, 6, 3600), 12)
+        self.assertEqual(read_bounds(path, 'json'), (300, 3600))
+
+        # only the new record is appended
+        add_records(self.dbm, 3900, 3900)
+        self.assertEqual(feed.update(self.dbm, 6, 3900), 1)
+        with open(path) as f:
+            points = json.load(f)
+        self.assertEqual(points[0], [300, 300 % 7])
+        self.assertEqual(points[-1], [3900, 3900 % 7])
+        self.assertEqual(len(points), 13)
+
+        # until the feed is compacted
+        add_records(self.dbm, 4200, 6000)
+        self.assertEqual(feed.update(self.dbm, 6, 6000), 12)
+        self.assertEqual(read_bounds(path, 'json'), (2700, 6000))
+
+    def test_csv_aggregate(self):
+        path = os.path.join(self.tmpdir, 'aqi_pm2_5_year.csv')
+        feed = Feed(path, 'csv', 'pm2_5', 86400, aggregate_interval=3600, aggregate_type='max', refresh=0)
+        format_like_mysql(self.dbm)
+        add_records(self.dbm, 300, 3 * 3600 - 300)
+        # the last hour is incomplete
+        self.assertEqual(feed.update(self.dbm, 6, 3 * 3600 - 300), 2)
+        add_records(self.dbm, 3 * 3600, 3 * 3600)
+        self.assertEqual(feed.update(self.dbm, 6, 3 * 3600), 1)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, ['dateTime,aqi_pm2_5', '3600,6.0', '7200,6.0', '10800,6.0'])
+
+    def test_refresh(self):
+        # an AQI deferred by the service's time budget is stored after its
+        # record's point was written
+        for fmt in FORMATS:
+            path = os.path.join(self.tmpdir, 'aqi_pm2_5_day.' + fmt)
+            feed = Feed(path, fmt, 'pm2_5', 86400, refresh=900)
+            add_records(self.dbm, 300, 3600)
+            self.dbm.getSql('UPDATE archive SET aqi_pm2_5 = NULL WHERE dateTime = 3600')
+            feed.update(self.dbm, 6, 3600)
+            self.dbm.getSql('UPDATE archive SET aqi_pm2_5 = 99.0 WHERE dateTime = 3600')
+            add_records(self.dbm, 3900, 3900)
+            # the points of the last 900 seconds are rewritten, along with the new one
+            self.assertEqual(feed.update(self.dbm, 6, 3900), 4)
+            with open(path) as f:
+                contents = f.read()
+            os.remove(path)
+            feed.rebuild(self.dbm, 6, 3900)
+            with open(path) as f:
+                self.assertEqual(contents, f.read())
+            self.assertEqual(read_bounds(path, fmt), (300, 3900))
+            self.dbm.getSql('DELETE FROM archive')
+
+    def test_refresh_aggregate(self):
+        path = os.path.join(self.tmpdir, 'aqi_pm2_5_year.json')
+        feed = Feed(path, 'json', 'pm2_5', 86400, aggregate_interval=3600, aggregate_type='max', refresh=1800)
+        add_records(self.dbm, 300, 3 * 3600)
+        self.assertEqual(feed.update(self.dbm, 6, 3 * 3600), 3)
+        self.dbm.getSql('UPDATE archive SET aqi_pm2_5 = 99.0 WHERE dateTime = 9000')
+        add_records(self.dbm, 3 * 3600 + 300, 4 * 3600)
+        # the refreshed points start at a whole interval
+        self.assertEqual(feed.update(self.dbm, 6, 4 * 3600), 2)
+        with open(path) as f:
+            self.assertEqual(json.load(f), [[3600, 6.0], [7200, 6.0], [10800, 99.0], [14400, 6.0]])
@@ -0,0 +1,20 @@
+import unittest
+
+from bin.user.aqi.india import *
+
+class TestNationalAirQualityIndex(unittest.TestCase):
+    def test_maximum(self):
+        # O3 and CO are indexed by the maximum reading in 8 hours, not the
+        # mean, nor the newest reading
+        obs_frequency_in_sec = 300
+        aqi = NationalAirQualityIndex(obs_frequency_in_sec)
+        pollutants = aqi.get_pollutants()
+        obs = []
+        for i in range(96):
+            obs.append({
+                'dateTime': (i + 1) * obs_frequency_in_sec,
+                calculators.O3: 150.0 if 40 <= i < 52 else 40.0,
+                calculators.CO: 3.0 if i == 50 else 1.0,
+            })
+        self.assertEqual(aqi.calculate_aqi(calculators.O3, pollutants[calculators.O3], obs), (173, 2))
+        self.assertEqual(aqi.calculate_aqi(calculators.CO, pollutants[calculators.CO], obs), (112, 2))
@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from bin.user.aqi.instrumentation import *
+from bin.user.aqi import standards
+
+class TestHistogram(unittest.TestCase):
+    def test_quantile(self):
+        h = Histogram()
+        self.assertEqual(h.quantile(0.5), 0.0)
+        for secs in [0.0002, 0.0002, 0.0002, 0.003, 100.0]:
+            h.add(secs)
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.max, 100.0)
+        self.assertEqual(h.quantile(0.5), 0.00025)
+        self.assertEqual(h.quantile(0.8), 0.005)
+        # the overflow bucket reports the maximum
+        self.assertEqual(h.quantile(1.0), 100.0)
+
+class TestStageTimer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stages(self):
+        stats_file = os.path.join(self.tmpdir, 'stats.json')
+        timer = StageTimer(emit_interval=3600, stats_file=stats_file)
+        for _ in range(3):
+            with timer.event():
+                with timer.stage('outer'):
+                    with timer.stage('inner'):
+                        pass
+                    rows = list(timer.timed_iter('query', iter([1, 2, 3])))
+                    self.assertEqual(rows, [1, 2, 3])
+        timer.emit()
+
+        with open(stats_file) as f:
+            stats = json.load(f)['stages']
+        self.assertEqual(sorted(stats.keys()), ['event', 'inner', 'other', 'outer', 'query'])
+        for name in stats:
+            self.assertEqual(stats[name]['count'], 3)
+
+        # exclusive stage times add up to the event total
+        total = 0.0
+        for name in ['inner', 'other', 'outer', 'query']:
+            total += stats[name]['sum']
+        self.assertAlmostEqual(total, stats['event']['sum'])
+
+        # the window was reset
+        self.assertEqual(timer.histograms, {})
+
+    def test_timed_iter(self):
+        def slow_rows(n, secs):
+            for i in range(n):
+                time.sleep(secs)
+                yield i
+
+        timer = StageTimer()
+        with timer.event():
+            with timer.stage('join'):
+                # two cursors consumed in turn, like the join of the sensor
+                # and weather readings
+                sensor = timer.timed_iter('sensor_query', slow_rows(3, 0.01))
+                weather = timer.timed_iter('weather_query', slow_rows(3, 0.01))
+                for (s, w) in zip(sensor, weather):
+                    time.sleep(0.02)
+                self.assertEqual(list(sensor), [])
+                self.assertEqual(list(weather), [])
+        # only the time spent producing rows is recorded, once per event
+        for name in ['sensor_query', 'weather_query']:
+            self.assertEqual(timer.histograms[name].count, 1)
+            self.assertGreaterEqual(timer.histograms[name].total, 0.03)
+            self.assertLess(timer.histograms[name].total, 0.06)
+        self.assertGreaterEqual(timer.histograms['join'].total, 0.06)
+        total = sum([timer.histograms[name].total for name in ['join', 'other', 'sensor_query', 'weather_query']])
+        self.assertAlmostEqual(total, timer.histograms['event'].total)
+
+    def test_timed_standard(self):
+        standard = standards.get_standard('us_aqi', 300)
+        calculate = standard.calculators['o3'].calculate
+        observations = [{'dateTime': 1600000000 - i * 300, 'o3': 50.0} for i in range(96)]
+        timers = [StageTimer(), StageTimer()]
+        timed = [timer.timed_standard(standard) for timer in timers]
+        # the shared standard is not modified
+        self.assertEqual(standard.calculators['o3'].calculate, calculate)
+        self.assertEqual(type(timed[0]), type(standard))
+
+        with timers[1].event():
+            aqi = timed[1].calculate_aqi('o3', standard.get_pollutants()['o3'], observations)
+        self.assertEqual(aqi, standard.calculate_aqi('o3', standard.get_pollutants()['o3'], observations))
+        # only the timer whose copy was used recorded the calculators
+        self.assertEqual(timers[0].histograms, {})
+        self.assertEqual(sorted([name for name in timers[1].histograms if name.startswith('calculator.')]),
+            ['calculator.o3.BreakpointTable.1h', 'calculator.o3.BreakpointTable.8h',
+             'calculator.o3.CalculatorCollection.8h'])
+
+@unittest.skipUnless(memory_profiling_available(), 'requires tracemalloc.reset_peak')
+class TestMemoryProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracemalloc.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_peaks(self):
+        report_file = os.path.join(self.tmpdir, 'memory.json')
+        profiler = MemoryProfiler(emit_interval=3600, report_file=report_file, top_allocations=5)
+        with profiler.event():
+            with profiler.stage('outer'):
+                with profiler.stage('inner'):
+                    garbage = [object() for _ in range(10000)]
+                    del garbage
+                kept = [object() for _ in range(1000)]
+        profiler.emit()
+
+        with open(report_file) as f:
+            report = json.load(f)
+        peaks = report['peaks']
+        self.assertEqual(sorted(peaks.keys()), ['event', 'inner', 'outer'])
+        # peaks include the nested stages
+        self.assertGreater(peaks['inner'], 10000 * 16)
+        self.assertGreaterEqual(peaks['outer'], peaks['inner'])
+        self.assertGreaterEqual(peaks['event'], peaks['outer'])
+        self.assertTrue(0 < len(report['top_allocations']) <= 5)
+        self.assertEqual(profiler.peaks, {})
+
+    def test_sampled_per_stage(self):
+        samples = []
+        get_traced_memory = tracemalloc.get_traced_memory
+        def counting_get_traced_memory():
+            samples.append(1)
+            return get_traced_memory()
+
+        profiler = MemoryProfiler(emit_interval=3600)
+        tracemalloc.get_traced_memory = counting_get_traced_memory
+        try:
+            with profiler.event():
+                with profiler.stage('join'):
+                    rows = list(profiler.timed_iter('sensor_query', iter(range(1000))))
+        finally:
+            tracemalloc.get_traced_memory = get_traced_memory
+        self.assertEqual(len(rows), 1000)
+        # the start and end of the event and the join stage
+        self.assertEqual(len(samples), 4)
+        self.assertEqual(profiler.histograms['sensor_query'].count, 1)
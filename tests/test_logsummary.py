@@ -0,0 +1,29 @@
+import unittest
+
+from bin.user.aqi.logsummary import *
+
+class TestWarningSummary(unittest.TestCase):
+    def test_flush(self):
+        summary = WarningSummary(interval=60)
+        self.assertIsNone(summary.flush('prefix: ', now=0))
+
+        for i in range(1000):
+            summary.warn('conversion failed', 'so2', 'row %d', i)
+        summary.warn('pressure missing', None, 'row %d', 7)
+        self.assertEqual(summary.flush('prefix: ', now=0),
+            'prefix: conversion failed so2 x1000 (e.g. row 0); pressure missing x1 (e.g. row 7)')
+        self.assertEqual(summary.counts, {})
+
+        # identical summaries are suppressed until the interval has passed
+        summary.warn('pressure missing', None, 'row %d', 8)
+        summary.warn('conversion failed', 'so2', 'row %d', 9)
+        self.assertIsNone(summary.flush('prefix: ', now=30))
+
+        # but different ones are not
+        summary.warn('pressure missing', None, 'row %d', 10)
+        self.assertEqual(summary.flush('prefix: ', now=31), 'prefix: pressure missing x1 (e.g. row 10)')
+
+        summary.warn('pressure missing', None, 'row %d', 11)
+        summary.warn('conversion failed', 'so2', 'row %d', 12)
+        self.assertEqual(summary.flush('prefix: ', now=60),
+            'prefix: conversion failed so2 x1 (e.g. row 12); pressure missing x1 (e.g. row 11) (1 similar summaries suppressed)')
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bin.user.aqi.metrics import *
+
+class TestMetrics(unittest.TestCase):
+    def test_to_prometheus(self):
+        m = Metrics(prefix='test')
+        m.counter('events_total', 'Events.')
+        m.counter('failures_total', 'Failures.')
+        m.gauge('lag_seconds', 'Lag.')
+        m.inc('events_total')
+        m.inc('events_total', 2)
+        m.inc('failures_total', pollutant='pm2_5', exception='ValueError')
+        m.inc('failures_total', pollutant='say "hi"\n', exception='ValueError')
+        m.set('lag_seconds', 1.5)
+        m.set('lag_seconds', 2.5)
+
+        self.assertEqual(m.get('events_total'), 3)
+        self.assertEqual(m.get('failures_total', exception='ValueError', pollutant='pm2_5'), 1)
+        self.assertEqual(m.get('failures_total', pollutant='o3'), 0)
+        self.assertEqual(m.to_prometheus(), '\n'.join([
+            '# HELP test_events_total Events.',
+            '# TYPE test_events_total counter',
+            'test_events_total 3',
+            '# HELP test_failures_total Failures.',
+            '# TYPE test_failures_total counter',
+            'test_failures_total{exception="ValueError",pollutant="pm2_5"} 1',
+            'test_failures_total{exception="ValueError",pollutant="say \\"hi\\"\\n"} 1',
+            '# HELP test_lag_seconds Lag.',
+            '# TYPE test_lag_seconds gauge',
+            'test_lag_seconds 2.5',
+        ]) + '\n')
+
+    def test_write(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'aqi.prom')
+            m = service_metrics()
+            m.inc('events_total')
+            m.write(path)
+            with open(path) as f:
+                contents = f.read()
+            self.assertIn('weewx_aqi_events_total 1\n', contents)
+            # unused counters are exported as zero
+            self.assertIn('weewx_aqi_records_written_total 0\n', contents)
+            self.assertEqual(os.listdir(tmpdir), ['aqi.prom'])
+        finally:
+            shutil.rmtree(tmpdir)
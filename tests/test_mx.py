@@ -0,0 +1,23 @@
+import unittest
+
+from bin.user.aqi.mx import *
+from bin.user.aqi import units
+
+class TestIndiceMetropolitanoCalidadAire(unittest.TestCase):
+    def test_gases_in_ppm(self):
+        obs_frequency_in_sec = 300
+        aqi = IndiceMetropolitanoCalidadAire(obs_frequency_in_sec)
+        pollutants = aqi.get_pollutants()
+        for pollutant in [calculators.O3, calculators.NO2, calculators.SO2, calculators.CO]:
+            self.assertEqual(pollutants[pollutant], 'part_per_million')
+
+        # 80 ppb of O3 is 0.08 ppm, not 157 ug/m3, which is off the scale
+        o3 = units.convert_pollutant_units(calculators.O3, 80, 'part_per_billion', pollutants[calculators.O3], None, None)
+        self.assertEqual(o3, 0.08)
+        obs = [{'dateTime': (i + 1) * obs_frequency_in_sec, calculators.O3: o3} for i in range(12)]
+        (index, category) = aqi.calculate_aqi(calculators.O3, pollutants[calculators.O3], obs)
+        self.assertAlmostEqual(index, 72.727, 3)
+        self.assertEqual(category, 1)
+
+        obs = [{'dateTime': (i + 1) * obs_frequency_in_sec, calculators.CO: 6.6} for i in range(96)]
+        self.assertEqual(aqi.calculate_aqi(calculators.CO, pollutants[calculators.CO], obs), (60.0, 1))
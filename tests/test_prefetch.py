@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import threading
+
+import weedb
+import weewx.manager
+from six.moves import queue
+
+from bin.user.aqi import prefetch
+from bin.user.aqi.prefetch import *
+
+SCHEMA = [
+    ('dateTime', 'INTEGER NOT NULL PRIMARY KEY'),
+    ('usUnits', 'INTEGER NOT NULL'),
+    ('interval', 'INTEGER NOT NULL'),
+    ('pm2_5', 'REAL'),
+]
+
+class TestQueryPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_dict = {
+            'DataBindings': {
+                'sensor_binding': {'database': 'sensor', 'table_name': 'archive',
+                    'manager': 'weewx.manager.Manager', 'schema': 'tests.test_prefetch.SCHEMA'},
+            },
+            'Databases': {
+                'sensor': {'database_name': os.path.join(self.directory, 'sensor.sdb'), 'driver': 'weedb.sqlite'},
+            },
+        }
+        dbm = weewx.manager.open_manager_with_config(self.config_dict, 'sensor_binding', initialize=True)
+        dbm.addRecord([{'dateTime': 60 * i, 'usUnits': weewx.US, 'interval': 1, 'pm2_5': float(i)}
+            for i in range(1, 1001)], log_success=False)
+        dbm.close()
+        self.pool = QueryPool(self.config_dict, 2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_queries(self):
+        sql = 'SELECT dateTime, pm2_5 FROM archive WHERE dateTime >= ? AND dateTime <= ? ORDER BY dateTime ASC'
+        first = self.pool.submit('sensor_binding', sql, (60, 600))
+        second = self.pool.submit('sensor_binding', sql, (60, 60000))
+        self.assertEqual(len(list(second)), 1000)
+        self.assertEqual(list(first), [(60 * i, float(i)) for i in range(1, 11)])
+
+        # an abandoned query does not hold up the next one
+        next(self.pool.submit('sensor_binding', sql, (60, 60000)))
+        self.assertEqual(len(list(self.pool.submit('sensor_binding', sql, (60, 600)))), 10)
+
+    def test_abandoned_query(self):
+        sql = 'SELECT dateTime, pm2_5 FROM archive WHERE dateTime >= ? AND dateTime <= ? ORDER BY dateTime ASC'
+        tasks = queue.Queue()
+        worker = prefetch._Worker(self.config_dict, tasks)
+        worker.start()
+        results = queue.Queue(1)
+        cancelled = threading.Event()
+        tasks.put(('sensor_binding', sql, (60, 60000), results, cancelled))
+        # the worker only reads ahead of the reader as far as the queue allows
+        rows = prefetch._gen_results(results, cancelled)
+        self.assertEqual(next(rows), (60, 1.0))
+        time.sleep(0.2)
+        self.assertEqual(results.qsize(), 1)
+        # once the rows are abandoned, it stops reading them
+        rows.close()
+        self.assertTrue(cancelled.is_set())
+        tasks.put(None)
+        worker.join(10)
+        self.assertFalse(worker.is_alive())
+
+    def test_errors(self):
+        with self.assertRaises(weedb.DatabaseError):
+            list(self.pool.submit('sensor_binding', 'SELECT nonexistent FROM archive', ()))
+
+class TestWindowCache(unittest.TestCase):
+    SQL = 'SELECT pm2_5, dateTime FROM archive WHERE dateTime >= ? AND dateTime <= ? ORDER BY dateTime ASC'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_dict = {
+            'DataBindings': {
+                'sensor_binding': {'database': 'sensor', 'table_name': 'archive',
+                    'manager': 'weewx.manager.Manager', 'schema': 'tests.test_prefetch.SCHEMA'},
+            },
+            'Databases': {
+                'sensor': {'database_name': os.path.join(self.directory, 'sensor.sdb'), 'driver': 'weedb.sqlite'},
+            },
+        }
+        self.dbm = weewx.manager.open_manager_with_config(self.config_dict, 'sensor_binding', initialize=True)
+        self.add(range(1, 101))
+        self.cache = WindowCache(self.SQL, 300, 1)
+
+    def tearDown(self):
+        self.dbm.close()
+        shutil.rmtree(self.directory)
+
+    def add(self, minutes):
+        self.dbm.addRecord([{'dateTime': 60 * i, 'usUnits': weewx.US, 'interval': 1, 'pm2_5': float(i)}
+            for i in minutes], log_success=False)
+
+    def assertWindow(self, start_time, end_time):
+        self.assertEqual(self.cache.get(self.dbm, start_time, end_time),
+            list(self.dbm.genSql(self.SQL, (start_time, end_time))))
+
+    def test_windows(self):
+        self.assertWindow(600, 3000)
+        self.add(range(101, 121))
+        self.assertWindow(900, 3300)
+        self.assertWindow(900, 7200)
+        # an earlier window reads everything again
+        self.assertWindow(60, 600)
+        self.assertWindow(6000, 6000)
+
+    def test_prefetch(self):
+        self.assertEqual(self.cache.prefetch(self.dbm, 7200), 0)
+        self.assertWindow(600, 3000)
+        self.add(range(101, 111))
+        self.assertEqual(self.cache.prefetch(self.dbm, 7200), 60)
+        self.assertEqual(len(self.cache.rows), 101)
+        # rows written out of order, within the overlap, are still read
+        self.add([108.5, 111])
+        self.assertWindow(900, 6660)
+
+    def test_idle_prefetcher(self):
+        prefetcher = IdlePrefetcher(self.config_dict, [('sensor_binding', self.cache)])
+        prefetcher.start()
+        try:
+            self.assertWindow(600, 3000)
+            self.assertEqual(len(self.cache.rows), 41)
+            self.add(range(101, 111))
+            # nothing is read before the prefetch is due
+            prefetcher.schedule(time.time() + 3600)
+            time.sleep(0.1)
+            self.assertEqual(len(self.cache.rows), 41)
+            # rescheduling replaces the due time
+            prefetcher.schedule(time.time())
+            deadline = time.time() + 10
+            while len(self.cache.rows) < 101 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(self.cache.rows), 101)
+        finally:
+            prefetcher.close()
+        self.assertFalse(prefetcher.is_alive())
+        self.assertIsNone(prefetcher.due)
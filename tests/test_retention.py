@@ -0,0 +1,70 @@
+import unittest
+
+import weeutil.weeutil
+import weewx.manager
+
+from bin.user.aqi.retention import *
+from bin.user.aqi.service import schema
+
+def open_memory_manager():
+    return weewx.manager.DaySummaryManager.open_with_create(
+        {'database_name': ':memory:', 'driver': 'weedb.sqlite'},
+        schema=schema)
+
+def make_records(start, n):
+    '''Five minute AQI records, with AQIs counting up from 40, and categories
+    cycling through 0, 1 and 2.'''
+    return [{'dateTime': start + (i + 1) * 300, 'usUnits': weewx.US, 'interval': 5,
+        'aqi_standard': 6, 'aqi_pm2_5': 40.0 + i, 'aqi_pm2_5_category': i % 3} for i in range(n)]
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.day = weeutil.weeutil.startOfDay(1600000000)
+        self.dbm = open_memory_manager()
+        self.dbm.addRecord(make_records(self.day, 288 * 3), log_success=False)
+
+    def rows(self):
+        return list(self.dbm.genSql('SELECT dateTime, `interval`, aqi_pm2_5, aqi_pm2_5_category FROM archive ORDER BY dateTime'))
+
+    def test_hourly(self):
+        # keep the last day at full resolution, with a budget of two hours a run
+        policy = RetentionPolicy(self.dbm, 1, max_rows=24)
+        now = self.day + 3 * 86400
+        self.assertEqual(policy.run(now), 24)
+        rows = self.rows()
+        self.assertEqual(rows[:2], [
+            (self.day + 3600, 60, 51.0, 2),
+            (self.day + 7200, 60, 63.0, 2),
+        ])
+        self.assertEqual(rows[2], (self.day + 7500, 5, 64.0, 0))
+
+        while policy.run(now) > 0:
+            pass
+        rows = self.rows()
+        self.assertEqual(len(rows), 48 + 288)
+        self.assertEqual(rows[47], (self.day + 2 * 86400, 60, 40.0 + 575, 2))
+        self.assertEqual(rows[48][1], 5)
+
+        # the daily summaries are left alone
+        self.assertEqual(self.dbm.getSql('SELECT count FROM archive_day_aqi_pm2_5 WHERE dateTime = ?', (self.day,))[0], 288)
+
+        # a late record is compacted into the hour already compacted
+        self.dbm.addRecord({'dateTime': self.day + 600, 'usUnits': weewx.US, 'interval': 5,
+            'aqi_standard': 6, 'aqi_pm2_5': 100.0, 'aqi_pm2_5_category': 1}, log_success=False)
+        self.assertEqual(policy.run(now), 1)
+        self.assertEqual(self.rows()[0], (self.day + 3600, 60, 100.0, 2))
+
+    def test_daily_mean(self):
+        policy = RetentionPolicy(self.dbm, 1, 2, max_rows=100, aggregate_type='mean')
+        while policy.run(self.day + 3 * 86400 + 1) > 0:
+            pass
+        rows = self.rows()
+        # the first day, less the record at midnight, then 24 hours of the
+        # second, then the third day
+        self.assertEqual(rows[0], (self.day + 86400, 1440, 40.0 + 143.5, 2))
+        self.assertEqual(rows[1][:2], (self.day + 86400 + 3600, 60))
+        self.assertEqual(len(rows), 1 + 24 + 288)
+
+    def test_unknown_aggregate(self):
+        with self.assertRaises(ValueError):
+            RetentionPolicy(self.dbm, 1, aggregate_type='median')
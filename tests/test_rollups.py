@@ -0,0 +1,83 @@
+import unittest
+
+import weeutil.weeutil
+import weewx.manager
+
+from bin.user.aqi.rollups import *
+from bin.user.aqi.service import schema
+
+def open_memory_manager():
+    return weewx.manager.Manager.open_with_create(
+        {'database_name': ':memory:', 'driver': 'weedb.sqlite'},
+        schema=schema)
+
+def make_records(start, n):
+    '''Five minute AQI records, alternating between categories 0 and 1.'''
+    records = []
+    for i in range(n):
+        records.append({'dateTime': start + (i + 1) * 300, 'usUnits': weewx.US, 'interval': 5,
+            'aqi_standard': 6, 'aqi_pm2_5': 40.0 + i, 'aqi_pm2_5_category': i % 2,
+            'aqi_composite': None, 'aqi_composite_category': None})
+    return records
+
+class TestCategoryRollup(unittest.TestCase):
+    def setUp(self):
+        self.day = weeutil.weeutil.startOfDay(1600000000)
+        self.aqi_dbm = open_memory_manager()
+
+    def test_add_records(self):
+        rollup = CategoryRollup(self.aqi_dbm, 'aqi_category_rollup')
+        records = make_records(self.day, 12)
+        self.assertEqual(rollup.add_records(records[:6]), 6)
+        self.assertEqual(rollup.add_records(records[4:]), 6)
+        self.assertEqual(rollup.get_durations(6, 'pm2_5', self.day, self.day + 86400), [
+            (0, 6 * 300, 6, 50.0),
+            (1, 6 * 300, 6, 51.0),
+        ])
+        self.assertEqual(rollup.get_durations(6, COMPOSITE, self.day, self.day + 86400), [])
+        self.assertEqual(rollup.get_durations(6, 'pm2_5', self.day + 86400, self.day + 2 * 86400), [])
+
+    def test_rebuild(self):
+        # the record at midnight belongs to the day before
+        records = make_records(self.day, 288 + 2)
+        self.aqi_dbm.addRecord(records, log_success=False)
+        rollup = CategoryRollup(self.aqi_dbm, 'aqi_category_rollup')
+        self.assertEqual(rollup.last_update, records[-1]['dateTime'])
+        self.assertEqual(rollup.get_durations(6, 'pm2_5', self.day, self.day + 86400), [
+            (0, 144 * 300, 144, 326.0),
+            (1, 144 * 300, 144, 327.0),
+        ])
+        self.assertEqual(rollup.get_durations(6, 'pm2_5', self.day + 86400, self.day + 2 * 86400), [
+            (0, 300, 1, 328.0),
+            (1, 300, 1, 329.0),
+        ])
+
+        # rebuilding replaces the days, rather than adding to them
+        self.assertEqual(rollup.rebuild(records[0]['dateTime'], records[-1]['dateTime']), 290)
+        self.assertEqual(rollup.get_durations(6, 'pm2_5', self.day, self.day + 2 * 86400)[0], (0, 145 * 300, 145, 328.0))
+
+        # and the table is reopened where it left off
+        rollup = CategoryRollup(self.aqi_dbm, 'aqi_category_rollup')
+        self.assertEqual(rollup.last_update, records[-1]['dateTime'])
+        self.assertEqual(rollup.add_records(records), 0)
+
+class TestQuantileRollup(unittest.TestCase):
+    def test_percentiles(self):
+        day = weeutil.weeutil.startOfDay(1600000000)
+        aqi_dbm = open_memory_manager()
+        records = make_records(day, 288 * 2)
+        aqi_dbm.addRecord(records[:288], log_success=False)
+        rollup = QuantileRollup(aqi_dbm, 'aqi_quantile_sketch')
+        self.assertEqual(rollup.add_records(records[288:]), 288)
+
+        # AQIs 40 through 615, spread over the two days
+        sketch = rollup.get_sketch(6, 'pm2_5', day, day + 3 * 86400)
+        self.assertEqual(sketch.count, 576)
+        self.assertAlmostEqual(sketch.quantile(0.5), 327.5, delta=4)
+        self.assertEqual(sketch.quantile(1.0), 615.0)
+        self.assertEqual(rollup.get_sketch(6, 'pm2_5', day + 86400, day + 2 * 86400).count, 288)
+        self.assertEqual(rollup.get_sketch(6, COMPOSITE, day, day + 3 * 86400).count, 0)
+
+        aqi_dbm.addRecord(records[288:], log_success=False)
+        rollup.rebuild(records[0]['dateTime'], records[-1]['dateTime'])
+        self.assertEqual(rollup.get_sketch(6, 'pm2_5', day, day + 3 * 86400).to_json(), sketch.to_json())
@@ -0,0 +1,235 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import weeutil.weeutil
+import weewx.manager
+
+from bin.user.aqi.service import *
+from bin.user.aqi.service import _apply_weather, _bucket_observation, _join_path, _join_window, _nearest_path
+
+class TestCatchupJoin(unittest.TestCase):
+    def join(self, pollutant_times, weather_times, epsilon):
+        return AqiService._join_sensor_results(None,
+            iter([(t, i) for (i, t) in enumerate(pollutant_times)]), ['dateTime', 'pm2_5'],
+            iter([(t, i) for (i, t) in enumerate(weather_times)]), ['dateTime', 'outTemp'],
+            epsilon)
+
+    def test_windows_match_join(self):
+        rng = random.Random(7)
+        pollutant_times = sorted(rng.sample(range(0, 20000), 300))
+        weather_times = sorted(rng.sample(range(0, 20000), 250))
+        epsilon = 60
+        (pairs, states) = _join_path(pollutant_times, weather_times, epsilon)
+        self.assertEqual(pairs, [(d['pm2_5'], d['outTemp']) for d in self.join(pollutant_times, weather_times, epsilon)])
+
+        synced = 0
+        for window_start in range(0, 18000, 337):
+            window_end = window_start + 2000
+            p_start = bisect.bisect_left(pollutant_times, window_start)
+            p_end = bisect.bisect_right(pollutant_times, window_end)
+            w_start = bisect.bisect_left(weather_times, window_start)
+            w_end = bisect.bisect_right(weather_times, window_end)
+            (window_pairs, p_synced) = _join_window(pollutant_times, weather_times,
+                p_start, p_end, w_start, w_end, epsilon, states)
+            if p_synced is not None:
+                synced += 1
+                window_pairs += [(p, w) for (p, w) in pairs if p >= p_synced and p < p_end and w < w_end]
+            expected = self.join(pollutant_times[p_start:p_end], weather_times[w_start:w_end], epsilon)
+            self.assertEqual(window_pairs, [(d['pm2_5'] + p_start, d['outTemp'] + w_start) for d in expected])
+        self.assertTrue(synced > 0)
+
+class TestNearestJoin(unittest.TestCase):
+    def test_nearest(self):
+        # one minute pollutant readings, five minute weather readings
+        pollutant_times = list(range(0, 900, 60))
+        weather_times = [0, 300, 600]
+        matches = _nearest_path(pollutant_times, weather_times, 0, len(pollutant_times), 0, len(weather_times), 300, False)
+        self.assertEqual(len(matches), len(pollutant_times))
+        self.assertEqual([match[0] for (p, match) in matches], [0, 0, 0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2])
+
+        # readings further than the tolerance are not matched
+        matches = _nearest_path(pollutant_times, weather_times, 0, len(pollutant_times), 0, len(weather_times), 60, False)
+        self.assertEqual([p for (p, match) in matches], [0, 1, 4, 5, 6, 9, 10, 11])
+
+        # nor are readings outside the window
+        matches = _nearest_path(pollutant_times, weather_times, 5, 10, 1, 2, 300, False)
+        self.assertEqual(matches, [(p, (1, 1, 0.0)) for p in range(5, 10)])
+
+    def test_interpolate(self):
+        weather_rows = [
+            {'dateTime': 0, 'weather_usUnits': weewx.METRIC, 'outTemp': 10.0, 'pressure': 1000.0},
+            {'dateTime': 300, 'weather_usUnits': weewx.METRIC, 'outTemp': 20.0, 'pressure': None},
+        ]
+        matches = _nearest_path([60, 240, 300], [0, 300], 0, 3, 0, 2, 300, True)
+        self.assertEqual(matches, [(0, (0, 1, 0.2)), (1, (0, 1, 0.8)), (2, (1, 1, 0.0))])
+
+        po = {'dateTime': 60, 'pm2_5': 12.0, 'outTemp': None}
+        _apply_weather(po, weather_rows, matches[0][1])
+        self.assertEqual(po, {'dateTime': 60, 'pm2_5': 12.0, 'weather_usUnits': weewx.METRIC, 'outTemp': 12.0, 'pressure': 1000.0})
+        po = {'dateTime': 240, 'pm2_5': 12.0}
+        _apply_weather(po, weather_rows, matches[1][1])
+        self.assertEqual((po['outTemp'], po['pressure']), (18.0, None))
+
+        # readings in different units are not interpolated
+        weather_rows[1]['weather_usUnits'] = weewx.US
+        po = {'dateTime': 60}
+        _apply_weather(po, weather_rows, matches[0][1])
+        self.assertEqual(po['outTemp'], 10.0)
+
+class TestBucketObservation(unittest.TestCase):
+    def test_means(self):
+        bucket = {'dateTime': 300, 'interval': 300, 'usUnits': weewx.US, 'weather_usUnits': weewx.METRIC,
+            'outTemp_mean': 10.5, 'pressure_mean': 1000.0,
+            'pm2_5_sum': 30.0, 'pm2_5_count': 4, 'pm10_0_sum': None, 'pm10_0_count': 0}
+        self.assertEqual(_bucket_observation(bucket, ['pm2_5', 'pm10_0']), {
+            'dateTime': 300, 'usUnits': weewx.US, 'weather_usUnits': weewx.METRIC,
+            'outTemp': 10.5, 'pressure': 1000.0, 'pm2_5': 7.5, 'pm10_0': None})
+
+class TestBudget(unittest.TestCase):
+    def test_calculation_order(self):
+        service = AqiService.__new__(AqiService)
+        service.aqi_standard = standards.get_standard('us_aqi', 300)
+        service.budget_priority = ['composite', 'pm10_0']
+        observation = dict([(pollutant, 1.0) for pollutant in service.aqi_standard.get_pollutants()])
+        order = service._get_calculation_order(observation)
+        self.assertEqual(order[:2], ['composite', 'pm10_0'])
+        self.assertEqual(sorted(order[2:]), sorted([p for p in observation if p != 'pm10_0']))
+
+        # the composite needs every pollutant
+        self.assertEqual(service._get_calculation_order({'pm2_5': 1.0, 'pm10_0': 1.0}), ['pm10_0', 'pm2_5'])
+
+    def test_past_deadline(self):
+        service = AqiService.__new__(AqiService)
+        service.aqi_standard = standards.get_standard('us_aqi', 300)
+        service.budget_priority = ['composite']
+        service.combines_aqis = True
+        service.timer = instrumentation.NullTimer()
+        service.metrics = metrics.service_metrics()
+        pollutants = service.aqi_standard.get_pollutants()
+        joined = [dict([('dateTime', 300 * i)] + [(pollutant, 1.0) for pollutant in pollutants]) for i in range(300)]
+        record = {}
+        deferred = service._calculate_aqis({'dateTime': 300 * 300}, record, joined,
+            service._get_calculation_order(joined[0]), time.time() - 1)
+
+        # the composite calculated every pollutant's AQI, none are left to defer
+        self.assertEqual(deferred, [])
+        self.assertTrue(record['aqi_composite'] is not None)
+        for pollutant in pollutants:
+            self.assertTrue('aqi_' + pollutant in record)
+
+    def test_flush(self):
+        service = AqiService.__new__(AqiService)
+        calls = []
+        def process_pending(deadline=None):
+            calls.append(('pending', deadline))
+            service.pending = []
+        def process_deferred(deadline=None):
+            calls.append(('deferred', deadline))
+            service.deferred = []
+        service._process_pending = process_pending
+        service._process_deferred = process_deferred
+        service.pending = []
+        service.deferred = []
+        service.flush()
+        self.assertEqual(calls, [])
+
+        # everything held back is processed, without a deadline
+        service.pending = [{'dateTime': 300, 'interval': 5}]
+        service.deferred = [({'dateTime': 0, 'interval': 5}, ['pm10_0'])]
+        service.flush()
+        self.assertEqual(calls, [('pending', None), ('deferred', None)])
+
+    def test_deferred_snapshot(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            service = AqiService.__new__(AqiService)
+            service.aqi_standard = standards.get_standard('us_aqi', 300)
+            service.timer = instrumentation.NullTimer()
+            service.category_rollup = None
+            service.quantile_rollup = None
+            service.aqi_dbm = weewx.manager.Manager.open_with_create(
+                {'database_name': ':memory:', 'driver': 'weedb.sqlite'}, schema=schema)
+            service.snapshot_file = os.path.join(tmpdir, 'aqi.json')
+            service.snapshot_time = None
+            record = {'dateTime': 600, 'usUnits': weewx.US, 'interval': 5, 'aqi_standard': service.aqi_standard.guid,
+                'aqi_composite': 60.0, 'aqi_composite_category': 1}
+            service.aqi_dbm.addRecord(record, log_success=False)
+            service._records_stored([record])
+            with open(service.snapshot_file) as f:
+                self.assertNotIn('pm2_5', json.load(f))
+
+            # a deferred AQI of an earlier record leaves the snapshot alone
+            service._records_updated(300, 300)
+            self.assertEqual(service.snapshot_time, 600)
+            # one of the snapshot's record replaces it
+            service.aqi_dbm.getSql('UPDATE archive SET aqi_pm2_5 = 60.0, aqi_pm2_5_category = 1 WHERE dateTime = 600')
+            service._records_updated(300, 600)
+            with open(service.snapshot_file) as f:
+                self.assertEqual(json.load(f)['pm2_5']['aqi'], 60.0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+class TestAqiSpanStats(unittest.TestCase):
+    def test_stats(self):
+        dbm = weewx.manager.Manager.open_with_create(
+            {'database_name': ':memory:', 'driver': 'weedb.sqlite'}, schema=schema)
+        dbm.addRecord([{'dateTime': 300 * i, 'usUnits': weewx.US, 'interval': 5, 'aqi_standard': 6,
+            'aqi_pm2_5': 40.0 + 10 * i, 'aqi_pm2_5_category': 0 if i < 3 else 1} for i in range(1, 5)], log_success=False)
+        cache = {}
+        stats = AqiSpanStats(dbm, standards.get_standard('us_nowcast', 300), 'pm2_5',
+            weeutil.weeutil.TimeSpan(300, 1200), cache)
+        self.assertEqual((stats.min, stats.max, stats.mean, stats.count), (60.0, 80.0, 70.0, 3))
+        self.assertEqual(stats.max_category['category'], 'Moderate')
+        self.assertEqual([(c['category'], c['count'], c['hours']) for c in stats.category_counts],
+            [('Good', 1, 5 / 60.0), ('Moderate', 2, 10 / 60.0)])
+        self.assertEqual(len(cache), 2)
+        with self.assertRaises(ValueError):
+            AqiSpanStats(dbm, None, 'pm2_5; DROP TABLE archive', None, cache)
+
+class TestCatchupInterpolate(unittest.TestCase):
+    def test_matches_reference(self):
+        # the windows of a batch mix the readings joined once with copies of
+        # those at their edges
+        from benchmarks import equivalence
+        self.assertEqual(equivalence.main(['--option', 'air_sensor.weather_join=interpolate',
+            '--candidate', 'catchup.enable=true', '--candidate', 'catchup.min_lag=0',
+            '--standards', 'user.aqi.us.NowCast', '--weather-source', 'archive',
+            '--span-days', '1.5', '--replay-days', '0.25']), 0)
+
+class TestWeatherDataBinding(unittest.TestCase):
+    def test_configured_binding(self):
+        # the weather archive is read through the data binding of
+        # [StdArchive], by the query pool and idle prefetch too
+        import shutil
+        import tempfile
+        from benchmarks import equivalence, synthetic
+        import user.aqi.service
+
+        workdir = tempfile.mkdtemp()
+        try:
+            end_time = 1609459200
+            config_dict = synthetic.make_config(workdir, 'user.aqi.us.NowCast', 300, 'archive')
+            synthetic.create_databases(config_dict, end_time - 86400, end_time, 60)
+            config_dict['DataBindings']['archive_binding'] = config_dict['DataBindings'].pop('wx_binding')
+            config_dict['StdArchive']['data_binding'] = 'archive_binding'
+            for option in ['prefetch.enable=true', 'idle_prefetch.enable=true']:
+                equivalence.set_option(config_dict, option)
+
+            engine = synthetic.Engine(config_dict)
+            try:
+                service = user.aqi.service.AqiService(engine, config_dict)
+                try:
+                    self.assertEqual(service._get_weather_data_binding(service.weather_dbm), 'archive_binding')
+                    for record in synthetic.gen_weather_records(end_time - 3600, end_time, 300):
+                        service.new_archive_record(weewx.Event(weewx.NEW_ARCHIVE_RECORD, record=record))
+                    self.assertEqual(len(equivalence.read_records(service.aqi_dbm)), 12)
+                finally:
+                    service.shutDown()
+            finally:
+                engine.db_binder.close()
+        finally:
+            shutil.rmtree(workdir)
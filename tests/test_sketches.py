@@ -0,0 +1,35 @@
+import random
+import unittest
+
+from bin.user.aqi.sketches import *
+
+class TestQuantileSketch(unittest.TestCase):
+    def test_quantile(self):
+        rng = random.Random(3)
+        values = [rng.uniform(0, 300) for _ in range(5000)] + [0] * 100
+        sketch = QuantileSketch()
+        for v in values:
+            sketch.add(v)
+        values.sort()
+        for q in [0.0, 0.5, 0.95, 0.98, 1.0]:
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), expected, delta=expected * DEFAULT_RELATIVE_ACCURACY + 1e-9)
+        self.assertEqual(sketch.quantile(0.0), 0)
+        self.assertEqual(sketch.quantile(1.0), values[-1])
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        with self.assertRaises(ValueError):
+            sketch.quantile(95)
+
+    def test_merge(self):
+        rng = random.Random(5)
+        whole = QuantileSketch()
+        parts = [QuantileSketch() for _ in range(3)]
+        for i in range(3000):
+            v = rng.expovariate(0.02)
+            whole.add(v)
+            parts[i % 3].add(v)
+        merged = QuantileSketch.from_json(parts[0].to_json())
+        merged.merge(parts[1]).merge(QuantileSketch.from_json(parts[2].to_json()))
+        self.assertEqual(merged.to_json(), whole.to_json())
+        with self.assertRaises(ValueError):
+            merged.merge(QuantileSketch(0.05))
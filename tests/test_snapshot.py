@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bin.user.aqi.snapshot import *
+from bin.user.aqi.us import NowCast
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_make_snapshot(self):
+        record = {'dateTime': 1600000000, 'interval': 5, 'aqi_standard': 6,
+            'aqi_pm2_5': 79.0, 'aqi_pm2_5_category': 1,
+            'aqi_pm10_0': None, 'aqi_pm10_0_category': None}
+        snapshot = make_snapshot(record, NowCast(300))
+        self.assertEqual(snapshot['dateTime'], 1600000000)
+        self.assertEqual(snapshot['pm2_5']['aqi'], 79.0)
+        self.assertEqual(snapshot['pm2_5']['index'], 1)
+        self.assertEqual(snapshot['pm2_5']['category'], 'Moderate')
+        self.assertNotIn('pm10_0', snapshot)
+        self.assertNotIn('composite', snapshot)
+
+    def test_reader(self):
+        path = os.path.join(self.tmpdir, 'aqi.json')
+        reader = SnapshotReader(path)
+        self.assertIsNone(reader.read())
+        write_snapshot(path, {'dateTime': 1})
+        self.assertEqual(reader.read(), {'dateTime': 1})
+        first = reader.read()
+        self.assertIs(reader.read(), first)
+        write_snapshot(path, {'dateTime': 1000})
+        self.assertEqual(reader.read(), {'dateTime': 1000})
+        self.assertIs(get_reader(path), get_reader(path))
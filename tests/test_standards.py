@@ -0,0 +1,50 @@
+import unittest
+
+import weewx.units
+
+from bin.user.aqi.standards import *
+from bin.user.aqi import units    # registers the pollutant unit conversions
+from bin.user.aqi import us
+
+class TestRegistry(unittest.TestCase):
+    def test_lookup(self):
+        self.assertIs(get_standard_class('user.aqi.us.NowCast'), us.NowCast)
+        self.assertIs(get_standard_class(US_NOWCAST_GUID), us.NowCast)
+        self.assertIs(get_standard_class('us_nowcast'), us.NowCast)
+        self.assertIs(get_standard_class('bin.user.aqi.us.AirQualityIndex'), us.AirQualityIndex)
+        with self.assertRaises(KeyError):
+            get_standard_class('nowcast')
+
+    def test_every_standard(self):
+        for (guid, module, class_name, short_name) in REGISTRY:
+            self.assertEqual(get_standard_name(guid), short_name)
+            self.assertEqual(get_standard(short_name, 300).guid, guid)
+        self.assertIsNone(get_standard_name(1000))
+
+    def test_units_are_known(self):
+        # readings are converted with weewx's conversions, so every unit a
+        # standard requires has to be one of weewx's unit names
+        for (guid, module, class_name, short_name) in REGISTRY:
+            for (pollutant, unit) in get_standard(short_name, 300).get_pollutants().items():
+                self.assertIn(unit, weewx.units.conversionDict, '%s %s' % (short_name, pollutant))
+
+    def test_instances_are_shared(self):
+        self.assertIs(get_standard('us_nowcast', 300), get_standard(US_NOWCAST_GUID, 300))
+        self.assertIsNot(get_standard('us_nowcast', 300), get_standard('us_nowcast', 60))
+
+class TestInterpretation(unittest.TestCase):
+    def test_interpret(self):
+        standard = us.NowCast(300)
+        self.assertEqual(standard.interpret_aqi_index(1), {'color': 'ffff00', 'category': 'Moderate', 'label': 'Moderate'})
+        self.assertIs(standard.interpret_aqi_index(1.0), standard.interpret_aqi_index(1))
+        self.assertEqual(standard.interpret_aqi_index(None)['color'], 'None')
+        with self.assertRaises(TypeError):
+            standard.interpret_aqi_index(1)['color'] = 'ff0000'
+        self.assertEqual([i['category'] for i in standard.interpret_aqi_indices([0, None, 1])], ['Good', 'None', 'Moderate'])
+
+class TestCombineAqis(unittest.TestCase):
+    def test_max(self):
+        standard = us.NowCast(300)
+        self.assertEqual(standard.combine_aqis([(40, 0), (75, 1), (75, 2), (10, 0)]), (75, 1))
+        with self.assertRaises(TypeError):
+            standard.combine_aqis([(40, 0), (None, None)])
@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from bin.user.aqi.calculators import *
@@ -70,8 +71,41 @@ class TestUnits(unittest.TestCase):
             actual = convert_pollutant_units(tc['pollutant'], tc['ppb'], 'part_per_billion', 'microgram_per_meter_cubed', tc['temp_in_k'], tc['pres_in_kpa'])
             self.assertAlmostEqual(actual, tc['ugm3'], num_decimals(tc['ugm3']))
 
-            actual = convert_pollutant_units(tc['pollutant'], tc['ppb'] * 1000, 'part_per_million', 'microgram_per_meter_cubed', tc['temp_in_k'], tc['pres_in_kpa'])
+            actual = convert_pollutant_units(tc['pollutant'], tc['ppb'] / 1000.0, 'part_per_million', 'microgram_per_meter_cubed', tc['temp_in_k'], tc['pres_in_kpa'])
             self.assertAlmostEqual(actual, tc['ugm3'], num_decimals(tc['ugm3']))
 
-            actual = convert_pollutant_units(tc['pollutant'], tc['ppb'] * 1000, 'part_per_million', 'milligram_per_meter_cubed', tc['temp_in_k'], tc['pres_in_kpa'])
+            actual = convert_pollutant_units(tc['pollutant'], tc['ppb'] / 1000.0, 'part_per_million', 'milligram_per_meter_cubed', tc['temp_in_k'], tc['pres_in_kpa'])
             self.assertAlmostEqual(actual, tc['ugm3'] / 1000.0, num_decimals(tc['ugm3']))
+
+            actual = convert_pollutant_units(tc['pollutant'], tc['ugm3'], 'microgram_per_meter_cubed', 'part_per_billion', tc['temp_in_k'], tc['pres_in_kpa'])
+            self.assertAlmostEqual(actual, tc['ppb'], num_decimals(tc['ugm3']))
+
+    def test_ppb_ppm_conversions(self):
+        self.assertEqual(convert_pollutant_units(CO, 1500, 'part_per_billion', 'part_per_million', None, None), 1.5)
+        self.assertEqual(convert_pollutant_units(CO, 1.5, 'part_per_million', 'part_per_billion', None, None), 1500)
+
+class TestColumnConversions(unittest.TestCase):
+    def test_matches_scalar(self):
+        rng = random.Random(11)
+        n = 500
+        values = [None if rng.random() < 0.05 else rng.random() * 500 for i in range(n)]
+        temps = [None if rng.random() < 0.05 else 250 + rng.random() * 60 for i in range(n)]
+        pressures = [None if rng.random() < 0.05 else 90 + rng.random() * 15 for i in range(n)]
+        conversions = [
+            ('part_per_billion', 'microgram_per_meter_cubed'),
+            ('part_per_million', 'microgram_per_meter_cubed'),
+            ('part_per_billion', 'milligram_per_meter_cubed'),
+            ('microgram_per_meter_cubed', 'part_per_billion'),
+            ('milligram_per_meter_cubed', 'part_per_million'),
+            ('part_per_million', 'part_per_billion'),
+            ('part_per_billion', 'part_per_billion'),
+        ]
+        for pollutant in [CO, NO2, SO2, O3, NH3]:
+            for (obs_unit, required_unit) in conversions:
+                expected = []
+                for (value, temp, pressure) in zip(values, temps, pressures):
+                    try:
+                        expected.append(convert_pollutant_units(pollutant, value, obs_unit, required_unit, temp, pressure))
+                    except TypeError:
+                        expected.append(None)
+                self.assertEqual(convert_pollutant_units_column(pollutant, values, obs_unit, required_unit, temps, pressures), expected)
@@ -0,0 +1,62 @@
+import unittest
+
+from bin.user.aqi.us import *
+from bin.user.aqi import units
+
+def make_observations(hourly_so2, obs_frequency_in_sec):
+    '''Returns a day of observations. hourly_so2 is the reading for each hour,
+    with the most recent hour last.'''
+    obs = []
+    for (hour, so2) in enumerate(hourly_so2):
+        for i in range(int(calculators.HOUR / obs_frequency_in_sec)):
+            obs.append({
+                'dateTime': hour * calculators.HOUR + (i + 1) * obs_frequency_in_sec,
+                calculators.SO2: so2,
+            })
+    return obs
+
+class TestAirQualityIndex(unittest.TestCase):
+    def test_so2_tables(self):
+        obs_frequency_in_sec = 300
+        aqi = AirQualityIndex(obs_frequency_in_sec)
+
+        # 1 hour table
+        obs = make_observations([10] * 24, obs_frequency_in_sec)
+        self.assertEqual(aqi.calculate_aqi(calculators.SO2, 'part_per_billion', obs), (14, 0))
+
+        # 24 hour table
+        obs = make_observations([400] * 24, obs_frequency_in_sec)
+        self.assertEqual(aqi.calculate_aqi(calculators.SO2, 'part_per_billion', obs), (232, 4))
+
+    def test_co_from_ppb(self):
+        # readings in ppb are converted to the ppm of the CO table
+        obs_frequency_in_sec = 300
+        aqi = AirQualityIndex(obs_frequency_in_sec)
+        co = units.convert_pollutant_units(calculators.CO, 5000, 'part_per_billion', 'part_per_million', None, None)
+        self.assertEqual(co, 5.0)
+        obs = [{'dateTime': (i + 1) * obs_frequency_in_sec, calculators.CO: co} for i in range(96)]
+        self.assertEqual(aqi.calculate_aqi(calculators.CO, 'part_per_million', obs), (56, 1))
+
+    def test_no2_from_ugm3(self):
+        # readings in ug/m3 are converted to the ppb of the NO2 table
+        obs_frequency_in_sec = 300
+        aqi = AirQualityIndex(obs_frequency_in_sec)
+        no2 = units.convert_pollutant_units(calculators.NO2, 150, 'microgram_per_meter_cubed', 'part_per_billion', 298.15, 101.325)
+        self.assertEqual(no2, 79.77)
+        obs = [{'dateTime': (i + 1) * obs_frequency_in_sec, calculators.NO2: no2} for i in range(12)]
+        self.assertEqual(aqi.calculate_aqi(calculators.NO2, 'part_per_billion', obs), (78, 1))
+
+    def test_so2_hole(self):
+        # the last hour is above the 1 hour table, but the day is below the
+        # 24 hour table, so the AQI is fixed at 200.
+        obs_frequency_in_sec = 300
+        aqi = AirQualityIndex(obs_frequency_in_sec)
+        obs = make_observations([10] * 23 + [320], obs_frequency_in_sec)
+        self.assertEqual(aqi.calculate_aqi(calculators.SO2, 'part_per_billion', obs), (200, 3))
+
+        # once the day is on the 24 hour table, the last hour is not used
+        obs = make_observations([310] * 23 + [600], obs_frequency_in_sec)
+        self.assertEqual(aqi.calculate_aqi(calculators.SO2, 'part_per_billion', obs), (207, 4))
+
+        # other failures are still reported
+        self.assertRaises(ValueError, aqi.calculate_aqi, calculators.SO2, 'part_per_billion', obs[-3:])